@@ -1,13 +1,49 @@
 from django.contrib import admin
-from .models import Expense, Category
+from .models import Expense, Category, CategoryRule, ExportJob, RecurringExpense
+from .search import amount_range
 # Register your models here.
 
 
 class ExpenseAdmin(admin.ModelAdmin):
     list_display = ('category', 'description', 'amount', 'date', 'owner' )
-    search_fields = ('category', 'description', 'amount', 'date', 'owner' )
+    search_fields = ('category__name', 'description', 'date', 'owner__username' )
+    list_select_related = ('category', 'owner')
 
     list_per_page = 5
+
+    def get_search_results(self, request, queryset, search_term):
+        # Amounts are stored in cents, so a typed amount is matched as a range rather than as text
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        amounts = amount_range(search_term.strip())
+        if amounts:
+            low, high = amounts
+            matches = queryset.filter(amount__gte=low)
+            results |= matches.filter(amount__lt=high) if high is not None else matches
+        return results, may_have_duplicates
     
 admin.site.register(Expense, ExpenseAdmin)
-admin.site.register(Category)
\ No newline at end of file
+admin.site.register(Category)
+
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('owner', 'ledger', 'format', 'status', 'created_at', 'expires_at')
+    list_filter = ('status', 'ledger', 'format')
+    list_select_related = ('owner',)
+
+admin.site.register(ExportJob, ExportJobAdmin)
+
+
+class RecurringExpenseAdmin(admin.ModelAdmin):
+    list_display = ('description', 'amount', 'category', 'rule', 'next_date', 'active', 'owner')
+    list_filter = ('active',)
+    list_select_related = ('category', 'owner')
+
+admin.site.register(RecurringExpense, RecurringExpenseAdmin)
+
+
+class CategoryRuleAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'pattern', 'category', 'min_amount', 'max_amount', 'priority', 'owner')
+    list_filter = ('kind',)
+    list_select_related = ('category', 'owner')
+
+admin.site.register(CategoryRule, CategoryRuleAdmin)
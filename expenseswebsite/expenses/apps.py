@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ExpensesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'expenses'
+
+    def ready(self):
+        from .cache import connect_data_version
+        from .models import Expense, ExpenseMonthlyRollup
+        from .rollups import connect_rollup
+
+        connect_rollup(Expense, ExpenseMonthlyRollup, 'category')
+        connect_data_version(Expense)
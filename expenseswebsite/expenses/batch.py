@@ -0,0 +1,182 @@
+"""
+Batches of create, update and delete operations on one ledger, applied at once.
+
+A batch is validated as a whole first; if any operation is invalid nothing is
+written. Otherwise creates go through one ``bulk_create``, updates through one
+``bulk_update`` of the changed columns and deletes through one filtered
+``delete()``, all in a single transaction. The rows a batch updates or deletes
+are locked from the moment they are read, so concurrent batches cannot
+interleave their changes. Creates and updates bypass the model signals, so their rollup
+changes are applied per (label, month) here; deletes still send them.
+"""
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .cache import bump_data_version
+from .imports import IMPORT_LEDGERS, amount_error
+from .rollups import apply_rollup_delta, month_start
+
+# Most operations accepted in one batch
+BATCH_MAX_OPERATIONS = getattr(settings, 'BATCH_MAX_OPERATIONS', 500)
+
+BATCH_OPERATIONS = ('create', 'update', 'delete')
+
+
+class InvalidBatch(ValueError):
+    """
+    Raised when a batch is not a list of operations.
+    """
+
+
+def clean_fields(operation, ledger_model, label_model, label_field, partial):
+    """
+    Validate the ledger fields of one operation.
+
+    Returns:
+    - tuple: ``(values, errors)``; ``values`` maps model attributes to clean
+      values and ``errors`` field names to messages.
+    """
+    values, errors = {}, {}
+    label_name = label_field.capitalize()
+
+    if 'amount' in operation or not partial:
+        try:
+            amount = ledger_model._meta.get_field('amount').to_python(operation.get('amount'))
+        except ValidationError as error:
+            errors['amount'] = amount_error(error)
+        else:
+            if amount is None:
+                errors['amount'] = 'Amount is required'
+            else:
+                values['amount'] = amount
+
+    if 'description' in operation or not partial:
+        description = operation.get('description')
+        if not isinstance(description, str) or not description.strip():
+            errors['description'] = 'Description is required'
+        else:
+            values['description'] = description
+
+    if label_field in operation or not partial:
+        label_id = operation.get(label_field)
+        if isinstance(label_id, bool) or not isinstance(label_id, int):
+            errors[label_field] = '{} is required'.format(label_name)
+        else:
+            values['{}_id'.format(label_field)] = label_id
+
+    if 'date' in operation or not partial:
+        try:
+            values['date'] = date.fromisoformat(operation.get('date'))
+        except (TypeError, ValueError):
+            errors['date'] = 'Invalid date format! The date must be in YYYY-MM-DD format.'
+
+    return values, errors
+
+
+def apply_batch(owner, ledger, operations):
+    """
+    Apply a batch of operations to ``owner``'s ``ledger`` (``'expense'`` or ``'income'``).
+
+    Each operation is a dict with ``op`` (create, update or delete); updates
+    and deletes name the row by ``id``; creates give ``amount``,
+    ``description``, ``date`` and the label id, and updates any of them.
+
+    Returns:
+    - tuple: ``(applied, results)``; ``results`` has one dict per operation,
+      in order, with its ``status`` and ``id``, or its ``errors``.
+
+    Raises:
+    - InvalidBatch: If ``operations`` is not a list of at most ``BATCH_MAX_OPERATIONS`` objects.
+    """
+    if not isinstance(operations, list) or not all(isinstance(item, dict) for item in operations):
+        raise InvalidBatch('operations must be a list of objects')
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise InvalidBatch('A batch holds at most {} operations'.format(BATCH_MAX_OPERATIONS))
+
+    model, label_model, rollup_model, label_field = IMPORT_LEDGERS[ledger]
+    label = '{}_id'.format(label_field)
+
+    ids = [item.get('id') for item in operations if item.get('op') in ('update', 'delete')]
+    labels = {item.get(label_field) for item in operations if isinstance(item.get(label_field), int)}
+    known_labels = set(label_model.objects.filter(pk__in=labels).values_list('pk', flat=True))
+
+    with transaction.atomic():
+        # Locked in primary key order, so that overlapping batches wait for each other instead of deadlocking
+        rows = (model.objects.select_for_update().filter(owner=owner, pk__in=[pk for pk in ids if isinstance(pk, int)])
+                .order_by('pk').in_bulk())
+
+        results, creates, updates, deletes = [], [], [], []
+        seen = set()
+        for item in operations:
+            op = item.get('op')
+            if op not in BATCH_OPERATIONS:
+                message = 'op must be one of: {}'.format(', '.join(BATCH_OPERATIONS))
+                results.append({'status': 'error', 'errors': {'op': message}})
+                continue
+            if op != 'create':
+                pk = item.get('id')
+                if not isinstance(pk, int) or pk not in rows:
+                    results.append({'status': 'error', 'id': pk, 'errors': {'id': 'No such {}'.format(ledger)}})
+                    continue
+                if pk in seen:
+                    results.append({'status': 'error', 'id': pk, 'errors': {'id': 'Appears twice in the batch'}})
+                    continue
+                seen.add(pk)
+            if op == 'delete':
+                deletes.append(rows[pk])
+                results.append({'status': 'deleted', 'id': pk})
+                continue
+
+            values, errors = clean_fields(item, model, label_model, label_field, partial=op == 'update')
+            if label in values and values[label] not in known_labels:
+                errors[label_field] = 'No such {}'.format(label_field)
+            if errors:
+                results.append({'status': 'error', 'id': item.get('id'), 'errors': errors})
+            elif op == 'create':
+                creates.append((len(results), model(owner=owner, **values)))
+                results.append({'status': 'created'})
+            else:
+                updates.append((rows[pk], values))
+                results.append({'status': 'updated', 'id': pk})
+
+        if any(result['status'] == 'error' for result in results):
+            return False, results
+
+        deltas = defaultdict(lambda: [0, 0])
+
+        def count(row, sign):
+            delta = deltas[getattr(row, label), month_start(row.date)]
+            delta[0] += sign * row.amount
+            delta[1] += sign
+
+        changed_rows, changed_fields = [], set()
+        for row, values in updates:
+            changed = {name for name, value in values.items() if getattr(row, name) != value}
+            if not changed:
+                continue
+            count(row, -1)
+            for name in changed:
+                setattr(row, name, values[name])
+            count(row, 1)
+            changed_rows.append(row)
+            changed_fields |= changed
+        for _, row in creates:
+            count(row, 1)
+
+        created = model.objects.bulk_create([row for _, row in creates])
+        for (position, _), row in zip(creates, created):
+            results[position]['id'] = row.pk
+        if changed_rows:
+            model.objects.bulk_update(changed_rows, sorted(changed_fields))
+        for (label_id, month), (total, number) in deltas.items():
+            if number or total:
+                apply_rollup_delta(rollup_model, label_field, owner.pk, label_id, month, total, number)
+        if deletes:
+            # Sends post_delete per row, which keeps the rollups and data version current
+            model.objects.filter(owner=owner, pk__in=[row.pk for row in deletes]).delete()
+        transaction.on_commit(lambda: bump_data_version(owner.pk))
+    return True, results
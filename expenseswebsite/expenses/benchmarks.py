@@ -0,0 +1,242 @@
+"""
+Benchmarks of the main views, driven through the Django test client.
+
+``manage.py benchmark`` seeds a synthetic dataset (see ``expenses.synthetic``)
+into a throwaway test database and requests every view of
+``BENCHMARK_VIEWS`` as one of the seeded users. Per view it records the p50,
+p95 and p99 latency of the timed requests, then makes one more request under
+tracemalloc for the SQL query count and the peak memory. Latencies include
+reading the whole response, so streamed exports are measured end to end.
+
+The seeded usernames record the dataset's parameters, so a test database
+kept between runs is refused when they change rather than silently reused.
+Unless ``--cold``, repeated requests are served from the warm caches, which
+for the export views means the cached rendered files.
+
+Results are JSON. Compared with a stored baseline, a view regresses when a
+latency percentile or its peak memory grows by more than the threshold, or
+when it makes more queries.
+"""
+import json
+import math
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from .cache import bump_data_version
+from .synthetic import generate_ledgers
+
+# Timed requests per view, after the warm-up ones
+BENCHMARK_REPEAT = getattr(settings, 'BENCHMARK_REPEAT', 20)
+BENCHMARK_WARMUP = getattr(settings, 'BENCHMARK_WARMUP', 2)
+
+# Relative growth over the baseline reported as a regression
+BENCHMARK_THRESHOLD = getattr(settings, 'BENCHMARK_THRESHOLD', 0.2)
+
+# Latency growth below this many milliseconds is noise, whatever the ratio
+BENCHMARK_MIN_DELTA_MS = getattr(settings, 'BENCHMARK_MIN_DELTA_MS', 1.0)
+
+# The seeded rows span these dates; the summaries are asked for the whole span
+BENCHMARK_START = date(2022, 1, 1)
+BENCHMARK_DAYS = 730
+BENCHMARK_SUMMARY_WINDOW = {'start': '2022-01-01', 'end': '2023-12-31'}
+
+BENCHMARK_PERCENTILES = (50, 95, 99)
+
+# Seeded users are named <prefix>-u<users>-r<rows>-s<seed>-<number>
+BENCHMARK_PREFIX = 'bench'
+
+# name, method, URL name, GET parameters or JSON body
+BENCHMARK_VIEWS = [
+    ('index', 'GET', 'expenses', None),
+    ('income_index', 'GET', 'income', None),
+    ('search_expenses', 'POST', 'search_expenses', {'searchText': 'coffee'}),
+    ('search_income', 'POST', 'search_income', {'searchText': 'salary'}),
+    ('expense_category_summary', 'GET', 'expense_category_summary', BENCHMARK_SUMMARY_WINDOW),
+    ('income_source_summary', 'GET', 'income_source_summary', BENCHMARK_SUMMARY_WINDOW),
+    ('export_csv', 'GET', 'export_csv', None),
+    ('export_excel', 'GET', 'export_excel', None),
+    ('export_pdf', 'GET', 'export_pdf', None),
+    ('income_export_csv', 'GET', 'income_export_csv', None),
+    ('income_export_excel', 'GET', 'income_export_excel', None),
+    ('income_export_pdf', 'GET', 'income_export_pdf', None),
+    ('export_columnar', 'GET', 'export_columnar', None),
+    ('income_export_columnar', 'GET', 'income_export_columnar', None),
+    ('export_combined', 'GET', 'export_combined', None),
+    ('validate_username', 'POST', 'validate-username', {'username': 'nosuchuser'}),
+    ('validate_email', 'POST', 'validate_email', {'email': 'nobody@example.com'}),
+]
+
+
+def percentile(values, p):
+    """
+    Return the ``p``-th percentile of ``values`` by the nearest-rank method.
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def request_view(client, method, url, payload):
+    """
+    Request one view and read the whole response.
+
+    Returns:
+    - tuple: ``(status, bytes read)``.
+    """
+    if method == 'POST':
+        response = client.post(url, json.dumps(payload or {}), content_type='application/json')
+    else:
+        response = client.get(url, payload or {})
+    size = sum(len(chunk) for chunk in response.streaming_content) if response.streaming else len(response.content)
+    response.close()
+    return response.status_code, size
+
+
+def measure_view(client, method, url, payload, repeat=None, warmup=None, before=None):
+    """
+    Benchmark one view.
+
+    Parameters:
+    - before: Optional callable run before every request, e.g. to empty the caches.
+
+    Returns:
+    - dict: ``status``, ``bytes``, ``p50_ms``/``p95_ms``/``p99_ms``, ``queries`` and ``peak_kib``.
+    """
+    repeat = repeat or BENCHMARK_REPEAT
+    warmup = BENCHMARK_WARMUP if warmup is None else warmup
+    before = before or (lambda: None)
+
+    for _ in range(warmup):
+        before()
+        request_view(client, method, url, payload)
+
+    timings = []
+    for _ in range(repeat):
+        before()
+        started = time.perf_counter()
+        status, size = request_view(client, method, url, payload)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    # Tracing slows every allocation down, so memory and queries are measured on a separate request
+    before()
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            request_view(client, method, url, payload)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = {'status': status, 'bytes': size}
+    for p in BENCHMARK_PERCENTILES:
+        result['p{}_ms'.format(p)] = round(percentile(timings, p), 3)
+    result.update(queries=len(queries), peak_kib=round(peak / 1024, 1))
+    return result
+
+
+def run_benchmarks(client, names=None, repeat=None, warmup=None, before=None):
+    """
+    Benchmark the views of ``BENCHMARK_VIEWS`` (or only those in ``names``) in order.
+
+    Returns:
+    - dict: The ``measure_view`` result of each view, by name.
+    """
+    results = {}
+    for name, method, url_name, payload in BENCHMARK_VIEWS:
+        if names is None or name in names:
+            results[name] = measure_view(client, method, reverse(url_name), payload, repeat, warmup, before)
+    return results
+
+
+def compare(results, baseline, threshold=None):
+    """
+    Compare benchmark ``results`` with a ``baseline`` of the same shape.
+
+    Returns:
+    - list: One message per regression; views missing from either side are skipped.
+    """
+    threshold = BENCHMARK_THRESHOLD if threshold is None else threshold
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for p in BENCHMARK_PERCENTILES:
+            key = 'p{}_ms'.format(p)
+            old, new = before.get(key), result[key]
+            if old is not None and new > old * (1 + threshold) and new - old > BENCHMARK_MIN_DELTA_MS:
+                regressions.append('{}: {} {:.1f} ms -> {:.1f} ms'.format(name, key, old, new))
+        if before.get('queries') is not None and result['queries'] > before['queries']:
+            regressions.append('{}: {} -> {} queries'.format(name, before['queries'], result['queries']))
+        old = before.get('peak_kib')
+        if old is not None and result['peak_kib'] > old * (1 + threshold):
+            regressions.append('{}: peak memory {:.0f} KiB -> {:.0f} KiB'.format(name, old, result['peak_kib']))
+    return regressions
+
+
+def dataset_prefix(users, rows, seed):
+    """
+    Return the username prefix of the benchmark dataset seeded with these parameters.
+    """
+    return '{}-u{}-r{}-s{}-'.format(BENCHMARK_PREFIX, users, rows, seed)
+
+
+def benchmark_user(users, rows, seed):
+    """
+    Return the first user of the benchmark dataset, or ``None`` if the
+    database does not hold all of it.
+    """
+    dataset = User.objects.filter(username__startswith=dataset_prefix(users, rows, seed))
+    if dataset.count() != users:
+        return None
+    return dataset.order_by('username').first()
+
+
+def seed_dataset(users, rows, seed):
+    """
+    Seed the benchmark dataset.
+
+    Returns:
+    - User: The first seeded user.
+
+    Raises:
+    - ValueError: If the database holds another benchmark dataset, e.g. kept
+      from a run with other parameters or cut short while seeding.
+    """
+    if User.objects.filter(username__startswith=BENCHMARK_PREFIX).exists():
+        raise ValueError('The database holds a benchmark dataset seeded with other parameters')
+    generate_ledgers(users, rows, max(rows // 20, 1), BENCHMARK_START, BENCHMARK_DAYS, seed=seed,
+                     prefix=dataset_prefix(users, rows, seed))
+    return benchmark_user(users, rows, seed)
+
+
+def cold_caches(user_id):
+    """
+    Return a ``before`` callable that makes every request miss the ledger caches.
+    """
+    return lambda: bump_data_version(user_id)
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    """
+    Run the block against a test database, as the test runner does, and
+    destroy it afterwards unless ``keepdb``.
+    """
+    old_name = connection.settings_dict['NAME']
+    setup_test_environment()
+    try:
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+    finally:
+        teardown_test_environment()
@@ -0,0 +1,210 @@
+"""
+Per-user cache of ledger-derived responses, invalidated by a data version.
+
+Every cached value is keyed by its owner's current data version. Any change to
+the owner's expenses or income bumps the version, which makes all of their
+cached entries unreachable at once; stale entries simply expire. The versions
+are stored in the database, so a change made by any web worker or management
+command is seen by all of them, whatever the cache backend: with the default
+local-memory cache every process just keeps its own copies of the values.
+"""
+import hashlib
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime
+from datetime import timezone as dt_timezone
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import BigIntegerField, F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+LEDGER_CACHE_ALIAS = getattr(settings, 'LEDGER_CACHE_ALIAS', 'default')
+LEDGER_CACHE_TIMEOUT = getattr(settings, 'LEDGER_CACHE_TIMEOUT', 60 * 60)
+
+# Rendered exports larger than this are not kept in the cache
+LEDGER_ARTIFACT_MAX_BYTES = getattr(settings, 'LEDGER_ARTIFACT_MAX_BYTES', 5 * 1024 * 1024)
+
+# Sent after every lookup with ``name`` (the kind of value) and ``hit`` (bool)
+ledger_cache_lookup = Signal()
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[LEDGER_CACHE_ALIAS]
+
+
+def _versions():
+    # Imported here because the models module imports this one
+    from .models import DataVersion
+
+    return DataVersion.objects
+
+
+def data_version(user_id):
+    """
+    Return the current data version of a user, 0 until their data first changes.
+    """
+    return _versions().filter(owner_id=user_id).values_list('version', flat=True).first() or 0
+
+
+def bump_data_version(user_id):
+    """
+    Invalidate every cached value of a user.
+
+    The new version is the current time in nanoseconds (or the old version
+    plus one should the clock lag), so it doubles as the last-modified time of
+    the user's data. It is computed by the database in one ``UPDATE``, so
+    concurrent bumps never lose one another. A user deleted in the meantime,
+    e.g. by the cascade whose row deletes queued the bump, is skipped.
+    """
+    versions = _versions().filter(owner_id=user_id)
+    bumped = {'version': Greatest(F('version') + 1, Value(time.time_ns(), output_field=BigIntegerField()))}
+    if not versions.update(**bumped):
+        if not User.objects.filter(pk=user_id).exists():
+            return
+        _, created = _versions().get_or_create(owner_id=user_id, defaults={'version': time.time_ns()})
+        if not created:
+            versions.update(**bumped)
+
+
+def data_last_modified(user_id):
+    """
+    Return when the user's data last changed (the epoch if it never did).
+    """
+    return datetime.fromtimestamp(data_version(user_id) / 1e9, tz=dt_timezone.utc)
+
+
+def _versioned_key(user_id, name, parts):
+    digest = hashlib.md5(repr(list(parts)).encode()).hexdigest()
+    return 'ledger:{}:{}:{}:{}'.format(user_id, data_version(user_id), name, digest)
+
+
+def _record_lookup(name, hit):
+    with _stats_lock:
+        _stats[name, hit] += 1
+    ledger_cache_lookup.send(sender=None, name=name, hit=hit)
+
+
+def cached_for_user(user_id, name, parts, compute):
+    """
+    Return the cached value for ``(name, parts)`` at the user's current data
+    version, computing and storing it on a miss.
+
+    Parameters:
+    - user_id: The owner of the data the value is derived from.
+    - name: The kind of value, e.g. ``'expense-summary'``.
+    - parts: Anything else the value depends on (request parameters); must have a stable ``repr``.
+    - compute: A callable returning the (picklable) value.
+    """
+    key = _versioned_key(user_id, name, parts)
+    cache = _cache()
+    value = cache.get(key)
+    hit = value is not None
+    if not hit:
+        value = compute()
+        cache.set(key, value, LEDGER_CACHE_TIMEOUT)
+    _record_lookup(name, hit)
+    return value
+
+
+def cached_artifact(user_id, name, parts, render):
+    """
+    Return a binary file holding the artifact for ``(name, parts)`` at the
+    user's current data version, rendering it on a miss.
+
+    ``render(output)`` writes the artifact to a binary file. Artifacts up to
+    ``LEDGER_ARTIFACT_MAX_BYTES`` are rendered in memory and kept in the cache,
+    so an unchanged ledger is never rendered twice. Larger ones spill over to a
+    temporary file, are served from it in blocks and rendered every time.
+    """
+    key = _versioned_key(user_id, name, parts)
+    cache = _cache()
+    content = cache.get(key)
+    _record_lookup(name, content is not None)
+    if content is not None:
+        return BytesIO(content)
+
+    output = tempfile.SpooledTemporaryFile(max_size=LEDGER_ARTIFACT_MAX_BYTES)
+    try:
+        render(output)
+    except BaseException:
+        output.close()
+        raise
+    if output.seek(0, 2) > LEDGER_ARTIFACT_MAX_BYTES:
+        output.seek(0)
+        return output
+    # Still in memory, so this is the only copy made for the cache
+    output.seek(0)
+    content = output.read()
+    output.close()
+    cache.set(key, content, LEDGER_CACHE_TIMEOUT)
+    return BytesIO(content)
+
+
+def ledger_etag(request, *args, **kwargs):
+    # Weak: re-rendered artifacts of unchanged data are equivalent, not byte-identical.
+    # The date is part of it because summaries default to a window ending today.
+    return 'W/"{}-{}"'.format(data_version(request.user.pk), date.today().isoformat())
+
+
+def ledger_last_modified(request, *args, **kwargs):
+    midnight = timezone.make_aware(datetime.combine(date.today(), datetime.min.time()))
+    return max(data_last_modified(request.user.pk), midnight)
+
+
+def conditional_on_ledger(view):
+    """
+    Answer conditional GETs of ``view`` from the user's data version: a client
+    whose copy is current gets a 304 without the view running. Responses must
+    be revalidated on every use and are not stored by shared caches.
+    """
+    view = condition(etag_func=ledger_etag, last_modified_func=ledger_last_modified)(view)
+    return cache_control(private=True, no_cache=True)(view)
+
+
+def cache_stats():
+    """
+    Return the hits, misses and hit rate of each kind of value since start-up.
+    """
+    with _stats_lock:
+        names = {name for name, _ in _stats}
+        stats = {name: {'hits': _stats[name, True], 'misses': _stats[name, False]} for name in names}
+    for counts in stats.values():
+        counts['hit_rate'] = counts['hits'] / (counts['hits'] + counts['misses'])
+    return stats
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def connect_data_version(ledger_model):
+    """
+    Bump the owner's data version whenever a ``ledger_model`` row is saved or deleted.
+
+    Bulk writes bypass these signals and must call ``bump_data_version`` themselves.
+    """
+    def bump(sender, instance, raw=False, **kwargs):
+        if raw:
+            return
+        owner_id = instance.owner_id
+        # After commit, so no request can cache pre-commit data under the new version
+        transaction.on_commit(lambda: bump_data_version(owner_id))
+
+    uid = 'data-version-{}'.format(ledger_model._meta.label_lower)
+    post_save.connect(bump, sender=ledger_model, weak=False, dispatch_uid=uid)
+    post_delete.connect(bump, sender=ledger_model, weak=False, dispatch_uid=uid)
@@ -0,0 +1,226 @@
+"""
+Rule-based categorization of expenses and income.
+
+A rule picks the category (expenses) or source (income) of a transaction whose
+description contains a keyword or matches a regular expression, optionally
+only for amounts within a range; a rule without a pattern matches on the
+amount alone. Rules without an owner apply to every user. An owner's own rules
+win over the global ones, then the lower ``priority``, then the older rule.
+
+All keyword rules of a rule set are compiled into one matcher, so every
+description is scanned once however many keywords there are: an Aho-Corasick
+automaton when pyahocorasick is installed, otherwise one regular expression
+whose alternation is factored into a trie. Keywords are matched anywhere in the
+description, ignoring case. Regular expression rules are tried afterwards, and
+only those that could still beat the best keyword match.
+"""
+import importlib.util
+import re
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .cache import bump_data_version
+from .rollups import rebuild_rollups
+
+# Rows read and updated per query by ``recategorize``
+CATEGORIZE_BATCH_SIZE = getattr(settings, 'CATEGORIZE_BATCH_SIZE', 5000)
+
+_ahocorasick_available = importlib.util.find_spec('ahocorasick') is not None
+
+# rank orders rules by precedence; regex is None for keyword and amount-only rules
+Rule = namedtuple('Rule', 'rank label_id min_amount max_amount regex')
+
+
+def trie_regex(words):
+    """
+    Return a pattern matching any of ``words``, with the alternation factored
+    into a trie so the regex engine tries each character once per position.
+    Longer words are preferred over their prefixes.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def alternation(node):
+        branches = [re.escape(char) + alternation(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        group = branches[0] if len(branches) == 1 else '(?:{})'.format('|'.join(branches))
+        return '(?:{})?'.format(group) if '' in node else group
+
+    return alternation(trie)
+
+
+class RuleSet:
+    """
+    The compiled rules of one owner (and the global rules) for one ledger.
+    """
+
+    def __init__(self, rules, label_field):
+        """
+        ``rules`` are dicts of the rule fields, as ``rule_values`` returns them.
+        """
+        label = '{}_id'.format(label_field)
+        self.keywords = defaultdict(list)
+        self.others = []
+        for values in rules:
+            rank = (values['owner_id'] is None, values['priority'], values['id'])
+            pattern = values['pattern'].strip()
+            regex = None
+            if pattern and values['kind'] == 'regex':
+                try:
+                    regex = re.compile(pattern, re.IGNORECASE)
+                except re.error:
+                    # Saved around the model validation; such a rule never matches
+                    continue
+            rule = Rule(rank, values[label], values['min_amount'], values['max_amount'], regex)
+            if pattern and values['kind'] != 'regex':
+                self.keywords[pattern.casefold()].append(rule)
+            else:
+                self.others.append(rule)
+
+        for candidates in self.keywords.values():
+            candidates.sort()
+        self.others.sort()
+        self.automaton = self.regex = None
+        if self.keywords and _ahocorasick_available:
+            import ahocorasick
+
+            self.automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self.automaton.add_word(keyword, keyword)
+            self.automaton.make_automaton()
+        elif self.keywords:
+            # A lookahead reports overlapping matches too. It finds the longest keyword at each position,
+            # so the keywords that are prefixes of it are looked up here
+            self.regex = re.compile('(?=({}))'.format(trie_regex(self.keywords)))
+            self.prefixes = {keyword: [keyword[:length] for length in range(1, len(keyword) + 1)
+                                       if keyword[:length] in self.keywords]
+                             for keyword in self.keywords}
+
+    def __bool__(self):
+        return bool(self.keywords or self.others)
+
+    def keywords_in(self, text):
+        """
+        Yield the keywords found in the casefolded ``text``, possibly repeated.
+        """
+        if self.automaton is not None:
+            for _, keyword in self.automaton.iter(text):
+                yield keyword
+        elif self.regex is not None:
+            for found in self.regex.findall(text):
+                yield from self.prefixes[found]
+
+    def categorize(self, description, amount):
+        """
+        Return the category or source id the rules pick, or ``None``.
+        """
+        best = None
+        for keyword in self.keywords_in(description.casefold()):
+            for rule in self.keywords[keyword]:
+                if best is not None and rule.rank > best.rank:
+                    break
+                if accepts(rule, amount):
+                    best = rule
+                    break
+        for rule in self.others:
+            if best is not None and rule.rank > best.rank:
+                break
+            if accepts(rule, amount) and (rule.regex is None or rule.regex.search(description)):
+                best = rule
+                break
+        return best.label_id if best is not None else None
+
+
+def accepts(rule, amount):
+    return ((rule.min_amount is None or amount >= rule.min_amount)
+            and (rule.max_amount is None or amount <= rule.max_amount))
+
+
+def rule_values(rule_model, label_field):
+    return rule_model.objects.values('id', 'owner_id', 'kind', 'pattern', 'min_amount', 'max_amount', 'priority',
+                                     '{}_id'.format(label_field))
+
+
+def rule_set(rule_model, label_field, owner_id):
+    """
+    Return the ``RuleSet`` of ``owner_id``'s rules and the global rules of ``rule_model``.
+    """
+    rules = rule_values(rule_model, label_field).filter(Q(owner_id=owner_id) | Q(owner__isnull=True))
+    return RuleSet(rules, label_field)
+
+
+def recategorize(rule_model, ledger_model, rollup_model, label_field, owners=None, labels=None, batch_size=None):
+    """
+    Apply the rules to existing rows of ``ledger_model``.
+
+    Only rows of ``owners`` and, when given, rows whose label id is in
+    ``labels`` are considered; rows no rule matches keep their label. Rows are
+    read ``batch_size`` at a time in primary key order and moved with one
+    ``UPDATE`` per new label. The rollups and data versions of the owners
+    with changed rows are brought up to date at the end.
+
+    Returns:
+    - tuple: ``(rows, changed)``.
+    """
+    batch_size = batch_size or CATEGORIZE_BATCH_SIZE
+    label = '{}_id'.format(label_field)
+    rows = ledger_model.objects.order_by('pk')
+    if owners is not None:
+        rows = rows.filter(owner_id__in=list(owners))
+    if labels is not None:
+        rows = rows.filter(**{'{}__in'.format(label): list(labels)})
+    rows = rows.values_list('pk', 'owner_id', 'description', 'amount', label)
+
+    # Owners without rules of their own share the rule set of the global rules
+    all_rules = list(rule_values(rule_model, label_field))
+    global_rules = RuleSet([values for values in all_rules if values['owner_id'] is None], label_field)
+    own_rules = defaultdict(list)
+    for values in all_rules:
+        if values['owner_id'] is not None:
+            own_rules[values['owner_id']].append(values)
+    rule_sets = {}
+
+    scanned = changed = 0
+    touched = set()
+    last_pk = 0
+    try:
+        while True:
+            batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            moves = defaultdict(list)
+            for pk, owner_id, description, amount, label_id in batch:
+                if owner_id in own_rules:
+                    if owner_id not in rule_sets:
+                        rule_sets[owner_id] = RuleSet(own_rules[owner_id] + [
+                            values for values in all_rules if values['owner_id'] is None], label_field)
+                    rules = rule_sets[owner_id]
+                else:
+                    rules = global_rules
+                new_label_id = rules.categorize(description, amount)
+                if new_label_id is not None and new_label_id != label_id:
+                    moves[new_label_id].append(pk)
+                    touched.add(owner_id)
+
+            with transaction.atomic():
+                for new_label_id, pks in moves.items():
+                    ledger_model.objects.filter(pk__in=pks).update(**{label: new_label_id})
+            scanned += len(batch)
+            changed += sum(len(pks) for pks in moves.values())
+    finally:
+        touched = sorted(touched)
+        for start in range(0, len(touched), batch_size):
+            rebuild_rollups(ledger_model, rollup_model, label_field, touched[start:start + batch_size])
+        for owner_id in touched:
+            bump_data_version(owner_id)
+    return scanned, changed
@@ -0,0 +1,464 @@
+"""
+Streaming exports of the expense and income ledgers.
+
+Rows are read as plain tuples through a chunked (server-side, where supported)
+cursor and written to the response as they arrive, so an export starts sending
+at once and its memory use does not grow with the size of the ledger.
+"""
+import csv
+import heapq
+import importlib.util
+import json
+import os
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal
+from io import BytesIO
+from itertools import chain, islice
+from operator import itemgetter
+from multiprocessing import get_context, parent_process
+
+import django
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.template.loader import render_to_string
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from pypdf import PdfWriter
+from weasyprint import HTML
+
+from .pagination import LEDGER_ORDERING
+
+# Rows fetched from the database cursor per round trip
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+# Rows joined into one chunk of the response body
+EXPORT_WRITE_BATCH = 500
+
+EXPORT_COLUMNS = ['AMOUNT', 'DESCRIPTION', 'CATEGORY', 'DATE']
+
+# Combined cash-flow export of both ledgers, oldest first
+COMBINED_COLUMNS = ['DATE', 'TYPE', 'LABEL', 'DESCRIPTION', 'AMOUNT', 'BALANCE']
+COMBINED_FIELDS = [column.lower() for column in COMBINED_COLUMNS]
+COMBINED_ORDERING = ('date', 'id')
+
+# Content codings streamed exports may be compressed with, most preferred
+# first; empty sends them uncompressed. zstd needs the zstandard package.
+EXPORT_COMPRESSION = getattr(settings, 'EXPORT_COMPRESSION', ('zstd', 'gzip'))
+EXPORT_GZIP_LEVEL = getattr(settings, 'EXPORT_GZIP_LEVEL', 6)
+EXPORT_ZSTD_LEVEL = getattr(settings, 'EXPORT_ZSTD_LEVEL', 3)
+
+_zstd_available = importlib.util.find_spec('zstandard') is not None
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+XLSX_COLUMN_WIDTHS = {'A': 14, 'B': 48, 'C': 24, 'D': 12}
+
+# Ledger rows per separately rendered part of a PDF report
+PDF_CHUNK_ROWS = getattr(settings, 'PDF_CHUNK_ROWS', 2000)
+
+# Processes rendering PDF parts, per web worker; 1 renders every part in the calling process
+PDF_RENDER_PROCESSES = getattr(settings, 'PDF_RENDER_PROCESSES', min(os.cpu_count() or 1, 4))
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+# Rows per Parquet row group / Arrow record batch
+COLUMNAR_BATCH_ROWS = getattr(settings, 'COLUMNAR_BATCH_ROWS', 50000)
+
+COLUMNAR_FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream'),
+}
+
+
+class InvalidExportFilter(ValueError):
+    """
+    Raised when an export filter parameter cannot be parsed.
+    """
+
+
+class Echo:
+    """
+    File-like object whose ``write`` hands the value back, for ``csv.writer``.
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_filename(prefix, extension):
+    """
+    Return e.g. ``Expenses_2023-06-18_10-30-00.csv``.
+    """
+    return '{}_{}.{}'.format(prefix, timezone.now().strftime('%Y-%m-%d_%H-%M-%S'), extension)
+
+
+def export_queryset(queryset, label_field):
+    """
+    Return the export rows of ``queryset`` as ``(amount, description, label, date)``
+    tuples, newest first.
+    """
+    return (queryset
+            .order_by(*LEDGER_ORDERING)
+            .values_list('amount', 'description', '{}__name'.format(label_field), 'date'))
+
+
+def filter_ledger(queryset, label_field, params):
+    """
+    Narrow ``queryset`` in SQL by the optional ``start``/``end`` dates,
+    ``label`` names (repeatable) and ``min_amount``/``max_amount`` parameters.
+
+    Raises:
+    - InvalidExportFilter: If a date or amount is invalid.
+    """
+    try:
+        if params.get('start'):
+            queryset = queryset.filter(date__gte=date.fromisoformat(params['start']))
+        if params.get('end'):
+            queryset = queryset.filter(date__lte=date.fromisoformat(params['end']))
+    except ValueError:
+        raise InvalidExportFilter('Dates must be given as YYYY-MM-DD')
+
+    labels = [label for label in params.getlist('label') if label]
+    if labels:
+        queryset = queryset.filter(**{'{}__name__in'.format(label_field): labels})
+
+    amount_field = queryset.model._meta.get_field('amount')
+    for param, lookup in (('min_amount', 'amount__gte'), ('max_amount', 'amount__lte')):
+        if params.get(param):
+            try:
+                queryset = queryset.filter(**{lookup: amount_field.to_python(params[param])})
+            except ValidationError:
+                raise InvalidExportFilter('{} must be a number'.format(param))
+    return queryset
+
+
+def ledger_rows(queryset, label_field):
+    """
+    Iterate over the export rows of ``queryset`` without loading them all.
+    """
+    return export_queryset(queryset, label_field).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def join_batches(lines):
+    """
+    Join ``lines`` into blocks of ``EXPORT_WRITE_BATCH`` lines.
+    """
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= EXPORT_WRITE_BATCH:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def csv_chunks(rows, header=EXPORT_COLUMNS):
+    """
+    Yield the CSV text of ``header`` and ``rows`` in blocks of ``EXPORT_WRITE_BATCH`` lines.
+    """
+    writer = csv.writer(Echo())
+    return join_batches(chain([writer.writerow(header)], (writer.writerow(row) for row in rows)))
+
+
+def jsonl_chunks(rows, fields):
+    """
+    Yield ``rows`` as JSON Lines objects keyed by ``fields``, in blocks of
+    ``EXPORT_WRITE_BATCH`` lines. Amounts are written as exact decimal strings.
+    """
+    return join_batches(json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n' for row in rows)
+
+
+def write_csv(rows, output):
+    """
+    Write ``rows`` as UTF-8 CSV to the binary file ``output``.
+    """
+    for chunk in csv_chunks(rows):
+        output.write(chunk.encode('utf-8'))
+
+
+def attachment(response, filename):
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
+
+
+def accepted_encoding(request):
+    """
+    Pick the content coding for a streamed export from the request's
+    ``Accept-Encoding`` header: the first of ``EXPORT_COMPRESSION`` the client
+    accepts (and that is installed), or ``None`` to send it uncompressed.
+    """
+    accepted = {}
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+
+    for coding in EXPORT_COMPRESSION:
+        if coding == 'zstd' and not _zstd_available:
+            continue
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+
+def compress_chunks(chunks, encoding):
+    """
+    Compress the text ``chunks`` of an export as they are produced.
+
+    Each chunk is flushed to a byte boundary, so the client receives every
+    block as soon as it is ready and the compressor never holds the file.
+    """
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        block, finish = zlib.Z_SYNC_FLUSH, zlib.Z_FINISH
+    else:
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=EXPORT_ZSTD_LEVEL).compressobj()
+        block, finish = zstandard.COMPRESSOBJ_FLUSH_BLOCK, zstandard.COMPRESSOBJ_FLUSH_FINISH
+
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8')) + compressor.flush(block)
+        if data:
+            yield data
+    yield compressor.flush(finish)
+
+
+def stream_text(chunks, filename, content_type, encoding=None):
+    """
+    Return a ``StreamingHttpResponse`` sending the text ``chunks`` as an
+    attachment, compressed with ``encoding`` if one is given.
+    """
+    if encoding:
+        response = StreamingHttpResponse(compress_chunks(chunks, encoding), content_type=content_type)
+        response['Content-Encoding'] = encoding
+    else:
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+    if EXPORT_COMPRESSION:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    return attachment(response, filename)
+
+
+def stream_csv(rows, filename, header=EXPORT_COLUMNS, encoding=None):
+    """
+    Return a ``StreamingHttpResponse`` sending ``rows`` as a CSV attachment.
+    """
+    return stream_text(csv_chunks(rows, header), filename, 'text/csv', encoding)
+
+
+def stream_jsonl(rows, filename, fields, encoding=None):
+    """
+    Return a ``StreamingHttpResponse`` sending ``rows`` as a JSON Lines attachment.
+    """
+    return stream_text(jsonl_chunks(rows, fields), filename, 'application/x-ndjson', encoding)
+
+
+def opening_balance(expenses, income, start):
+    """
+    Return the balance carried into ``start``: earlier income minus earlier expenses.
+    """
+    def total(queryset):
+        return queryset.filter(date__lt=start).aggregate(total=Sum('amount'))['total'] or Decimal(0)
+
+    return total(income) - total(expenses)
+
+
+def combined_rows(expenses, income, balance=Decimal(0)):
+    """
+    Merge expenses and income into one date-ordered stream of
+    ``(date, type, label, description, amount, balance)`` rows.
+
+    Each side is read oldest first through its own chunked cursor and the two
+    are merged lazily, so neither is held in memory. Income comes before
+    expenses on the same day; expense amounts are negative, and ``balance``
+    runs on from the given opening balance.
+    """
+    def side(queryset, label_field, kind, rank):
+        rows = (queryset
+                .order_by(*COMBINED_ORDERING)
+                .values_list('date', 'id', '{}__name'.format(label_field), 'description', 'amount')
+                .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+        return ((day, rank, pk, kind, label, description, amount)
+                for day, pk, label, description, amount in rows)
+
+    merged = heapq.merge(side(income, 'source', 'income', 0), side(expenses, 'category', 'expense', 1),
+                         key=itemgetter(0, 1, 2))
+    for day, rank, pk, kind, label, description, amount in merged:
+        if kind == 'expense':
+            amount = -amount
+        balance += amount
+        yield day, kind, label, description, amount, balance
+
+
+def write_xlsx(rows, output, title, header=EXPORT_COLUMNS):
+    """
+    Write ``rows`` to ``output`` as an .xlsx workbook, followed by a totals row.
+
+    The workbook is write-only: each row is serialised to a temporary file as
+    it is appended, so memory does not grow with the number of rows. Amounts
+    are written as numbers and dates as date cells.
+
+    Returns:
+    - Decimal: The total of the amount column.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    for column, width in XLSX_COLUMN_WIDTHS.items():
+        sheet.column_dimensions[column].width = width
+
+    bold = Font(bold=True)
+
+    def bold_cell(value):
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.font = bold
+        return cell
+
+    sheet.append([bold_cell(name) for name in header])
+    total = Decimal(0)
+    for row in rows:
+        total += row[0]
+        sheet.append(row)
+    sheet.append([bold_cell(total), bold_cell('TOTAL')])
+
+    workbook.save(output)
+    return total
+
+
+def pdf_pool():
+    """
+    Return the process pool PDF parts are rendered in, starting it on first use.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(PDF_RENDER_PROCESSES, mp_context=get_context('spawn'),
+                                            initializer=django.setup)
+    return _pdf_pool
+
+
+def render_pdf_part(template, context):
+    """
+    Render one part of a PDF report; runs in a pool process.
+    """
+    return HTML(string=render_to_string(template, context)).write_pdf()
+
+
+def pdf_part_contexts(rows, label_field, context_name):
+    """
+    Split export ``rows`` into template contexts of ``PDF_CHUNK_ROWS`` rows.
+
+    Each context holds its rows as dicts, the row number ``offset`` of its
+    first row and its ``part`` number; the ``last`` one also gets the ``total``.
+    """
+    rows = iter(rows)
+    chunks = iter(lambda: list(islice(rows, PDF_CHUNK_ROWS)), [])
+    current, part, offset, total = next(chunks, []), 1, 0, Decimal(0)
+    while True:
+        following = next(chunks, None)
+        for row in current:
+            total += row[0]
+        yield {
+            context_name: [dict(zip(('amount', 'description', label_field, 'date'), row)) for row in current],
+            'offset': offset,
+            'part': part,
+            'last': following is None,
+            'total': total if following is None else None,
+        }
+        if following is None:
+            return
+        part, offset, current = part + 1, offset + len(current), following
+
+
+def write_pdf(queryset, label_field, template, context_name, output):
+    """
+    Render the rows of ``queryset`` and their total through ``template`` as a
+    PDF written to ``output``.
+
+    Large ledgers are rendered as parts of ``PDF_CHUNK_ROWS`` rows in parallel
+    in the PDF process pool and then joined into one document; a ledger that
+    fits in one part is rendered right here. So are all parts when called in
+    a process of a pool already, such as the export worker's: a pool per
+    pool process would multiply the number of processes.
+    """
+    contexts = pdf_part_contexts(ledger_rows(queryset, label_field), label_field, context_name)
+    first = next(contexts)
+    if first['last'] or PDF_RENDER_PROCESSES <= 1 or parent_process() is not None:
+        parts = [render_pdf_part(template, context) for context in chain([first], contexts)]
+    else:
+        pool, parts, pending = pdf_pool(), [], deque()
+        for context in chain([first], contexts):
+            pending.append(pool.submit(render_pdf_part, template, context))
+            # Bound the rows and rendered parts in flight
+            if len(pending) >= PDF_RENDER_PROCESSES * 2:
+                parts.append(pending.popleft().result())
+        parts.extend(future.result() for future in pending)
+
+    if len(parts) == 1:
+        output.write(parts[0])
+        return
+    writer = PdfWriter()
+    for part in parts:
+        writer.append(BytesIO(part))
+    writer.write(output)
+
+
+def write_columnar(rows, output, export_format, label_field):
+    """
+    Write export ``rows`` to ``output`` as a typed Parquet file or Arrow IPC stream.
+
+    Rows are gathered into batches of ``COLUMNAR_BATCH_ROWS``; each batch is
+    one Parquet row group or Arrow record batch, so memory is bounded by the
+    batch size. Amounts are ``decimal128(18, 2)``, dates ``date32`` and labels
+    dictionary-encoded.
+
+    Raises:
+    - ImportError: If pyarrow is not installed.
+    """
+    import pyarrow as pa
+
+    schema = pa.schema([
+        ('amount', pa.decimal128(18, 2)),
+        ('description', pa.string()),
+        (label_field, pa.dictionary(pa.int32(), pa.string())),
+        ('date', pa.date32()),
+    ])
+
+    if export_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(output, schema, compression='zstd')
+    else:
+        # The stream flavour of IPC, since each batch carries its own label dictionary
+        writer = pa.ipc.new_stream(output, schema)
+
+    with writer:
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, COLUMNAR_BATCH_ROWS))
+            if not chunk:
+                break
+            amounts, descriptions, labels, dates = zip(*chunk)
+            writer.write_batch(pa.RecordBatch.from_arrays([
+                pa.array(amounts, type=schema.field('amount').type),
+                pa.array(descriptions, type=pa.string()),
+                pa.array(labels, type=pa.string()).dictionary_encode(),
+                pa.array(dates, type=pa.date32()),
+            ], schema=schema))
+
@@ -0,0 +1,71 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+
+
+class MoneyField(models.BigIntegerField):
+    """
+    An amount of money stored as an integer number of minor units (cents).
+
+    Python code only ever sees ``Decimal`` amounts in major units: values are
+    converted on the way in and out of the database, so ``12.5``, ``'12.50'``
+    and ``Decimal('12.5')`` are all stored as ``1250``. Sums stay exact and
+    filters such as ``amount__gte=12`` compare integers. Amounts whose minor
+    units do not fit the 64-bit column are rejected like malformed ones.
+    """
+    description = 'Amount of money stored in minor units'
+    default_error_messages = {
+        'invalid': '“%(value)s” value must be a decimal number.',
+        'out_of_range': '“%(value)s” value must be between -%(limit)s and %(limit)s.',
+    }
+
+    # Number of minor units digits, i.e. amounts are stored times 10 ** decimal_places
+    decimal_places = 2
+
+    # The largest amount whose minor units fit the column
+    max_amount = Decimal(models.BigIntegerField.MAX_BIGINT).scaleb(-decimal_places)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return Decimal(value).scaleb(-self.decimal_places)
+
+    def to_python(self, value):
+        if value is None:
+            return value
+        try:
+            # Going through str() keeps floats such as 0.1 from picking up binary noise
+            amount = value if isinstance(value, Decimal) else Decimal(str(value).strip())
+        except (InvalidOperation, ValueError):
+            amount = None
+        if amount is None or not amount.is_finite():
+            raise exceptions.ValidationError(
+                self.error_messages['invalid'], code='invalid', params={'value': value})
+        try:
+            amount = self.quantize(amount)
+        except InvalidOperation:
+            # More digits than the decimal context holds, so far out of range anyway
+            amount = None
+        if amount is None or abs(amount) > self.max_amount:
+            raise exceptions.ValidationError(
+                self.error_messages['out_of_range'], code='out_of_range',
+                params={'value': value, 'limit': self.max_amount})
+        return amount
+
+    def quantize(self, value):
+        return value.quantize(Decimal(1).scaleb(-self.decimal_places), rounding=ROUND_HALF_UP)
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return None
+        return int(self.to_python(value).scaleb(self.decimal_places))
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{
+            'form_class': forms.DecimalField,
+            'decimal_places': self.decimal_places,
+            **kwargs,
+        })
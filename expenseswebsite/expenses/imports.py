@@ -0,0 +1,261 @@
+"""
+Bulk CSV import of the expense and income ledgers.
+
+Files use the column layout the CSV exports write (``AMOUNT``, ``DESCRIPTION``,
+``CATEGORY``, ``DATE``; the label column may also be headed ``SOURCE``) and are
+parsed row by row, so memory use is bounded by the batch size. Rows without a
+category or source (or files without the column) get the one the owner's
+categorization rules pick. Valid rows are
+inserted with ``bulk_create`` in batches of ``IMPORT_BATCH_SIZE``, each batch in
+its own transaction; invalid rows are skipped and reported by line number.
+Missing categories and sources are created. Bulk inserts bypass the model
+signals, so the owner's rollups are rebuilt and data version bumped at the end.
+"""
+import csv
+from datetime import date
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from userincome.models import IncomeMonthlyRollup, Source, SourceRule, Userincome
+
+from .cache import bump_data_version
+from .categorize import rule_set
+from .models import Category, CategoryRule, Expense, ExpenseMonthlyRollup
+from .rollups import rebuild_rollups
+
+# Rows inserted per bulk_create and transaction
+IMPORT_BATCH_SIZE = getattr(settings, 'IMPORT_BATCH_SIZE', 1000)
+
+# Row errors listed in an import report; the rest are only counted
+IMPORT_MAX_ERRORS = getattr(settings, 'IMPORT_MAX_ERRORS', 100)
+
+IMPORT_LABEL_HEADERS = ('CATEGORY', 'SOURCE')
+
+# model, label model, rollup model, label field
+IMPORT_LEDGERS = {
+    'expense': (Expense, Category, ExpenseMonthlyRollup, 'category'),
+    'income': (Userincome, Source, IncomeMonthlyRollup, 'source'),
+}
+
+# Categorization rules of each ledger
+LEDGER_RULES = {'expense': CategoryRule, 'income': SourceRule}
+
+
+class InvalidImportFile(ValueError):
+    """
+    Raised when a file does not start with a header in the export layout.
+    """
+
+
+class RowError(ValueError):
+    """
+    Raised for a row that cannot be imported.
+    """
+
+
+def amount_error(error):
+    """
+    Return the row error message for the ``ValidationError`` a ``MoneyField`` raised.
+    """
+    return 'Amount is too large' if error.code == 'out_of_range' else 'Amount must be a number'
+
+
+def read_header(header):
+    """
+    Return the positions of the amount, description, label and date columns;
+    the label position is ``None`` if the file has no label column.
+
+    Raises:
+    - InvalidImportFile: If a column is missing.
+    """
+    names = [name.strip().upper() for name in header]
+    label_header = next((name for name in IMPORT_LABEL_HEADERS if name in names), None)
+    missing = [name for name in ('AMOUNT', 'DESCRIPTION', 'DATE') if name not in names]
+    if missing:
+        raise InvalidImportFile('Missing column(s): {}'.format(', '.join(missing)))
+    return tuple(names.index(name) if name else None for name in ('AMOUNT', 'DESCRIPTION', label_header, 'DATE'))
+
+
+class LedgerImport:
+    """
+    Import of CSV rows into one owner's expenses or income.
+    """
+
+    def __init__(self, owner, ledger, batch_size=None):
+        self.model, self.label_model, self.rollup_model, self.label_field = IMPORT_LEDGERS[ledger]
+        self.owner_id = owner.pk
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
+        self.amount_field = self.model._meta.get_field('amount')
+        self.label_max_length = self.label_model._meta.get_field('name').max_length
+        self.labels = None
+        self.rule_model = LEDGER_RULES[ledger]
+        self.rules = None
+        self.created = 0
+        self.duplicates = 0
+        self.errors = []
+        self.error_count = 0
+
+    def label_id(self, name):
+        if self.labels is None:
+            # Names are not unique; descending order leaves the oldest row of each name
+            self.labels = dict(self.label_model.objects.order_by('-pk').values_list('name', 'pk'))
+        if name not in self.labels:
+            self.labels[name] = self.label_model.objects.create(name=name).pk
+        return self.labels[name]
+
+    def categorize(self, description, amount):
+        """
+        Return the label id the owner's categorization rules pick, or ``None``.
+        """
+        if self.rules is None:
+            self.rules = rule_set(self.rule_model, self.label_field, self.owner_id)
+        return self.rules.categorize(description, amount)
+
+    def parse(self, values, columns):
+        """
+        Build an unsaved ledger row from the CSV ``values``.
+
+        Raises:
+        - RowError: If a value is missing or invalid.
+        """
+        width = max(column for column in columns if column is not None) + 1
+        if len(values) < width:
+            raise RowError('Expected {} columns, got {}'.format(width, len(values)))
+        amount, description, label, day = (values[column].strip() if column is not None else ''
+                                           for column in columns)
+        label_name = self.label_field.capitalize()
+
+        if not amount:
+            raise RowError('Amount is required')
+        try:
+            amount = self.amount_field.to_python(amount)
+        except ValidationError as error:
+            raise RowError(amount_error(error))
+        if not description:
+            raise RowError('Description is required')
+        if len(label) > self.label_max_length:
+            raise RowError('{} must be at most {} characters'.format(label_name, self.label_max_length))
+        try:
+            day = date.fromisoformat(day)
+        except ValueError:
+            raise RowError('Invalid date format! The date must be in YYYY-MM-DD format.')
+        label_id = self.label_id(label) if label else self.categorize(description, amount)
+        if label_id is None:
+            raise RowError('{} is required'.format(label_name))
+
+        return self.model(owner_id=self.owner_id, amount=amount, description=description, date=day,
+                          **{'{}_id'.format(self.label_field): label_id})
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def rows(self, reader, columns):
+        """
+        Yield the valid rows of ``reader`` as unsaved ledger rows, recording the errors.
+        """
+        while True:
+            try:
+                values = next(reader, None)
+            except (UnicodeDecodeError, csv.Error) as error:
+                # The rest of the file cannot be read reliably
+                self.add_error(reader.line_num + 1, 'Unreadable row: {}'.format(error))
+                return
+            if values is None:
+                return
+            if not any(value.strip() for value in values):
+                continue
+            try:
+                yield self.parse(values, columns)
+            except RowError as error:
+                self.add_error(reader.line_num, str(error))
+
+    def run(self, lines):
+        """
+        Import the CSV text ``lines`` (any iterable of lines, header first).
+
+        Returns:
+        - dict: ``created`` rows, ``error_count`` and the first
+          ``IMPORT_MAX_ERRORS`` ``errors`` as ``{'line', 'error'}``.
+
+        Raises:
+        - InvalidImportFile: If the header is missing or incomplete.
+        """
+        reader = csv.reader(lines)
+        try:
+            columns = read_header(next(reader, []))
+        except (UnicodeDecodeError, csv.Error):
+            raise InvalidImportFile('The file must be UTF-8 encoded CSV')
+
+        rows = self.rows(reader, columns)
+        try:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                self.insert(batch)
+        finally:
+            self.finish()
+
+        return {'created': self.created, 'error_count': self.error_count, 'errors': self.errors}
+
+    def insert(self, batch):
+        """
+        Insert ``batch`` in one transaction, skipping rows whose fingerprint
+        the owner already has with a single query for the whole batch.
+
+        Should a concurrent import of the same statement insert some of the rows
+        first, the insert is retried without them, so ``created`` and
+        ``duplicates`` count exactly the rows this import inserted and skipped.
+        """
+        with transaction.atomic():
+            batch = self.skip_existing(batch)
+            while True:
+                try:
+                    with transaction.atomic():
+                        self.model.objects.bulk_create(batch)
+                    break
+                except IntegrityError:
+                    # A concurrent import of the same statement inserted some of these rows first
+                    remaining = self.skip_existing(batch)
+                    if len(remaining) == len(batch):
+                        raise
+                    batch = remaining
+        self.created += len(batch)
+
+    def skip_existing(self, batch):
+        """
+        Return ``batch`` without the rows whose fingerprint the owner already
+        has, counting those as duplicates.
+        """
+        fingerprints = [row.fingerprint for row in batch if row.fingerprint]
+        if not fingerprints:
+            return batch
+        existing = set(self.model.objects
+                       .filter(owner_id=self.owner_id, fingerprint__in=fingerprints)
+                       .values_list('fingerprint', flat=True))
+        if not existing:
+            return batch
+        self.duplicates += len(existing)
+        return [row for row in batch if row.fingerprint not in existing]
+
+    def finish(self):
+        """
+        Bring the owner's rollups and data version up to date after the inserts.
+        """
+        if self.created:
+            # One grouped query instead of a rollup update per (label, month) of every batch
+            rebuild_rollups(self.model, self.rollup_model, self.label_field, [self.owner_id])
+            bump_data_version(self.owner_id)
+
+
+def import_csv(owner, ledger, lines, batch_size=None):
+    """
+    Import the CSV text ``lines`` into ``owner``'s ``ledger`` (``'expense'`` or
+    ``'income'``); see ``LedgerImport.run``.
+    """
+    return LedgerImport(owner, ledger, batch_size).run(lines)
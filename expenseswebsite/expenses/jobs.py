@@ -0,0 +1,128 @@
+"""
+Background export jobs.
+
+A request only inserts an ``ExportJob`` row. ``manage.py run_export_worker``
+polls for pending rows and renders them in a pool of worker processes, so a
+slow PDF never ties up a web worker, and no message broker is needed: the jobs
+table is the queue. Finished files go to the default storage and are removed
+by ``manage.py cleanup_export_jobs`` once they expire.
+"""
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from userincome.models import Userincome
+
+from .exports import export_filename, ledger_rows, write_csv, write_pdf, write_xlsx
+from .models import Expense, ExportJob
+
+# How long a finished export can be downloaded
+EXPORT_JOB_TTL = getattr(settings, 'EXPORT_JOB_TTL', 24 * 60 * 60)
+
+# A job still pending or running after this long is assumed lost, e.g. with its worker
+EXPORT_JOB_TIMEOUT = getattr(settings, 'EXPORT_JOB_TIMEOUT', 60 * 60)
+
+# model, label field, file name prefix, PDF template, PDF template variable
+EXPORT_LEDGERS = {
+    'expense': (Expense, 'category', 'Expenses', 'expenses/pdf-output.html', 'expenses'),
+    'income': (Userincome, 'source', 'Income', 'income/pdf-output.html', 'incomes'),
+}
+
+
+def enqueue_export(owner, ledger, export_format):
+    """
+    Create a pending export job.
+
+    Raises:
+    - ValueError: If the ledger or format is unknown.
+    """
+    if ledger not in EXPORT_LEDGERS:
+        raise ValueError('ledger must be one of: {}'.format(', '.join(EXPORT_LEDGERS)))
+    if export_format not in dict(ExportJob.FORMAT_CHOICES):
+        raise ValueError('format must be one of: {}'.format(', '.join(dict(ExportJob.FORMAT_CHOICES))))
+    return ExportJob.objects.create(owner=owner, ledger=ledger, format=export_format)
+
+
+def claim_job(pk):
+    """
+    Mark a pending job as running. Returns ``False`` if another worker got it first.
+    """
+    return bool(ExportJob.objects.filter(pk=pk, status=ExportJob.PENDING)
+                .update(status=ExportJob.RUNNING, started_at=timezone.now()))
+
+
+def render_export(job, output):
+    """
+    Write the export described by ``job`` to the binary file ``output``.
+    """
+    model, label_field, prefix, template, context_name = EXPORT_LEDGERS[job.ledger]
+    queryset = model.objects.filter(owner_id=job.owner_id)
+    if job.format == 'csv':
+        write_csv(ledger_rows(queryset, label_field), output)
+    elif job.format == 'xlsx':
+        write_xlsx(ledger_rows(queryset, label_field), output, prefix)
+    else:
+        write_pdf(queryset, label_field, template, context_name, output)
+    return export_filename(prefix, job.format)
+
+
+def run_export_job(pk):
+    """
+    Render a claimed job and store its file; failures are recorded on the job.
+    """
+    close_old_connections()
+    job = ExportJob.objects.get(pk=pk)
+    try:
+        with tempfile.TemporaryFile() as output:
+            filename = render_export(job, output)
+            output.seek(0)
+            job.file.save(filename, File(output), save=False)
+    except Exception as error:
+        job.status = ExportJob.FAILED
+        job.error = '{}: {}'.format(type(error).__name__, error)
+    else:
+        job.status = ExportJob.DONE
+    job.finished_at = timezone.now()
+    job.expires_at = job.finished_at + timedelta(seconds=EXPORT_JOB_TTL)
+    job.save(update_fields=['status', 'file', 'error', 'finished_at', 'expires_at'])
+    close_old_connections()
+    return job.pk
+
+
+def fail_job(pk, error):
+    """
+    Record the failure of a running job that ``run_export_job`` could not record, e.g. because its process died.
+    """
+    now = timezone.now()
+    ExportJob.objects.filter(pk=pk, status=ExportJob.RUNNING).update(
+        status=ExportJob.FAILED, error=error, finished_at=now, expires_at=now + timedelta(seconds=EXPORT_JOB_TTL))
+
+
+def expire_jobs(now=None):
+    """
+    Delete expired jobs and their files, and fail jobs that no worker picked
+    up or finished in time.
+
+    Returns:
+    - tuple: ``(deleted, failed)`` job counts.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=EXPORT_JOB_TIMEOUT)
+    failed = (ExportJob.objects
+              .filter(Q(status=ExportJob.PENDING, created_at__lt=cutoff)
+                      | Q(status=ExportJob.RUNNING, started_at__lt=cutoff))
+              .update(status=ExportJob.FAILED, error='Timed out', finished_at=now,
+                      expires_at=now + timedelta(seconds=EXPORT_JOB_TTL)))
+
+    deleted = 0
+    for job in ExportJob.objects.filter(expires_at__lt=now).iterator():
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        deleted += 1
+    return deleted, failed
@@ -0,0 +1,84 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from expenses.benchmarks import (BENCHMARK_REPEAT, BENCHMARK_THRESHOLD, BENCHMARK_VIEWS, BENCHMARK_WARMUP,
+                                 benchmark_database, benchmark_user, cold_caches, compare, run_benchmarks,
+                                 seed_dataset)
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic dataset into a test database and report latency percentiles, query counts and '
+            'peak memory of the main views, optionally against a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5, help='Users to seed (default: %(default)s).')
+        parser.add_argument('--rows', type=int, default=2000, help='Expenses per user (default: %(default)s).')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the dataset (default: %(default)s).')
+        parser.add_argument('--repeat', type=int, default=BENCHMARK_REPEAT,
+                            help='Timed requests per view (default: %(default)s).')
+        parser.add_argument('--warmup', type=int, default=BENCHMARK_WARMUP,
+                            help='Untimed requests per view first (default: %(default)s).')
+        parser.add_argument('--cold', action='store_true',
+                            help='Invalidate the ledger caches before every request.')
+        parser.add_argument('--view', action='append', dest='views', choices=[view[0] for view in BENCHMARK_VIEWS],
+                            help='Only benchmark this view; may be repeated.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the test database, and reuse its dataset on the next run with the same '
+                                 '--users, --rows and --seed.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='Compare with the results stored in this JSON file.')
+        parser.add_argument('--threshold', type=float, default=BENCHMARK_THRESHOLD,
+                            help='Relative growth reported as a regression (default: %(default)s).')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['rows'], options['repeat']) < 1 or options['warmup'] < 0:
+            raise CommandError('--users, --rows and --repeat must be positive')
+        dataset = {key: options[key] for key in ('users', 'rows', 'seed', 'cold')}
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as stream:
+                    stored = json.load(stream)
+                baseline = stored['views']
+            except (OSError, ValueError, KeyError) as error:
+                raise CommandError('Cannot read the baseline: {}'.format(error))
+            if stored.get('dataset') != dataset:
+                self.stderr.write(self.style.WARNING(
+                    'The baseline was measured with {}; this run uses {}.'.format(stored.get('dataset'), dataset)))
+
+        with benchmark_database(options['keepdb']):
+            user = benchmark_user(options['users'], options['rows'], options['seed'])
+            if user is None:
+                self.stderr.write('Seeding {} users with {} expenses each...'.format(options['users'], options['rows']))
+                try:
+                    user = seed_dataset(options['users'], options['rows'], options['seed'])
+                except ValueError as error:
+                    raise CommandError('{}; run once without --keepdb to recreate the database'.format(error))
+            client = Client()
+            client.force_login(user)
+            results = run_benchmarks(client, options['views'], options['repeat'], options['warmup'],
+                                     cold_caches(user.pk) if options['cold'] else None)
+
+        self.stdout.write('{:<26} {:>6} {:>10} {:>10} {:>10} {:>8} {:>10}'.format(
+            'view', 'status', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'peak KiB'))
+        for name, result in results.items():
+            self.stdout.write('{:<26} {status:>6} {p50_ms:>10.2f} {p95_ms:>10.2f} {p99_ms:>10.2f} {queries:>8} '
+                              '{peak_kib:>10.1f}'.format(name, **result))
+        if not options['cold']:
+            self.stdout.write('Warm caches: after the first request the exports are served from cached files; '
+                              'pass --cold to render them on every request.')
+
+        if options['output']:
+            report = {'dataset': dataset, 'views': results}
+            with open(options['output'], 'w') as stream:
+                json.dump(report, stream, indent=2)
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['threshold'])
+            for regression in regressions:
+                self.stderr.write(self.style.ERROR(regression))
+            if regressions:
+                raise CommandError('{} regression(s) against {}'.format(len(regressions), options['baseline']))
+            self.stdout.write(self.style.SUCCESS('No regressions against {}.'.format(options['baseline'])))
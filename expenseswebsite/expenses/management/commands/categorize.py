@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.categorize import CATEGORIZE_BATCH_SIZE, recategorize
+from expenses.imports import IMPORT_LEDGERS, LEDGER_RULES
+from expenses.statements import STATEMENT_DEFAULT_LABEL
+
+
+class Command(BaseCommand):
+    help = ('Apply the categorization rules to existing expenses and income; by default only to rows in the '
+            '"{}" category or source.'.format(STATEMENT_DEFAULT_LABEL))
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ledger', choices=list(IMPORT_LEDGERS),
+                            help='Only this ledger (default: both).')
+        parser.add_argument('--user', dest='username', metavar='USERNAME', help='Only rows of this user.')
+        parser.add_argument('--all', action='store_true', help='Recategorize every row a rule matches.')
+        parser.add_argument('--batch-size', type=int, default=CATEGORIZE_BATCH_SIZE,
+                            help='Rows per query (default: %(default)s).')
+
+    def handle(self, *args, **options):
+        owners = None
+        if options['username']:
+            owner = User.objects.filter(username=options['username']).first()
+            if owner is None:
+                raise CommandError('Unknown user: {}'.format(options['username']))
+            owners = [owner.pk]
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        for ledger in [options['ledger']] if options['ledger'] else list(IMPORT_LEDGERS):
+            model, label_model, rollup_model, label_field = IMPORT_LEDGERS[ledger]
+            labels = None
+            if not options['all']:
+                labels = list(label_model.objects.filter(name=STATEMENT_DEFAULT_LABEL).values_list('pk', flat=True))
+            scanned, changed = recategorize(LEDGER_RULES[ledger], model, rollup_model, label_field, owners, labels,
+                                            options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                'Recategorized {} of {} {} rows.'.format(changed, scanned, ledger)))
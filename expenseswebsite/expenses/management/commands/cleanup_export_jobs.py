@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from expenses.jobs import expire_jobs
+
+
+class Command(BaseCommand):
+    help = 'Delete expired export jobs and their files, and fail jobs no worker picked up or finished in time.'
+
+    def handle(self, *args, **options):
+        deleted, failed = expire_jobs()
+        self.stdout.write(self.style.SUCCESS(
+            'Deleted {} expired and failed {} timed out export jobs.'.format(deleted, failed)))
@@ -0,0 +1,49 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.synthetic import SYNTHETIC_BATCH_SIZE, generate_ledgers
+
+
+class Command(BaseCommand):
+    help = 'Generate users with synthetic expenses and income. The same arguments always give the same data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Users to create (default: %(default)s).')
+        parser.add_argument('--rows', type=int, default=1000, help='Expenses per user (default: %(default)s).')
+        parser.add_argument('--income-rows', type=int,
+                            help='Income rows per user (default: a twentieth of --rows, at least one).')
+        parser.add_argument('--start', default='2022-01-01',
+                            help='First date of the generated rows, YYYY-MM-DD (default: %(default)s).')
+        parser.add_argument('--days', type=int, default=730,
+                            help='Days the rows are spread over (default: %(default)s).')
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='How strongly each user favours some categories; 0 spreads rows evenly '
+                                 '(default: %(default)s).')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: %(default)s).')
+        parser.add_argument('--prefix', default='synthetic', help='Username prefix (default: %(default)s).')
+        parser.add_argument('--batch-size', type=int, default=SYNTHETIC_BATCH_SIZE,
+                            help='Rows per insert and transaction (default: %(default)s).')
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start'])
+        except ValueError:
+            raise CommandError('--start must be given as YYYY-MM-DD')
+        income_rows = options['income_rows']
+        if income_rows is None:
+            income_rows = max(options['rows'] // 20, 1)
+        if min(options['users'], options['rows'], income_rows) < 0:
+            raise CommandError('--users, --rows and --income-rows cannot be negative')
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days and --batch-size must be positive')
+        if options['skew'] < 0:
+            raise CommandError('--skew cannot be negative')
+
+        try:
+            report = generate_ledgers(options['users'], options['rows'], income_rows, start, options['days'],
+                                      options['skew'], options['seed'], options['prefix'], options['batch_size'])
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            'Generated {users} users with {expenses} expenses and {income} income rows.'.format(**report)))
@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.imports import IMPORT_BATCH_SIZE, IMPORT_LEDGERS, InvalidImportFile, import_csv
+
+
+class Command(BaseCommand):
+    help = 'Import expenses or income of a user from a CSV file in the export layout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with AMOUNT, DESCRIPTION, CATEGORY (or SOURCE) and DATE columns.')
+        parser.add_argument('--user', required=True, dest='username', metavar='USERNAME',
+                            help='Owner of the imported rows.')
+        parser.add_argument('--ledger', choices=list(IMPORT_LEDGERS), default='expense',
+                            help='Ledger to import into (default: expense).')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='Rows per insert and transaction (default: %(default)s).')
+
+    def handle(self, *args, **options):
+        owner = User.objects.filter(username=options['username']).first()
+        if owner is None:
+            raise CommandError('Unknown user: {}'.format(options['username']))
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                report = import_csv(owner, options['ledger'], lines, options['batch_size'])
+        except (OSError, InvalidImportFile) as error:
+            raise CommandError(error)
+
+        for error in report['errors']:
+            self.stderr.write('Line {line}: {error}'.format(**error))
+        if report['error_count'] > len(report['errors']):
+            self.stderr.write('... and {} more errors'.format(report['error_count'] - len(report['errors'])))
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {} rows; skipped {} invalid rows.'.format(report['created'], report['error_count'])))
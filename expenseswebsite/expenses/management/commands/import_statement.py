@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.imports import IMPORT_BATCH_SIZE, InvalidImportFile
+from expenses.statements import import_statement
+
+
+class Command(BaseCommand):
+    help = 'Import an OFX or QIF bank statement: debits as expenses, credits as income.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='OFX, QFX or QIF statement file.')
+        parser.add_argument('--user', required=True, dest='username', metavar='USERNAME',
+                            help='Owner of the imported rows.')
+        parser.add_argument('--day-first', action='store_true',
+                            help='Read QIF dates as day/month/year instead of month/day/year.')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='Rows per insert and transaction (default: %(default)s).')
+
+    def handle(self, *args, **options):
+        owner = User.objects.filter(username=options['username']).first()
+        if owner is None:
+            raise CommandError('Unknown user: {}'.format(options['username']))
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        try:
+            with open(options['path'], 'rb') as statement:
+                report = import_statement(owner, options['path'], statement.read(), options['batch_size'],
+                                          options['day_first'])
+        except (OSError, InvalidImportFile) as error:
+            raise CommandError(error)
+
+        for error in report['errors']:
+            self.stderr.write('Line {line}: {error}'.format(**error))
+        if report['error_count'] > len(report['errors']):
+            self.stderr.write('... and {} more errors'.format(report['error_count'] - len(report['errors'])))
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {} expenses and {} income rows; skipped {} already imported and {} invalid.'.format(
+                report['expenses'], report['income'], report['duplicates'], report['error_count'])))
@@ -0,0 +1,32 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.models import Expense, ExpenseMonthlyRollup, RecurringExpense
+from expenses.recurrence import RECURRING_BATCH_SIZE, materialize
+from userincome.models import IncomeMonthlyRollup, RecurringIncome, Userincome
+
+
+class Command(BaseCommand):
+    help = 'Write the due occurrences of all recurring expenses and income. Safe to rerun.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Materialize occurrences up to this YYYY-MM-DD date (default: today).')
+        parser.add_argument('--batch-size', type=int, default=RECURRING_BATCH_SIZE,
+                            help='Rules per query, insert and transaction (default: %(default)s).')
+
+    def handle(self, *args, **options):
+        try:
+            today = date.fromisoformat(options['date']) if options['date'] else date.today()
+        except ValueError:
+            raise CommandError('--date must be given as YYYY-MM-DD')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        expenses = materialize(RecurringExpense, Expense, ExpenseMonthlyRollup, 'category', today,
+                               options['batch_size'])
+        income = materialize(RecurringIncome, Userincome, IncomeMonthlyRollup, 'source', today,
+                             options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Materialized {} expenses from {} rules and {} income rows from {} rules.'.format(
+                expenses[1], expenses[0], income[1], income[0])))
@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.models import Expense, ExpenseMonthlyRollup
+from expenses.rollups import rebuild_rollups
+from userincome.models import IncomeMonthlyRollup, Userincome
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly expense and income rollups from the ledgers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help='Only rebuild the rollups of this user (repeatable).')
+
+    def handle(self, *args, **options):
+        owners = None
+        if options['usernames']:
+            owners = list(User.objects.filter(username__in=options['usernames']).values_list('pk', flat=True))
+            if len(owners) != len(set(options['usernames'])):
+                raise CommandError('Unknown user in: {}'.format(', '.join(options['usernames'])))
+
+        expenses = rebuild_rollups(Expense, ExpenseMonthlyRollup, 'category', owners)
+        income = rebuild_rollups(Userincome, IncomeMonthlyRollup, 'source', owners)
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt {} expense and {} income rollup rows.'.format(expenses, income)))
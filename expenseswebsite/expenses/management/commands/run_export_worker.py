@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from expenses.jobs import claim_job, fail_job, run_export_job
+from expenses.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = 'Render pending export jobs in a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes (default: one per CPU).')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait between polls when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no pending jobs are left instead of polling forever.')
+
+    def start_pool(self, processes):
+        # Spawned workers start clean instead of inheriting this process' database
+        # connections, and set Django up before the first job is unpickled
+        context = multiprocessing.get_context('spawn')
+        return ProcessPoolExecutor(processes, mp_context=context, initializer=django.setup)
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        # Job id of each submitted future
+        running = {}
+        pool = self.start_pool(processes)
+
+        try:
+            while True:
+                broken = False
+                free = processes - len(running)
+                pending = list(ExportJob.objects.filter(status=ExportJob.PENDING)
+                               .order_by('created_at').values_list('pk', flat=True)[:free]) if free else []
+                for pk in pending:
+                    if not claim_job(pk):
+                        continue
+                    try:
+                        running[pool.submit(run_export_job, pk)] = pk
+                    except BrokenProcessPool as error:
+                        self.fail(pk, error)
+                        broken = True
+                        break
+                connections.close_all()
+
+                if not running and not broken:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    broken |= self.finish(running.pop(future), future)
+
+                if broken:
+                    # A worker process died, e.g. killed for running out of memory, and took the pool down with
+                    # it. Every job still in the pool is lost, as there is no telling which one was to blame.
+                    pool.shutdown(cancel_futures=True)
+                    for future, pk in running.items():
+                        self.finish(pk, future)
+                    running.clear()
+                    pool = self.start_pool(processes)
+        finally:
+            pool.shutdown()
+
+    def finish(self, pk, future):
+        """
+        Report a finished job. Returns ``True`` if the pool it ran in is broken.
+        """
+        try:
+            future.result()
+        except BrokenProcessPool as error:
+            self.fail(pk, error)
+            return True
+        except Exception as error:
+            self.fail(pk, error)
+        else:
+            job = ExportJob.objects.get(pk=pk)
+            self.stdout.write('Export job {} {}'.format(job.pk, job.status))
+        return False
+
+    def fail(self, pk, error):
+        fail_job(pk, '{}: {}'.format(type(error).__name__, error))
+        self.stderr.write('Export job {} failed: {}'.format(pk, error))
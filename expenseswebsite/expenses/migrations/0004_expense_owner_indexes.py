@@ -0,0 +1,21 @@
+# Generated by Django 4.2.2 on 2026-10-17 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0003_expense_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['owner', '-date', '-id'], name='expense_owner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['owner', 'category'], name='expense_owner_category_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.2 on 2026-10-17 21:20
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Round
+
+import expenses.fields
+from expenses.search import install_search_index
+
+
+def amounts_to_minor_units(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    Expense.objects.update(amount=Round(F('amount') * 100))
+
+
+def amounts_to_major_units(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    Expense.objects.update(amount=F('amount') / 100.0)
+
+
+def restore_search_index(apps, schema_editor):
+    # SQLite drops the index triggers when AlterField rebuilds the table
+    install_search_index(schema_editor, apps.get_model('expenses', 'Expense')._meta.db_table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0004_expense_owner_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.RunPython(amounts_to_minor_units, amounts_to_major_units),
+        migrations.AlterField(
+            model_name='expense',
+            name='amount',
+            field=expenses.fields.MoneyField(),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['owner', 'amount'], name='expense_owner_amount_idx'),
+        ),
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+from expenses.search import install_search_index
+
+
+def link_categories(apps, schema_editor):
+    Category = apps.get_model('expenses', 'Category')
+    Expense = apps.get_model('expenses', 'Expense')
+
+    names = set(Expense.objects.values_list('category', flat=True).distinct())
+    names -= set(Category.objects.values_list('name', flat=True))
+    Category.objects.bulk_create(Category(name=name) for name in sorted(names))
+
+    Expense.objects.update(category_ref=Subquery(
+        Category.objects.filter(name=OuterRef('category')).order_by('pk').values('pk')[:1]))
+
+
+def unlink_categories(apps, schema_editor):
+    Category = apps.get_model('expenses', 'Category')
+    Expense = apps.get_model('expenses', 'Expense')
+
+    Expense.objects.update(category=Subquery(
+        Category.objects.filter(pk=OuterRef('category_ref')).values('name')[:1]))
+
+
+def restore_search_index(apps, schema_editor):
+    # SQLite drops the index triggers when a field change rebuilds the table
+    install_search_index(schema_editor, apps.get_model('expenses', 'Expense')._meta.db_table)
+
+
+# Only adds and fills in the new column; ``0007_expense_category_swap`` swaps it in. On PostgreSQL the
+# backfill leaves deferred foreign key checks pending until the transaction commits,
+# and a table with pending checks cannot be altered in the same transaction.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0005_expense_amount_minor_units'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.AddField(
+            model_name='expense',
+            name='category_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='expenses.category'),
+        ),
+        # Nullable so that unapplying can re-add the column before refilling it
+        migrations.AlterField(
+            model_name='expense',
+            name='category',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        # Before the backfill, which must be the last operation (see above)
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+        migrations.RunPython(link_categories, unlink_categories),
+    ]
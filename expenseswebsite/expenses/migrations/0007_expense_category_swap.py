@@ -0,0 +1,46 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from expenses.search import install_search_index
+
+
+def restore_search_index(apps, schema_editor):
+    # SQLite drops the index triggers when a field change rebuilds the table
+    install_search_index(schema_editor, apps.get_model('expenses', 'Expense')._meta.db_table)
+
+
+# Replaces the old category name column with the foreign key filled in by the previous migration
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0006_expense_category_foreign_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.RemoveIndex(
+            model_name='expense',
+            name='expense_owner_category_idx',
+        ),
+        migrations.RemoveField(
+            model_name='expense',
+            name='category',
+        ),
+        migrations.RenameField(
+            model_name='expense',
+            old_name='category_ref',
+            new_name='category',
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='expenses.category'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['owner', 'category'], name='expense_owner_category_idx'),
+        ),
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.2 on 2026-10-17 21:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import expenses.fields
+from expenses.rollups import rebuild_rollups
+
+
+def fill_rollups(apps, schema_editor):
+    rebuild_rollups(apps.get_model('expenses', 'Expense'), apps.get_model('expenses', 'ExpenseMonthlyRollup'), 'category')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0007_expense_category_swap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('total', expenses.fields.MoneyField(default=0)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='expenses.category')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'month'], name='expense_rollup_owner_month_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='expensemonthlyrollup',
+            constraint=models.UniqueConstraint(fields=('owner', 'category', 'month'), name='expense_rollup_owner_category_month_uniq'),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
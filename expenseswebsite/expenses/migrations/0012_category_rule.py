@@ -0,0 +1,34 @@
+# Generated by Django 4.2.2 on 2026-10-17 21:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import expenses.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0011_recurring_expense'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('keyword', 'Keyword'), ('regex', 'Regular expression')], default='keyword', max_length=10)),
+                ('pattern', models.CharField(blank=True, help_text='Leave empty to match on the amount only.', max_length=255)),
+                ('min_amount', expenses.fields.MoneyField(blank=True, null=True)),
+                ('max_amount', expenses.fields.MoneyField(blank=True, null=True)),
+                ('priority', models.PositiveIntegerField(default=100, help_text='Rules with a lower priority are tried first.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='expenses.category')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
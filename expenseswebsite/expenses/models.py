@@ -1,26 +1,44 @@
+import re
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.utils.timezone import now
 
+from .fields import MoneyField
+from .recurrence import InvalidRecurrence, next_occurrence, parse_rule
+
 
 
 
 # Create your models here.
 
 class Expense(models.Model):
-    amount = models.FloatField()
+    amount = MoneyField()
     date = models.DateField(default=now)
     description = models.TextField()
     owner = models.ForeignKey(to=User, on_delete=models.CASCADE)
-    category = models.CharField(max_length=255)
+    category = models.ForeignKey(to='Category', on_delete=models.PROTECT)
+    # Hash identifying a transaction imported from a bank statement, so re-imports skip it
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     def __str__(self):
-        return self.category
+        return str(self.category)
     
 
 
     class Meta:
         ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'fingerprint'], condition=models.Q(fingerprint__isnull=False),
+                                    name='expense_owner_fingerprint_uniq'),
+        ]
+        indexes = [
+            # Every list, summary and export filters by owner and sorts/filters by date
+            models.Index(fields=['owner', '-date', '-id'], name='expense_owner_date_idx'),
+            models.Index(fields=['owner', 'category'], name='expense_owner_category_idx'),
+            models.Index(fields=['owner', 'amount'], name='expense_owner_amount_idx'),
+        ]
 
     
 class Category(models.Model):
@@ -31,4 +49,163 @@ class Category(models.Model):
 
    
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class ExpenseMonthlyRollup(models.Model):
+    """
+    Running total and count of one owner's expenses per category and month.
+
+    Kept current by the signal handlers in ``expenses.rollups``; rebuild it with
+    ``manage.py rebuild_rollups`` after writes that bypass them.
+    """
+    owner = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    category = models.ForeignKey(to='Category', on_delete=models.CASCADE)
+    # First day of the month
+    month = models.DateField()
+    total = MoneyField(default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'category', 'month'],
+                                    name='expense_rollup_owner_category_month_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'month'], name='expense_rollup_owner_month_idx'),
+        ]
+
+
+class DataVersion(models.Model):
+    """
+    The data version of one owner's expenses and income; see ``expenses.cache``.
+
+    Kept in the database rather than in the cache so that every web worker and
+    management command sees the same version.
+    """
+    owner = models.OneToOneField(to=User, on_delete=models.CASCADE, primary_key=True)
+    # Nanoseconds since the epoch at the last change
+    version = models.BigIntegerField(default=0)
+
+
+class ExportJob(models.Model):
+    """
+    An export of one user's expenses or income, rendered by the export worker.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    LEDGER_CHOICES = [('expense', 'Expenses'), ('income', 'Income')]
+    FORMAT_CHOICES = [('csv', 'CSV'), ('xlsx', 'Excel'), ('pdf', 'PDF')]
+
+    owner = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    ledger = models.CharField(max_length=16, choices=LEDGER_CHOICES)
+    format = models.CharField(max_length=8, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    file = models.FileField(upload_to='exports/%Y/%m/%d', blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # When the rendered file is removed by ``cleanup_export_jobs``
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{} {} export ({})'.format(self.get_ledger_display(), self.format, self.status)
+
+    class Meta:
+        indexes = [
+            # The worker picks up the oldest pending jobs
+            models.Index(fields=['status', 'created_at'], name='export_job_status_idx'),
+            models.Index(fields=['expires_at'], name='export_job_expires_idx'),
+        ]
+
+
+class RecurringRule(models.Model):
+    """
+    A transaction repeated on an RRULE-style schedule; see ``expenses.recurrence``.
+
+    ``next_date`` is the first occurrence not yet written to the ledger and is
+    recomputed on every save from the rule, start date and ``occurrences``.
+    """
+    owner = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    amount = MoneyField()
+    description = models.TextField()
+    rule = models.CharField(max_length=255, help_text='e.g. FREQ=MONTHLY;BYMONTHDAY=1')
+    start_date = models.DateField(default=now)
+    next_date = models.DateField(null=True, blank=True, editable=False)
+    # Occurrences written so far
+    occurrences = models.PositiveIntegerField(default=0, editable=False)
+    active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        abstract = True
+
+    def clean(self):
+        try:
+            parse_rule(self.rule)
+        except InvalidRecurrence as error:
+            raise ValidationError({'rule': str(error)})
+
+    def save(self, *args, **kwargs):
+        self.next_date = next_occurrence(parse_rule(self.rule), self.start_date, self.occurrences)
+        if self.next_date is None:
+            self.active = False
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return '{} ({})'.format(self.description, self.rule)
+
+
+class RecurringExpense(RecurringRule):
+    category = models.ForeignKey(to='Category', on_delete=models.PROTECT)
+
+    class Meta:
+        indexes = [
+            # materialize_recurring reads the active rules that are due
+            models.Index(fields=['active', 'next_date'], name='recurring_expense_due_idx'),
+        ]
+
+
+class LabelRule(models.Model):
+    """
+    Picks the category or source of new and imported transactions from their
+    description and amount; see ``expenses.categorize``.
+    """
+    KEYWORD = 'keyword'
+    REGEX = 'regex'
+    KINDS = [(KEYWORD, 'Keyword'), (REGEX, 'Regular expression')]
+
+    # Rules without an owner apply to every user
+    owner = models.ForeignKey(to=User, on_delete=models.CASCADE, null=True, blank=True)
+    kind = models.CharField(max_length=10, choices=KINDS, default=KEYWORD)
+    pattern = models.CharField(max_length=255, blank=True, help_text='Leave empty to match on the amount only.')
+    min_amount = MoneyField(null=True, blank=True)
+    max_amount = MoneyField(null=True, blank=True)
+    priority = models.PositiveIntegerField(default=100, help_text='Rules with a lower priority are tried first.')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        abstract = True
+
+    def clean(self):
+        if self.kind == self.REGEX:
+            try:
+                re.compile(self.pattern)
+            except re.error as error:
+                raise ValidationError({'pattern': 'Invalid regular expression: {}'.format(error)})
+        if not self.pattern.strip() and self.min_amount is None and self.max_amount is None:
+            raise ValidationError('A rule needs a pattern or an amount range')
+        if self.min_amount is not None and self.max_amount is not None and self.min_amount > self.max_amount:
+            raise ValidationError({'max_amount': 'The maximum amount is below the minimum'})
+
+    def __str__(self):
+        return '{} {!r}'.format(self.get_kind_display(), self.pattern)
+
+
+class CategoryRule(LabelRule):
+    category = models.ForeignKey(to='Category', on_delete=models.CASCADE)
@@ -0,0 +1,191 @@
+"""
+Keyset (seek) pagination helpers.
+
+A page is fetched by filtering on the ordering columns of the last row already
+seen instead of using OFFSET, so every page costs the same as the first one.
+The position is handed to the client as an opaque, signed cursor.
+"""
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'expenses.pagination.cursor'
+
+# Rows per page on the expense and income lists, and the most a client may ask for
+LEDGER_PAGE_SIZE = getattr(settings, 'LEDGER_PAGE_SIZE', 5)
+LEDGER_MAX_PAGE_SIZE = getattr(settings, 'LEDGER_MAX_PAGE_SIZE', 100)
+
+# Newest first; the id makes the order unique so no row is skipped or repeated
+LEDGER_ORDERING = ('-date', '-id')
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a cursor was tampered with or built for another ordering.
+    """
+
+
+def encode_cursor(row, ordering):
+    """
+    Build an opaque cursor pointing just after ``row``.
+
+    Parameters:
+    - row: A dict (``values()`` row) or model instance.
+    - ordering: The ordering the rows were fetched with, e.g. ``('-date', '-id')``.
+
+    Returns:
+    - str: The signed cursor.
+    """
+    values = []
+    for field in ordering:
+        name = field.lstrip('-')
+        value = row[name] if isinstance(row, dict) else getattr(row, name)
+        if isinstance(value, date):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        values.append(value)
+    return signing.dumps([list(ordering), values], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor, ordering):
+    """
+    Return the ordering values stored in ``cursor``.
+
+    Raises:
+    - InvalidCursor: If the cursor is not valid for ``ordering``.
+    """
+    try:
+        cursor_ordering, values = signing.loads(cursor, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise InvalidCursor('Invalid cursor')
+    if cursor_ordering != list(ordering):
+        raise InvalidCursor('Cursor does not match the requested ordering')
+    return values
+
+
+def seek_filter(ordering, values):
+    """
+    Build the filter selecting the rows that come after ``values`` in ``ordering``.
+
+    For ``('-date', '-id')`` this is ``date <= d AND (date < d OR (date = d AND id < i))``.
+    The leading ``date <= d`` is redundant, but it gives the planner a single
+    range on the index to walk in order instead of OR-ing two scans and sorting.
+    """
+    first = ordering[0]
+    bound = '{}__lte'.format(first.lstrip('-')) if first.startswith('-') else '{}__gte'.format(first)
+    condition = Q()
+    for position, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = '{}__lt'.format(name) if field.startswith('-') else '{}__gt'.format(name)
+        step = Q(**{lookup: values[position]})
+        for previous, value in zip(ordering[:position], values):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return Q(**{bound: values[0]}) & condition
+
+
+def reverse_ordering(ordering):
+    """
+    Flip every direction in ``ordering``.
+    """
+    return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+
+def get_page_size(request, default=LEDGER_PAGE_SIZE, maximum=LEDGER_MAX_PAGE_SIZE):
+    """
+    Read the ``per_page`` query parameter, falling back to ``default``.
+    """
+    try:
+        per_page = int(request.GET.get('per_page', default))
+    except ValueError:
+        per_page = default
+    return max(1, min(per_page, maximum))
+
+
+class KeysetPage:
+    """
+    One page of a ``KeysetPaginator``, with cursors to its neighbours.
+    """
+
+    def __init__(self, object_list, ordering, has_next, has_previous):
+        self.object_list = object_list
+        self.ordering = ordering
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1], self.ordering) if self._has_next else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0], self.ordering) if self._has_previous else None
+
+
+class KeysetPaginator:
+    """
+    Seek-based stand-in for ``django.core.paginator.Paginator``.
+
+    Pages are addressed by the cursor of a neighbouring row rather than a page
+    number, so there is no ``COUNT(*)`` and no OFFSET: each page is one
+    ``LIMIT per_page + 1`` query on the ordering index, however deep it is.
+    """
+
+    def __init__(self, queryset, per_page, ordering=LEDGER_ORDERING):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+
+    def page(self, after=None, before=None):
+        """
+        Return the page following the ``after`` cursor or preceding the
+        ``before`` cursor, or the first page when neither is given.
+
+        Raises:
+        - InvalidCursor: If a cursor is invalid.
+        """
+        if before:
+            ordering = reverse_ordering(self.ordering)
+            queryset = self.queryset.filter(seek_filter(ordering, decode_cursor(before, self.ordering)))
+            rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            return KeysetPage(rows[:self.per_page][::-1], self.ordering, True, has_previous)
+
+        queryset = self.queryset
+        if after:
+            queryset = queryset.filter(seek_filter(self.ordering, decode_cursor(after, self.ordering)))
+        rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        return KeysetPage(rows[:self.per_page], self.ordering, has_next, bool(after))
+
+    def get_page(self, after=None, before=None):
+        """
+        Like ``page()``, but fall back to the first page on an invalid cursor
+        or when the cursor points past the last row (e.g. after deletions).
+        """
+        try:
+            page = self.page(after, before)
+        except InvalidCursor:
+            return self.page()
+        if not page and (after or before):
+            return self.page()
+        return page
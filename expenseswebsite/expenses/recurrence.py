@@ -0,0 +1,214 @@
+"""
+Recurring expenses and income.
+
+A rule repeats one transaction on an RRULE-style schedule such as
+``FREQ=MONTHLY;BYMONTHDAY=1`` or ``FREQ=WEEKLY;INTERVAL=2;COUNT=10``. The
+supported parts are ``FREQ`` (DAILY, WEEKLY, MONTHLY or YEARLY), ``INTERVAL``,
+``COUNT``, ``UNTIL`` and, for monthly and yearly rules, one ``BYMONTHDAY``
+(negative counts from the end of the month). Days past the end of a short month
+fall on its last day, so a rule for the 31st still fires in February.
+
+``manage.py materialize_recurring`` writes the due occurrences of all rules in
+batches. Every occurrence carries the fingerprint ``rule:<id>:<date>``, unique
+per owner, so rerunning the command never creates a transaction twice.
+"""
+import calendar
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import bump_data_version
+from .rollups import rebuild_rollups
+
+# Rules materialized per query, bulk insert and transaction
+RECURRING_BATCH_SIZE = getattr(settings, 'RECURRING_BATCH_SIZE', 1000)
+
+# Most occurrences one rule catches up on in a single run
+RECURRING_MAX_CATCH_UP = getattr(settings, 'RECURRING_MAX_CATCH_UP', 366)
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+
+
+class InvalidRecurrence(ValueError):
+    """
+    Raised for a schedule outside the supported RRULE subset.
+    """
+
+
+def parse_rule(rule):
+    """
+    Parse an RRULE string into a dict of ``freq``, ``interval``, ``count``,
+    ``until`` and ``bymonthday``.
+
+    Raises:
+    - InvalidRecurrence: If a part is unknown, repeated or invalid.
+    """
+    rule = rule.strip()
+    if rule.upper().startswith('RRULE:'):
+        rule = rule[len('RRULE:'):]
+    parts = {}
+    for part in filter(None, rule.split(';')):
+        name, _, value = part.partition('=')
+        name = name.strip().upper()
+        if name in parts:
+            raise InvalidRecurrence('{} is given twice'.format(name))
+        parts[name] = value.strip()
+
+    unknown = set(parts) - {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL', 'BYMONTHDAY'}
+    if unknown:
+        raise InvalidRecurrence('Unsupported rule part(s): {}'.format(', '.join(sorted(unknown))))
+    freq = parts.get('FREQ', '').upper()
+    if freq not in FREQUENCIES:
+        raise InvalidRecurrence('FREQ must be one of: {}'.format(', '.join(FREQUENCIES)))
+
+    try:
+        interval = int(parts.get('INTERVAL', 1))
+        count = int(parts['COUNT']) if 'COUNT' in parts else None
+        bymonthday = int(parts['BYMONTHDAY']) if 'BYMONTHDAY' in parts else None
+    except ValueError:
+        raise InvalidRecurrence('INTERVAL, COUNT and BYMONTHDAY must be whole numbers')
+    if interval < 1 or (count is not None and count < 1):
+        raise InvalidRecurrence('INTERVAL and COUNT must be positive')
+    if bymonthday is not None and (freq in ('DAILY', 'WEEKLY') or not 1 <= abs(bymonthday) <= 31):
+        raise InvalidRecurrence('BYMONTHDAY must be 1 to 31 or -31 to -1, for monthly and yearly rules')
+
+    until = None
+    if 'UNTIL' in parts:
+        value = parts['UNTIL']
+        try:
+            until = date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+        except ValueError:
+            raise InvalidRecurrence('UNTIL must be a date such as 20251231')
+
+    return {'freq': freq, 'interval': interval, 'count': count, 'until': until, 'bymonthday': bymonthday}
+
+
+def occurrence(schedule, start, index):
+    """
+    Return occurrence number ``index`` (from 0) of ``schedule`` starting at ``start``.
+    """
+    step = schedule['interval'] * index
+    if schedule['freq'] == 'DAILY':
+        return start + timedelta(days=step)
+    if schedule['freq'] == 'WEEKLY':
+        return start + timedelta(weeks=step)
+
+    period = 1 if schedule['freq'] == 'MONTHLY' else 12
+    months = step * period
+    if month_day(schedule, start.year, start.month, start.day) < start.day:
+        # The day falls before the start in the first month (or year), so the schedule begins a period later
+        months += period
+    year, month = divmod(start.month - 1 + months, 12)
+    year, month = start.year + year, month + 1
+    return date(year, month, month_day(schedule, year, month, start.day))
+
+
+def month_day(schedule, year, month, default):
+    last_day = calendar.monthrange(year, month)[1]
+    day = schedule['bymonthday'] or default
+    if day < 0:
+        day = max(last_day + 1 + day, 1)
+    return min(day, last_day)
+
+
+def next_occurrence(schedule, start, index):
+    """
+    Return occurrence number ``index``, or ``None`` once the schedule has ended.
+    """
+    if schedule['count'] is not None and index >= schedule['count']:
+        return None
+    day = occurrence(schedule, start, index)
+    if schedule['until'] is not None and day > schedule['until']:
+        return None
+    return day
+
+
+def due_occurrences(rule, today):
+    """
+    Return the dates of ``rule`` due up to ``today`` that are not yet
+    materialized, and the rule's next date after them (``None`` once it ends).
+    """
+    schedule = parse_rule(rule.rule)
+    index, day = rule.occurrences, rule.next_date
+    dates = []
+    while day is not None and day <= today and len(dates) < RECURRING_MAX_CATCH_UP:
+        dates.append(day)
+        index += 1
+        day = next_occurrence(schedule, rule.start_date, index)
+    return dates, day
+
+
+def occurrence_fingerprint(rule, day):
+    return 'rule:{}:{}'.format(rule.pk, day.isoformat())
+
+
+def materialize(rule_model, ledger_model, rollup_model, label_field, today=None, batch_size=None):
+    """
+    Write every due occurrence of the active rules of ``rule_model`` up to ``today``.
+
+    Rules are read in primary key order, ``batch_size`` at a time. Each batch
+    is one transaction: the occurrences are inserted with one ``bulk_create``
+    (occurrences that already exist are skipped by their fingerprint) and the
+    rules move on with one ``UPDATE`` per distinct next date. The rollups of
+    the owners with new occurrences are rebuilt once at the end, from the
+    earliest new month on.
+
+    Returns:
+    - tuple: ``(rules, occurrences)`` processed.
+    """
+    today = today or date.today()
+    batch_size = batch_size or RECURRING_BATCH_SIZE
+    label = '{}_id'.format(label_field)
+    due = rule_model.objects.filter(active=True, next_date__lte=today).order_by('pk')
+
+    rules_done = occurrences_done = 0
+    last_pk = 0
+    owners, since = set(), None
+    try:
+        while True:
+            rules = list(due.filter(pk__gt=last_pk)[:batch_size])
+            if not rules:
+                break
+            last_pk = rules[-1].pk
+
+            rows, changes = [], defaultdict(list)
+            for rule in rules:
+                dates, next_date = due_occurrences(rule, today)
+                # Most rules of a batch end up with the same change, so one UPDATE covers each group
+                changes[next_date, rule.occurrences + len(dates)].append(rule.pk)
+                rows.extend(ledger_model(owner_id=rule.owner_id, amount=rule.amount, description=rule.description,
+                                         date=day, fingerprint=occurrence_fingerprint(rule, day),
+                                         **{label: getattr(rule, label)})
+                            for day in dates)
+
+            with transaction.atomic():
+                ledger_model.objects.bulk_create(rows, ignore_conflicts=True)
+                for (next_date, occurrences), pks in changes.items():
+                    # The count is absolute, so overlapping runs over the same rules agree on it, and a run
+                    # that read a rule before another run moved it on cannot move it back
+                    rule_model.objects.filter(pk__in=pks, occurrences__lte=occurrences).update(
+                        next_date=next_date, active=next_date is not None, occurrences=occurrences)
+
+            if rows:
+                owners.update(row.owner_id for row in rows)
+                earliest = min(row.date for row in rows)
+                since = earliest if since is None else min(since, earliest)
+            rules_done += len(rules)
+            occurrences_done += len(rows)
+    finally:
+        finish(ledger_model, rollup_model, label_field, owners, since, batch_size)
+    return rules_done, occurrences_done
+
+
+def finish(ledger_model, rollup_model, label_field, owners, since, batch_size):
+    """
+    Bring the rollups and data versions of ``owners`` up to date after the inserts.
+    """
+    owners = sorted(owners)
+    for start in range(0, len(owners), batch_size):
+        # One grouped query per chunk of owners instead of a rollup update per (label, month) of every batch
+        rebuild_rollups(ledger_model, rollup_model, label_field, owners[start:start + batch_size], since)
+    for owner_id in owners:
+        bump_data_version(owner_id)
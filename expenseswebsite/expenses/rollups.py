@@ -0,0 +1,124 @@
+"""
+Per-user monthly rollups of the expense and income ledgers.
+
+Each ledger row contributes its amount and a count of one to the rollup row for
+its (owner, label, month). Saves and deletes through the ORM keep the rollups
+current via the signal handlers connected by ``connect_rollup``; bulk writes
+(``bulk_create``, ``QuerySet.update``/``delete``) bypass signals and must call
+``rebuild_rollups`` for the owners they touched.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import post_delete, post_save, pre_save
+
+
+def month_start(value):
+    """
+    Return the first day of the month of ``value``.
+    """
+    return value.replace(day=1)
+
+
+def apply_rollup_delta(rollup_model, label_field, owner_id, label_id, month, total, count):
+    """
+    Add ``total`` and ``count`` (either may be negative) to one rollup row,
+    creating it if needed and dropping it once its count reaches zero.
+    """
+    key = {'owner_id': owner_id, '{}_id'.format(label_field): label_id, 'month': month}
+    total_field = rollup_model._meta.get_field('total')
+    changes = {
+        'total': F('total') + Value(total, output_field=total_field),
+        'count': F('count') + count,
+    }
+
+    with transaction.atomic():
+        if not rollup_model.objects.filter(**key).update(**changes):
+            try:
+                with transaction.atomic():
+                    rollup_model.objects.create(total=total, count=count, **key)
+            except IntegrityError:
+                # Another request created the row first
+                rollup_model.objects.filter(**key).update(**changes)
+        rollup_model.objects.filter(count__lte=0, **key).delete()
+
+
+def rebuild_rollups(ledger_model, rollup_model, label_field, owners=None, since=None):
+    """
+    Recompute the rollups of ``ledger_model`` from scratch with one grouped query.
+
+    Parameters:
+    - ledger_model: ``Expense`` or ``Userincome`` (historical models work too).
+    - rollup_model: The matching rollup model.
+    - label_field: ``'category'`` or ``'source'``.
+    - owners: Optional iterable of user ids to limit the rebuild to.
+    - since: Optional date; only the months from the one holding it on are rebuilt.
+
+    Returns:
+    - int: The number of rollup rows written.
+    """
+    ledger = ledger_model.objects.all()
+    rollups = rollup_model.objects.all()
+    if owners is not None:
+        owners = list(owners)
+        ledger = ledger.filter(owner_id__in=owners)
+        rollups = rollups.filter(owner_id__in=owners)
+    if since is not None:
+        ledger = ledger.filter(date__gte=month_start(since))
+        rollups = rollups.filter(month__gte=month_start(since))
+
+    label = '{}_id'.format(label_field)
+    grouped = (ledger
+               .annotate(month=TruncMonth('date'))
+               .values('owner_id', label, 'month')
+               .annotate(total=Sum('amount'), count=Count('id'))
+               .order_by())
+
+    with transaction.atomic():
+        rollups.delete()
+        created = rollup_model.objects.bulk_create(
+            (rollup_model(**row) for row in grouped.iterator()), batch_size=1000)
+    return len(created)
+
+
+def connect_rollup(ledger_model, rollup_model, label_field):
+    """
+    Keep ``rollup_model`` current as ``ledger_model`` rows are saved and deleted.
+    """
+    label = '{}_id'.format(label_field)
+    date_field = ledger_model._meta.get_field('date')
+    amount_field = ledger_model._meta.get_field('amount')
+
+    def contribution(owner_id, label_id, date, amount):
+        return (owner_id, label_id, month_start(date_field.to_python(date)),
+                amount_field.to_python(amount))
+
+    def remember_previous(sender, instance, raw=False, **kwargs):
+        # The row as it is stored now, so an edit can move its amount out of the old bucket
+        previous = None
+        if instance.pk is not None and not raw:
+            previous = (sender.objects.filter(pk=instance.pk)
+                        .values_list('owner_id', label, 'date', 'amount').first())
+        instance._rollup_previous = previous
+
+    def record_save(sender, instance, raw=False, **kwargs):
+        if raw:
+            return
+        previous = getattr(instance, '_rollup_previous', None)
+        if previous is not None:
+            owner_id, label_id, month, amount = contribution(*previous)
+            apply_rollup_delta(rollup_model, label_field, owner_id, label_id, month, -amount, -1)
+        owner_id, label_id, month, amount = contribution(
+            instance.owner_id, getattr(instance, label), instance.date, instance.amount)
+        apply_rollup_delta(rollup_model, label_field, owner_id, label_id, month, amount, 1)
+        instance._rollup_previous = None
+
+    def record_delete(sender, instance, **kwargs):
+        owner_id, label_id, month, amount = contribution(
+            instance.owner_id, getattr(instance, label), instance.date, instance.amount)
+        apply_rollup_delta(rollup_model, label_field, owner_id, label_id, month, -amount, -1)
+
+    uid = 'rollup-{}'.format(ledger_model._meta.label_lower)
+    pre_save.connect(remember_previous, sender=ledger_model, weak=False, dispatch_uid=uid)
+    post_save.connect(record_save, sender=ledger_model, weak=False, dispatch_uid=uid)
+    post_delete.connect(record_delete, sender=ledger_model, weak=False, dispatch_uid=uid)
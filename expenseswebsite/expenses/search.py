@@ -0,0 +1,303 @@
+"""
+Indexed search over the expense and income ledgers.
+
+Descriptions are matched through a full-text index: a GIN index over
+``to_tsvector('simple', description)`` on PostgreSQL and an FTS5 table kept in
+sync by triggers on SQLite. Amount and date terms are turned into range
+predicates and category/source terms are resolved against the (small) lookup
+table, so every branch of a search can be answered from an index instead of a
+scan over the user's whole ledger.
+"""
+import re
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import BooleanField, F, FloatField, Func, Q, Value
+
+from .fields import MoneyField
+from .pagination import decode_cursor, encode_cursor, seek_filter
+
+# Maximum number of rows returned for a single search request
+SEARCH_RESULTS_LIMIT = getattr(settings, 'SEARCH_RESULTS_LIMIT', 50)
+
+# Number of rows returned when the client does not ask for a page size
+SEARCH_PAGE_SIZE = getattr(settings, 'SEARCH_PAGE_SIZE', 20)
+
+# Matching rows are counted up to this many for the total estimate
+SEARCH_TOTAL_CAP = getattr(settings, 'SEARCH_TOTAL_CAP', 1000)
+
+SEARCH_ORDERING = ('-rank', '-date', '-id')
+
+# Ids are only unique per ledger, so cross-ledger pages also order on the type
+TRANSACTION_ORDERING = ('-rank', '-date', 'type', '-id')
+
+# Text search configuration used by the PostgreSQL index and queries
+SEARCH_CONFIG = 'simple'
+
+TOKEN_RE = re.compile(r'\w+')
+AMOUNT_RE = re.compile(r'^\d+(\.\d*)?$')
+DATE_RE = re.compile(r'^(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?$')
+
+
+def fts_table(table):
+    """
+    Name of the SQLite FTS5 table that indexes ``table``.
+    """
+    return '{}_fts'.format(table)
+
+
+def install_search_index(schema_editor, table, column='description'):
+    """
+    Create the full-text index over ``table.column`` for the current database.
+
+    Safe to run repeatedly. On SQLite the sync triggers are lost whenever
+    Django rebuilds the table during a migration, so migrations that alter a
+    ledger table call this again afterwards.
+    """
+    vendor = schema_editor.connection.vendor
+    qn = schema_editor.quote_name
+
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS {index} ON {table} "
+            "USING gin (to_tsvector('{config}', {column}))".format(
+                index=qn('{}_{}_fts'.format(table, column)), table=qn(table),
+                config=SEARCH_CONFIG, column=qn(column)))
+
+    elif vendor == 'sqlite':
+        fts = fts_table(table)
+        statements = [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            "{column}, content='{table}', content_rowid='id')",
+
+            "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            "INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+
+            "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END",
+
+            "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+            "INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+
+            "INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+        ]
+        for statement in statements:
+            schema_editor.execute(statement.format(fts=fts, table=table, column=column))
+
+
+def drop_search_index(schema_editor, table, column='description'):
+    """
+    Remove the full-text index created by ``install_search_index``.
+    """
+    vendor = schema_editor.connection.vendor
+    qn = schema_editor.quote_name
+
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(qn('{}_{}_fts'.format(table, column))))
+
+    elif vendor == 'sqlite':
+        fts = fts_table(table)
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS {}_{}'.format(fts, suffix))
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(fts))
+
+
+class TextMatch(Func):
+    """
+    True when the row's text column matches every search token as a prefix.
+
+    Takes the primary key and the text column so each backend can use
+    whichever its index is keyed on.
+    """
+    output_field = BooleanField()
+
+    def __init__(self, pk, text, tokens, **extra):
+        super().__init__(pk, text, **extra)
+        self.tokens = tokens
+
+    def as_postgresql(self, compiler, connection):
+        text_sql, params = compiler.compile(self.source_expressions[1])
+        query = ' & '.join('{}:*'.format(token) for token in self.tokens)
+        sql = "to_tsvector('{0}', {1}) @@ to_tsquery('{0}', %s)".format(SEARCH_CONFIG, text_sql)
+        return sql, (*params, query)
+
+    def as_sqlite(self, compiler, connection):
+        pk_sql, params = compiler.compile(self.source_expressions[0])
+        fts = fts_table(self.source_expressions[0].target.model._meta.db_table)
+        query = ' '.join('"{}"*'.format(token) for token in self.tokens)
+        sql = '{} IN (SELECT rowid FROM {fts} WHERE {fts} MATCH %s)'.format(pk_sql, fts=fts)
+        return sql, (*params, query)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # Backends without a full-text index fall back to substring matching
+        text_sql, text_params = compiler.compile(self.source_expressions[1])
+        clauses, params = [], []
+        for token in self.tokens:
+            clauses.append('UPPER({}) LIKE UPPER(%s)'.format(text_sql))
+            params.extend((*text_params, '%{}%'.format(token)))
+        return '({})'.format(' AND '.join(clauses)), tuple(params)
+
+
+class TextRank(TextMatch):
+    """
+    Relevance of the row's text column for the search tokens; 0 when it does
+    not match. Higher is better on every backend.
+    """
+    output_field = FloatField()
+
+    def as_postgresql(self, compiler, connection):
+        text_sql, params = compiler.compile(self.source_expressions[1])
+        query = ' & '.join('{}:*'.format(token) for token in self.tokens)
+        # ts_rank() is a real; as a double it compares equal to the float a cursor stores, so ties page exactly
+        sql = "ts_rank(to_tsvector('{0}', {1}), to_tsquery('{0}', %s))::double precision".format(
+            SEARCH_CONFIG, text_sql)
+        return sql, (*params, query)
+
+    def as_sqlite(self, compiler, connection):
+        pk_sql, params = compiler.compile(self.source_expressions[0])
+        fts = fts_table(self.source_expressions[0].target.model._meta.db_table)
+        query = ' '.join('"{}"*'.format(token) for token in self.tokens)
+        # FTS5's rank is bm25(), where lower is better
+        sql = 'COALESCE((SELECT -rank FROM {fts} WHERE {fts} MATCH %s AND rowid = {pk}), 0)'.format(
+            fts=fts, pk=pk_sql)
+        return sql, (query, *params)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(compiler, connection, **extra_context)
+        return 'CASE WHEN {} THEN 1.0 ELSE 0.0 END'.format(sql), params
+
+
+def amount_range(search_str):
+    """
+    Return the ``[low, high)`` amount range a numeric search string stands for,
+    e.g. ``'12'`` -> 12 to 13 and ``'12.5'`` -> 12.5 to 12.6, or None. Numbers
+    beyond what an amount can be give None, and ranges running past the
+    largest amount an open ``high`` of None.
+    """
+    if not AMOUNT_RE.match(search_str):
+        return None
+    try:
+        low = Decimal(search_str.rstrip('.'))
+    except InvalidOperation:
+        return None
+    if low >= MoneyField.max_amount:
+        return None
+    decimals = len(search_str.partition('.')[2])
+    high = low + Decimal(1).scaleb(-decimals)
+    return low, high if high <= MoneyField.max_amount else None
+
+
+def date_range(search_str):
+    """
+    Return the ``[low, high)`` date range for a ``YYYY``, ``YYYY-MM`` or
+    ``YYYY-MM-DD`` search string, or None.
+    """
+    match = DATE_RE.match(search_str)
+    if not match:
+        return None
+    year, month, day = (int(part) if part else None for part in match.groups())
+    try:
+        if day:
+            low = date(year, month, day)
+            return low, low + timedelta(days=1)
+        if month:
+            low = date(year, month, 1)
+            return low, date(year + month // 12, month % 12 + 1, 1)
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    except ValueError:
+        return None
+
+
+def search_ledger(queryset, search_str, label_field, label_model):
+    """
+    Search a ledger queryset, best matches first.
+
+    Parameters:
+    - queryset: The owner-filtered Expense or Userincome queryset.
+    - search_str: The text typed by the user.
+    - label_field: The name of the category/source foreign key on the ledger model.
+    - label_model: The lookup model holding the category/source names.
+
+    Returns:
+    - QuerySet: The matching rows annotated with ``rank``, in ``SEARCH_ORDERING``.
+    """
+    search_str = (search_str or '').strip()
+    tokens = TOKEN_RE.findall(search_str)
+    if not tokens:
+        # Still annotated, so that callers can select and order on the rank
+        return queryset.none().annotate(rank=Value(0.0, output_field=FloatField())).order_by(*SEARCH_ORDERING)
+
+    condition = Q(TextMatch(F('pk'), F('description'), tokens))
+    condition |= Q(**{label_field + '__in': label_model.objects.filter(
+        name__icontains=search_str).values('pk')})
+
+    amounts = amount_range(search_str)
+    if amounts:
+        low, high = amounts
+        condition |= Q(amount__gte=low, amount__lt=high) if high is not None else Q(amount__gte=low)
+
+    dates = date_range(search_str)
+    if dates:
+        condition |= Q(date__gte=dates[0], date__lt=dates[1])
+
+    return queryset.filter(condition).annotate(
+        rank=TextRank(F('pk'), F('description'), tokens),
+    ).order_by(*SEARCH_ORDERING)
+
+
+def search_page(results, params, fields, ordering=SEARCH_ORDERING):
+    """
+    Return one bounded page of search results.
+
+    Parameters:
+    - results: The queryset returned by ``search_ledger``, or a list of them
+      (with matching columns) to be combined into one UNION ALL query.
+    - params: The decoded request body; ``cursor``, ``pageSize`` and
+      ``fields`` are all optional.
+    - fields: The columns the client is allowed to ask for, as a mapping of
+      response key to ``values()`` lookup (e.g. ``'category': 'category__name'``).
+    - ordering: The unique ordering the pages are cut from.
+
+    Returns:
+    - dict: ``results``, ``next_cursor`` (None on the last page) and, on the
+      first page only, ``total_estimate`` (capped at ``SEARCH_TOTAL_CAP``).
+
+    Raises:
+    - InvalidCursor: If ``params['cursor']`` is not a valid search cursor.
+    """
+    try:
+        page_size = int(params.get('pageSize') or SEARCH_PAGE_SIZE)
+    except (TypeError, ValueError):
+        page_size = SEARCH_PAGE_SIZE
+    page_size = max(1, min(page_size, SEARCH_RESULTS_LIMIT))
+
+    requested = [field for field in params.get('fields') or ()
+                 if isinstance(field, str) and field in fields] or list(fields)
+    columns = dict.fromkeys([fields[field] for field in requested] + [field.lstrip('-') for field in ordering])
+
+    parts = list(results) if isinstance(results, (list, tuple)) else [results]
+    cursor = params.get('cursor')
+    if cursor:
+        seek = seek_filter(ordering, decode_cursor(cursor, ordering))
+        parts = [part.filter(seek) for part in parts]
+    parts = [part.values(*columns) for part in parts]
+
+    if len(parts) > 1:
+        # Each side is filtered on its own index; the database does the one sort/limit
+        results = parts[0].order_by().union(*(part.order_by() for part in parts[1:]), all=True)
+    else:
+        results = parts[0]
+
+    response = {}
+    if not cursor:
+        response['total_estimate'] = results.order_by()[:SEARCH_TOTAL_CAP].count()
+
+    rows = list(results.order_by(*ordering)[:page_size + 1])
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+
+    response['next_cursor'] = encode_cursor(rows[-1], ordering) if has_next else None
+    response['results'] = [{field: row[fields[field]] for field in requested} for row in rows]
+    return response
@@ -0,0 +1,244 @@
+"""
+Import of OFX and QIF bank statements into the expense and income ledgers.
+
+Debits become expenses and credits income. Transactions without a category
+(a QIF ``L`` line) get the one the owner's categorization rules pick, or else
+``STATEMENT_DEFAULT_LABEL``. Every imported row stores a fingerprint of its
+date, signed amount, normalized description and (OFX) FITID, unique per owner,
+so importing an overlapping statement again only adds the transactions that
+are new. Duplicates are found with one query per batch.
+"""
+import hashlib
+import re
+from collections import Counter
+from datetime import date
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .imports import (IMPORT_BATCH_SIZE, IMPORT_MAX_ERRORS, InvalidImportFile, LedgerImport, RowError,
+                      amount_error)
+
+# Category/source of statement lines that do not name one
+STATEMENT_DEFAULT_LABEL = getattr(settings, 'STATEMENT_DEFAULT_LABEL', 'Uncategorized')
+
+OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)(?=</STMTTRN>|<STMTTRN>|</BANKTRANLIST>|$)', re.DOTALL | re.IGNORECASE)
+# Matches both SGML (``<TRNAMT>-1.00``) and XML (``<TRNAMT>-1.00</TRNAMT>``) elements
+OFX_ELEMENT = re.compile(r'<(\w+)>([^<\r\n]*)')
+OFX_FIELDS = {'DTPOSTED': 'date', 'TRNAMT': 'amount', 'NAME': 'name', 'MEMO': 'memo', 'FITID': 'fitid'}
+
+QIF_FIELDS = {'D': 'date', 'T': 'amount', 'U': 'amount', 'P': 'payee', 'M': 'memo', 'L': 'label'}
+
+
+def decode_statement(data):
+    """
+    Decode a statement file; older OFX and QIF files are often Windows-1252.
+    """
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return data.decode('cp1252', errors='replace')
+
+
+def statement_format(filename, text):
+    """
+    Tell an OFX (or QFX) statement from a QIF one by file name or content.
+
+    Raises:
+    - InvalidImportFile: If the file is neither.
+    """
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    head = text[:1024].upper()
+    if extension in ('ofx', 'qfx') or 'OFXHEADER' in head or '<OFX>' in head:
+        return 'ofx'
+    if extension == 'qif' or text.lstrip().startswith('!'):
+        return 'qif'
+    raise InvalidImportFile('The file must be an OFX or QIF statement')
+
+
+def ofx_records(text):
+    """
+    Yield ``(line, fields)`` for every transaction of an OFX statement.
+    """
+    line, position = 1, 0
+    for match in OFX_TRANSACTION.finditer(text):
+        # Count only the newlines since the previous transaction, not from the start of the file every time
+        line += text.count('\n', position, match.start())
+        position = match.start()
+        fields = {}
+        for tag, value in OFX_ELEMENT.findall(match.group(1)):
+            if tag.upper() in OFX_FIELDS:
+                fields[OFX_FIELDS[tag.upper()]] = value.strip()
+        yield line, fields
+
+
+def qif_records(text):
+    """
+    Yield ``(line, fields)`` for every transaction of a QIF statement.
+
+    Split lines are ignored; the transaction total is imported.
+    """
+    fields, start = {}, None
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('!'):
+            continue
+        if line == '^':
+            if fields:
+                yield start, fields
+            fields, start = {}, None
+            continue
+        start = start or number
+        if line[0] in QIF_FIELDS:
+            fields.setdefault(QIF_FIELDS[line[0]], line[1:].strip())
+    if fields:
+        yield start, fields
+
+
+def parse_ofx_date(value):
+    # YYYYMMDD, optionally followed by the time and time zone
+    return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+
+
+def parse_qif_date(value, day_first=False):
+    # 12/31/2023, 12/31'23, 1/ 5/24 or 2023-12-31
+    parts = [int(part) for part in re.split(r"[/'.-]", value.replace(' ', ''))]
+    if len(parts) != 3:
+        raise ValueError(value)
+    if parts[0] > 31:
+        year, month, day = parts
+    elif day_first:
+        day, month, year = parts
+    else:
+        month, day, year = parts
+    if year < 100:
+        year += 2000 if year < 70 else 1900
+    return date(year, month, day)
+
+
+def fingerprint(day, amount, description, fitid, occurrence):
+    """
+    Return the hex digest identifying one statement transaction.
+
+    ``occurrence`` numbers identical transactions within a statement, so two
+    equal coffees on one day are both kept and both recognised on re-import.
+    """
+    normalized = ' '.join(description.casefold().split())
+    key = '|'.join([day.isoformat(), str(amount), normalized, fitid, str(occurrence)])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class StatementImport:
+    """
+    Import of one bank statement into an owner's expenses and income.
+    """
+
+    def __init__(self, owner, batch_size=None, day_first=False):
+        self.ledgers = {'expense': LedgerImport(owner, 'expense', batch_size),
+                        'income': LedgerImport(owner, 'income', batch_size)}
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
+        self.day_first = day_first
+        self.occurrences = Counter()
+        self.errors = []
+        self.error_count = 0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def parse(self, fields, statement_type):
+        """
+        Build an unsaved expense or income row from a statement transaction.
+
+        Returns:
+        - tuple: ``(ledger, row)``.
+
+        Raises:
+        - RowError: If the date or amount is missing or invalid.
+        """
+        amount = fields.get('amount', '').replace(',', '' if statement_type == 'qif' else '.')
+        try:
+            amount = self.ledgers['expense'].amount_field.to_python(amount)
+        except ValidationError as error:
+            raise RowError(amount_error(error))
+        if not amount:
+            raise RowError('Amount is zero')
+        try:
+            if statement_type == 'ofx':
+                day = parse_ofx_date(fields.get('date', ''))
+            else:
+                day = parse_qif_date(fields.get('date', ''), self.day_first)
+        except ValueError:
+            raise RowError('Invalid date: {!r}'.format(fields.get('date', '')))
+
+        name = fields.get('name') or fields.get('payee') or ''
+        memo = fields.get('memo', '')
+        description = '{} - {}'.format(name, memo) if name and memo and memo != name else name or memo
+        if not description:
+            raise RowError('Description is required')
+        label = (fields.get('label') or '').split('/')[0].strip()
+
+        ledger = 'expense' if amount < 0 else 'income'
+        ledger_import = self.ledgers[ledger]
+        if label:
+            label_id = ledger_import.label_id(label)
+        else:
+            label_id = ledger_import.categorize(description, abs(amount))
+            if label_id is None:
+                label_id = ledger_import.label_id(STATEMENT_DEFAULT_LABEL)
+        key = (day, amount, ' '.join(description.casefold().split()), fields.get('fitid', ''))
+        self.occurrences[key] += 1
+
+        row = ledger_import.model(
+            owner_id=ledger_import.owner_id, amount=abs(amount), description=description, date=day,
+            fingerprint=fingerprint(day, amount, description, fields.get('fitid', ''), self.occurrences[key]),
+            **{'{}_id'.format(ledger_import.label_field): label_id})
+        return ledger, row
+
+    def run(self, text, statement_type):
+        """
+        Import the decoded statement ``text`` of type ``'ofx'`` or ``'qif'``.
+
+        Returns:
+        - dict: ``expenses`` and ``income`` rows created, ``duplicates``
+          skipped, ``error_count`` and the first ``IMPORT_MAX_ERRORS`` ``errors``.
+        """
+        records = ofx_records(text) if statement_type == 'ofx' else qif_records(text)
+        batches = {ledger: [] for ledger in self.ledgers}
+        try:
+            for line, fields in records:
+                try:
+                    ledger, row = self.parse(fields, statement_type)
+                except RowError as error:
+                    self.add_error(line, str(error))
+                    continue
+                batches[ledger].append(row)
+                if len(batches[ledger]) >= self.batch_size:
+                    self.ledgers[ledger].insert(batches[ledger])
+                    batches[ledger] = []
+            for ledger, batch in batches.items():
+                if batch:
+                    self.ledgers[ledger].insert(batch)
+        finally:
+            for ledger_import in self.ledgers.values():
+                ledger_import.finish()
+
+        return {
+            'expenses': self.ledgers['expense'].created,
+            'income': self.ledgers['income'].created,
+            'duplicates': sum(ledger_import.duplicates for ledger_import in self.ledgers.values()),
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def import_statement(owner, filename, data, batch_size=None, day_first=False):
+    """
+    Import the bank statement file ``data`` (bytes) into ``owner``'s ledgers.
+
+    Raises:
+    - InvalidImportFile: If the file is not an OFX or QIF statement.
+    """
+    text = decode_statement(data)
+    return StatementImport(owner, batch_size, day_first).run(text, statement_format(filename, text))
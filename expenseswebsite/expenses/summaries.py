@@ -0,0 +1,138 @@
+"""
+Time-series summaries of a ledger, grouped by label and period in the database.
+
+Only one row per (period, label) bucket leaves the database, so the cost of a
+summary follows the number of buckets instead of the number of transactions.
+"""
+from datetime import date, timedelta
+
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Trunc
+
+# Window used when the request does not give a start date
+SUMMARY_DEFAULT_DAYS = 30 * 6
+
+# Period widths a summary can be bucketed by
+SUMMARY_GRANULARITIES = ('day', 'week', 'month', 'year')
+SUMMARY_DEFAULT_GRANULARITY = 'month'
+
+# Granularities the monthly rollups can answer
+ROLLUP_GRANULARITIES = ('month', 'year')
+
+
+class InvalidSummaryRequest(ValueError):
+    """
+    Raised when the summary window or granularity cannot be parsed.
+    """
+
+
+def month_end(value):
+    """
+    Return the last day of the month of ``value``.
+    """
+    return (value.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def summary_window(params):
+    """
+    Read the summary window from request parameters.
+
+    Parameters:
+    - params: A mapping with optional ``start``/``end`` ISO dates and ``granularity``.
+
+    Returns:
+    - tuple: ``(start, end, granularity)``; the window defaults to the last six months.
+
+    Raises:
+    - InvalidSummaryRequest: If a date or the granularity is invalid.
+    """
+    try:
+        end = date.fromisoformat(params['end']) if params.get('end') else date.today()
+        start = (date.fromisoformat(params['start']) if params.get('start')
+                 else end - timedelta(days=SUMMARY_DEFAULT_DAYS))
+    except (TypeError, ValueError):
+        raise InvalidSummaryRequest('Dates must be given as YYYY-MM-DD')
+    if start > end:
+        raise InvalidSummaryRequest('start must not be after end')
+
+    granularity = params.get('granularity') or SUMMARY_DEFAULT_GRANULARITY
+    if granularity not in SUMMARY_GRANULARITIES:
+        raise InvalidSummaryRequest(
+            'granularity must be one of: {}'.format(', '.join(SUMMARY_GRANULARITIES)))
+    return start, end, granularity
+
+
+def summary_queryset(queryset, label_field, start, end, granularity):
+    """
+    Build the grouped query: one ``(period, label, total, count)`` row per bucket.
+    """
+    return (queryset
+            .filter(date__gte=start, date__lte=end)
+            .annotate(period=Trunc('date', granularity, output_field=DateField()))
+            .values('period', label=F('{}__name'.format(label_field)))
+            .annotate(total=Sum('amount'), count=Count('id'))
+            .order_by('period', 'label'))
+
+
+def rollup_summary_queryset(rollups, label_field, start, end, granularity):
+    """
+    Like ``summary_queryset``, but read from the monthly rollups; only valid
+    for ``month`` and ``year`` granularity over whole months.
+    """
+    return (rollups
+            .filter(month__gte=start, month__lte=end)
+            .annotate(period=Trunc('month', granularity, output_field=DateField()))
+            .values('period', label=F('{}__name'.format(label_field)))
+            .annotate(total=Sum('total'), count=Sum('count'))
+            .order_by('period', 'label'))
+
+
+def ledger_summary(queryset, label_field, start, end, granularity, rollups=None):
+    """
+    Summarise ``queryset`` per label and period as compact, chart-ready arrays.
+
+    Parameters:
+    - queryset: The owner's expenses or income.
+    - label_field: ``'category'`` or ``'source'``.
+    - start, end: The inclusive date window.
+    - granularity: One of ``SUMMARY_GRANULARITIES``.
+    - rollups: Optional queryset of the owner's monthly rollups. When given,
+      ``month`` and ``year`` summaries read it instead of the ledger and the
+      window is widened to whole months.
+
+    Returns:
+    - dict: ``periods`` and ``labels`` are the axes; ``series[i][j]`` is the
+      total of ``labels[i]`` in ``periods[j]``, and ``totals``/``counts`` are
+      per label over the whole window. Periods without data are left out.
+    """
+    if rollups is not None and granularity in ROLLUP_GRANULARITIES:
+        start, end = start.replace(day=1), month_end(end)
+        rows = list(rollup_summary_queryset(rollups, label_field, start, end, granularity))
+    else:
+        rows = list(summary_queryset(queryset, label_field, start, end, granularity))
+
+    periods = sorted({row['period'] for row in rows})
+    labels = sorted({row['label'] for row in rows})
+    period_index = {period: index for index, period in enumerate(periods)}
+    label_index = {label: index for index, label in enumerate(labels)}
+
+    series = [[0.0] * len(periods) for _ in labels]
+    totals = [0] * len(labels)
+    counts = [0] * len(labels)
+    for row in rows:
+        position = label_index[row['label']]
+        # Amounts are exact Decimals; the charts only need plain numbers
+        series[position][period_index[row['period']]] = float(row['total'])
+        totals[position] += row['total']
+        counts[position] += row['count']
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'granularity': granularity,
+        'periods': [period.isoformat() for period in periods],
+        'labels': labels,
+        'series': series,
+        'totals': [float(total) for total in totals],
+        'counts': counts,
+    }
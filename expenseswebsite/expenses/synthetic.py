@@ -0,0 +1,172 @@
+"""
+Deterministic synthetic ledgers for load and scale testing.
+
+``manage.py generate_ledger`` creates users with expenses and income spread
+evenly over a date span. Every random choice comes from a generator seeded
+with the seed and the user's number, so the same arguments always rebuild the
+same dataset, whatever the batch size. Each user favours some categories and
+sources over others: the k-th of a per-user shuffle is picked with weight
+``1 / k ** skew``. Amounts are log-normal around a typical amount per category.
+
+Rows are written with ``bulk_create`` in batches of ``SYNTHETIC_BATCH_SIZE``,
+each batch in its own transaction. Bulk inserts bypass the model signals, so
+the rollups of the new users are rebuilt at the end.
+"""
+import math
+import random
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from userincome.models import IncomeMonthlyRollup, Source, Userincome
+from userpreferences.models import UserPreference
+
+from .models import Category, Expense, ExpenseMonthlyRollup
+from .rollups import rebuild_rollups
+
+# Users or ledger rows per bulk_create and transaction
+SYNTHETIC_BATCH_SIZE = getattr(settings, 'SYNTHETIC_BATCH_SIZE', 10000)
+
+SYNTHETIC_CURRENCY = 'USD - United States Dollar'
+
+# name, typical amount, spread (sigma of the log-normal), merchants
+SYNTHETIC_CATEGORIES = [
+    ('Groceries', 45, 0.6, ['Tesco', 'Aldi', 'Lidl', 'Whole Foods', 'Trader Joe\'s', 'Corner shop']),
+    ('Restaurants', 35, 0.5, ['Pizza Express', 'Nando\'s', 'Sushi bar', 'Thai kitchen', 'Burger joint']),
+    ('Coffee', 4, 0.3, ['Starbucks', 'Costa Coffee', 'Pret A Manger', 'Blue Bottle']),
+    ('Transport', 12, 0.7, ['Uber', 'Lyft', 'Metro card', 'Train ticket', 'Bus pass']),
+    ('Fuel', 55, 0.3, ['Shell', 'BP', 'Esso', 'Texaco']),
+    ('Rent', 1200, 0.1, ['Monthly rent']),
+    ('Utilities', 90, 0.4, ['Electricity bill', 'Gas bill', 'Water bill']),
+    ('Phone', 30, 0.2, ['Vodafone', 'T-Mobile', 'Verizon']),
+    ('Subscriptions', 12, 0.4, ['Netflix', 'Spotify', 'Disney+', 'iCloud storage']),
+    ('Shopping', 60, 0.9, ['Amazon', 'IKEA', 'Zara', 'H&M', 'Apple Store']),
+    ('Health', 40, 0.8, ['Pharmacy', 'Dentist', 'Gym membership', 'Optician']),
+    ('Entertainment', 25, 0.6, ['Cinema', 'Concert tickets', 'Steam', 'Bowling']),
+    ('Travel', 300, 0.9, ['Airbnb', 'Ryanair', 'Hilton', 'Booking.com']),
+    ('Education', 80, 0.8, ['Coursera', 'Bookshop', 'Udemy']),
+    ('Gifts', 40, 0.7, ['Flowers', 'Gift shop', 'Birthday present']),
+]
+
+SYNTHETIC_SOURCES = [
+    ('Salary', 3200, 0.15, ['ACME payroll', 'Monthly salary']),
+    ('Freelance', 600, 0.6, ['Invoice payment', 'Consulting fee']),
+    ('Interest', 15, 0.8, ['Savings interest']),
+    ('Dividends', 120, 0.7, ['Dividend payment']),
+    ('Refunds', 35, 0.8, ['Amazon refund', 'Tax refund']),
+]
+
+
+class SyntheticLabel:
+    """
+    A category or source with its log-normal amount and merchant names.
+    """
+
+    def __init__(self, label_id, typical, spread, merchants):
+        self.label_id = label_id
+        self.mu = math.log(typical)
+        self.spread = spread
+        self.merchants = merchants
+
+    def row(self, rng, owner_id, day):
+        amount = Decimal(max(rng.lognormvariate(self.mu, self.spread), 0.5)).quantize(Decimal('0.01'))
+        description = rng.choice(self.merchants)
+        if rng.random() < 0.3:
+            description = '{} #{}'.format(description, rng.randrange(1000, 10000))
+        return owner_id, self.label_id, amount, description, day
+
+
+def synthetic_labels(label_model, definitions):
+    """
+    Return a ``SyntheticLabel`` per definition, reusing labels of the same name.
+    """
+    labels = []
+    for name, typical, spread, merchants in definitions:
+        label = label_model.objects.filter(name=name).order_by('pk').first()
+        if label is None:
+            label = label_model.objects.create(name=name)
+        labels.append(SyntheticLabel(label.pk, typical, spread, merchants))
+    return labels
+
+
+def draw_rows(rng, owner_id, labels, count, start, days, skew):
+    """
+    Return ``count`` rows ``(owner_id, label_id, amount, description, date)`` in date order.
+    """
+    favourites = rng.sample(labels, len(labels))
+    weights = list(accumulate(1 / (rank + 1) ** skew for rank in range(len(favourites))))
+    picks = rng.choices(favourites, cum_weights=weights, k=count)
+    dates = sorted(start + timedelta(days=rng.randrange(days)) for _ in range(count))
+    return [label.row(rng, owner_id, day) for label, day in zip(picks, dates)]
+
+
+def generate_ledgers(users, rows, income_rows, start, days, skew=1.0, seed=0, prefix='synthetic',
+                     batch_size=None):
+    """
+    Create ``users`` users named ``<prefix><number>`` with ``rows`` expenses
+    and ``income_rows`` income rows each, dated from ``start`` over ``days`` days.
+
+    Returns:
+    - dict: The ``users``, ``expenses`` and ``income`` rows created.
+
+    Raises:
+    - ValueError: If a user with the prefix already exists.
+    """
+    batch_size = batch_size or SYNTHETIC_BATCH_SIZE
+    if User.objects.filter(username__startswith=prefix).exists():
+        raise ValueError('Users named {}... already exist; pick another prefix'.format(prefix))
+
+    ledgers = [
+        (Expense, ExpenseMonthlyRollup, 'category', synthetic_labels(Category, SYNTHETIC_CATEGORIES), rows),
+        (Userincome, IncomeMonthlyRollup, 'source', synthetic_labels(Source, SYNTHETIC_SOURCES), income_rows),
+    ]
+    buffers = [[] for _ in ledgers]
+    created = [0 for _ in ledgers]
+    width = len(str(max(users - 1, 0)))
+
+    def flush(position):
+        model, _, label_field, _, _ = ledgers[position]
+        label = '{}_id'.format(label_field)
+        buffer = buffers[position]
+        for offset in range(0, len(buffer), batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    model(owner_id=owner_id, amount=amount, description=description, date=day, **{label: label_id})
+                    for owner_id, label_id, amount, description, day in buffer[offset:offset + batch_size])
+        created[position] += len(buffer)
+        buffers[position] = []
+
+    owners = []
+    for first in range(0, users, batch_size):
+        numbers = range(first, min(users, first + batch_size))
+        names = ['{}{:0{}d}'.format(prefix, number, width) for number in numbers]
+        with transaction.atomic():
+            User.objects.bulk_create(User(username=name, email='{}@example.com'.format(name),
+                                          password=UNUSABLE_PASSWORD_PREFIX) for name in names)
+            # Not every backend returns the primary keys of bulk inserts
+            ids = dict(User.objects.filter(username__in=names).values_list('username', 'pk'))
+            UserPreference.objects.bulk_create(
+                UserPreference(user_id=ids[name], currency=SYNTHETIC_CURRENCY) for name in names)
+
+        for number, name in zip(numbers, names):
+            owner_id = ids[name]
+            owners.append(owner_id)
+            rng = random.Random('{}:{}'.format(seed, number))
+            for position, (_, _, _, labels, count) in enumerate(ledgers):
+                buffers[position].extend(draw_rows(rng, owner_id, labels, count, start, days, skew))
+                if len(buffers[position]) >= batch_size:
+                    flush(position)
+
+    for position in range(len(ledgers)):
+        if buffers[position]:
+            flush(position)
+    for start_index in range(0, len(owners), batch_size):
+        for model, rollup_model, label_field, _, _ in ledgers:
+            rebuild_rollups(model, rollup_model, label_field, owners[start_index:start_index + batch_size])
+
+    return {'users': users, 'expenses': created[0], 'income': created[1]}
@@ -1,3 +1,1505 @@
-from django.test import TestCase
+import gzip
+import importlib.util
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import partial
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import load_workbook
+from pypdf import PdfReader
+
+from userincome.models import IncomeMonthlyRollup, RecurringIncome, Source, SourceRule, Userincome
+from userpreferences.models import UserPreference
+
+from .batch import apply_batch
+from .benchmarks import benchmark_user, compare, percentile, run_benchmarks, seed_dataset
+from .cache import (LEDGER_CACHE_ALIAS, bump_data_version, cache_stats, cached_artifact, cached_for_user, data_version,
+                    reset_cache_stats)
+from .categorize import RuleSet, rule_set
+from .exports import (COMBINED_COLUMNS, EXPORT_COLUMNS, XLSX_CONTENT_TYPE, export_queryset, pdf_part_contexts,
+                      write_pdf)
+from .imports import LedgerImport, import_csv
+from .jobs import EXPORT_JOB_TIMEOUT, claim_job, enqueue_export, expire_jobs, run_export_job
+from .management.commands.run_export_worker import Command as ExportWorkerCommand
+from .models import Category, CategoryRule, DataVersion, Expense, ExpenseMonthlyRollup, ExportJob, RecurringExpense
+from .pagination import LEDGER_ORDERING, KeysetPaginator, decode_cursor, seek_filter
+from .recurrence import InvalidRecurrence, materialize, next_occurrence, parse_rule
+from .rollups import rebuild_rollups
+from .search import SEARCH_RESULTS_LIMIT, TRANSACTION_ORDERING, search_ledger
+from .summaries import SUMMARY_GRANULARITIES, ledger_summary, summary_queryset
+from .synthetic import SYNTHETIC_CURRENCY, generate_ledgers
+
+# Size of the seeded dataset the plans are checked against
+QUERY_PLAN_USERS = 40
+QUERY_PLAN_ROWS_PER_USER = 500
+
+
+class QueryPlanMixin:
+    """
+    Assertions on the plan the database picks for an ORM queryset.
+    """
+
+    def explain(self, queryset):
+        return queryset.explain()
+
+    def assertNoFullScan(self, queryset):
+        """
+        Fail if ``queryset`` reads its table without an index.
+        """
+        table = queryset.model._meta.db_table
+        plan = self.explain(queryset)
+
+        if connection.vendor == 'postgresql':
+            bad = re.search(r'Seq Scan on {}\b'.format(table), plan)
+        else:
+            # SQLite: SEARCH uses an index, SCAN walks the whole table (or index)
+            bad = re.search(r'\bSCAN {}( |$)'.format(table), plan, re.MULTILINE)
+        self.assertIsNone(bad, 'Full scan of {}:\n{}'.format(table, plan))
+
+    def assertNoSort(self, queryset):
+        """
+        Fail if ``queryset`` needs a sort step instead of reading rows in index order.
+        """
+        plan = self.explain(queryset)
+        if connection.vendor == 'postgresql':
+            bad = re.search(r'\bSort\b', plan)
+        else:
+            bad = re.search(r'TEMP B-TREE FOR ORDER BY', plan)
+        self.assertIsNone(bad, 'Sort step in plan:\n{}'.format(plan))
+
+
+def seed_ledger(model, label_field, labels):
+    """
+    Create ``QUERY_PLAN_USERS`` users with ``QUERY_PLAN_ROWS_PER_USER`` rows each
+    of ``model`` and refresh the planner statistics.
+    """
+    label_model = model._meta.get_field(label_field).related_model
+    labels = label_model.objects.bulk_create(label_model(name=name) for name in labels)
+    users = User.objects.bulk_create(
+        User(username='{}-plan-{}'.format(model._meta.model_name, number))
+        for number in range(QUERY_PLAN_USERS))
+    start = date.today() - timedelta(days=QUERY_PLAN_ROWS_PER_USER)
+
+    rows = []
+    for user in users:
+        for number in range(QUERY_PLAN_ROWS_PER_USER):
+            rows.append(model(**{
+                'owner': user,
+                'amount': number % 97 + 0.5,
+                'date': start + timedelta(days=number),
+                'description': 'seeded row {}'.format(number),
+                label_field: labels[number % len(labels)],
+            }))
+    model.objects.bulk_create(rows, batch_size=2000)
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return users
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Runs each test from the migrations in ``migrate_from``; the latest migrations are applied again afterwards.
+    """
+    migrate_from = []
+
+    def setUp(self):
+        self.apps = self.migrate(self.migrate_from)
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def migrate(self, targets):
+        """
+        Migrate forwards or backwards to ``targets`` and return the historical models there.
+        """
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        executor.loader.build_graph()
+        return executor.loader.project_state(targets).apps
+
+
+def other_process_cache():
+    """
+    Give the block a local-memory cache of its own, like a management command run in another process.
+    """
+    return mock.patch('expenses.cache._cache', return_value=LocMemCache('other-process', {}))
+
+
+class ExpenseQueryPlanTests(QueryPlanMixin, TestCase):
+    """
+    The queries behind the expense views must be served from the (owner, ...) indexes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_ledger(Expense, 'category', ['Food', 'Rent', 'Travel', 'Bills'])[0]
+        cls.category = Category.objects.get(name='Food')
+
+    def test_index_page(self):
+        expenses = Expense.objects.filter(owner=self.user).order_by(*LEDGER_ORDERING)
+        self.assertNoFullScan(expenses[:6])
+        self.assertNoSort(expenses[:6])
+        deep = expenses.filter(seek_filter(LEDGER_ORDERING, [date.today() - timedelta(days=400), 1]))
+        self.assertNoFullScan(deep[:6])
+        self.assertNoSort(deep[:6])
+
+    def test_category_summary(self):
+        today = date.today()
+        for granularity in SUMMARY_GRANULARITIES:
+            self.assertNoFullScan(summary_queryset(Expense.objects.filter(owner=self.user), 'category',
+                                                   today - timedelta(days=30 * 6), today, granularity))
+
+    def test_category_filter(self):
+        self.assertNoFullScan(Expense.objects.filter(owner=self.user, category=self.category))
+
+    def test_exports(self):
+        expenses = Expense.objects.filter(owner=self.user)
+        self.assertNoFullScan(expenses)
+        self.assertNoSort(expenses)
+        rows = export_queryset(expenses, 'category')
+        self.assertNoFullScan(rows)
+        self.assertNoSort(rows)
+
+
+class MoneyFieldTests(TestCase):
+    """
+    Amounts are stored as whole cents and read back as two-place decimals.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='money')
+        cls.category = Category.objects.create(name='Food')
+
+    def test_round_trip(self):
+        field = Expense._meta.get_field('amount')
+        for value, expected in [(12.5, '12.50'), ('0.1', '0.10'), (Decimal('19.99'), '19.99'), (-3, '-3.00'),
+                                (' 7 ', '7.00'), (field.max_amount, str(field.max_amount))]:
+            expense = Expense.objects.create(owner=self.user, category=self.category, amount=value, description='x')
+            expense.refresh_from_db()
+            self.assertEqual(str(expense.amount), expected)
+        self.assertEqual(Expense.objects.filter(owner=self.user, amount__gte=12).count(), 3)
+
+    def test_rounding(self):
+        field = Expense._meta.get_field('amount')
+        self.assertEqual(field.to_python('1.005'), Decimal('1.01'))
+        self.assertEqual(field.to_python('-1.005'), Decimal('-1.01'))
+        self.assertEqual(field.to_python(0.1 + 0.2), Decimal('0.30'))
+        self.assertEqual(field.get_prep_value('2.675'), 268)
+
+    def test_invalid_and_out_of_range(self):
+        field = Expense._meta.get_field('amount')
+        for value, code in [('abc', 'invalid'), ('nan', 'invalid'), ('inf', 'invalid'), ('1e20', 'out_of_range'),
+                            ('1e30', 'out_of_range'), ('-1e400', 'out_of_range'),
+                            (field.max_amount + Decimal('0.01'), 'out_of_range')]:
+            with self.assertRaises(ValidationError) as raised:
+                field.to_python(value)
+            self.assertEqual(raised.exception.code, code, value)
+        with self.assertRaises(ValidationError):
+            Expense.objects.create(owner=self.user, category=self.category, amount='1e20', description='x')
+
+
+class AmountMinorUnitsMigrationTests(MigrationTestCase):
+    """
+    Migrating a populated table converts the float amounts to cents, and back.
+    """
+    migrate_from = [('expenses', '0004_expense_owner_indexes')]
+    migrate_to = [('expenses', '0005_expense_amount_minor_units')]
+
+    def test_round_trip(self):
+        owner = self.apps.get_model('auth', 'User').objects.create(username='migrated')
+        Expense = self.apps.get_model('expenses', 'Expense')
+        for amount in [12.5, 0.1, 19.99, 1234567.89, -3.0]:
+            Expense.objects.create(owner_id=owner.pk, category='Food', amount=amount, description='row')
+
+        apps = self.migrate(self.migrate_to)
+        amounts = apps.get_model('expenses', 'Expense').objects.order_by('pk').values_list('amount', flat=True)
+        self.assertEqual([str(amount) for amount in amounts], ['12.50', '0.10', '19.99', '1234567.89', '-3.00'])
+
+        apps = self.migrate(self.migrate_from)
+        amounts = apps.get_model('expenses', 'Expense').objects.order_by('pk').values_list('amount', flat=True)
+        self.assertEqual(list(amounts), [12.5, 0.1, 19.99, 1234567.89, -3.0])
+
+
+class CategoryForeignKeyMigrationTests(MigrationTestCase):
+    """
+    Migrating a populated table turns the category names into foreign keys, and back.
+    """
+    migrate_from = [('expenses', '0005_expense_amount_minor_units')]
+    migrate_to = [('expenses', '0007_expense_category_swap')]
+
+    def test_round_trip(self):
+        owner = self.apps.get_model('auth', 'User').objects.create(username='migrated')
+        self.apps.get_model('expenses', 'Category').objects.create(name='Food')
+        Expense = self.apps.get_model('expenses', 'Expense')
+        for category in ['Food', 'Rent', 'Food']:
+            Expense.objects.create(owner_id=owner.pk, category=category, amount=Decimal('1.50'), description='row')
+
+        apps = self.migrate(self.migrate_to)
+        Category = apps.get_model('expenses', 'Category')
+        self.assertEqual(Category.objects.count(), 2)
+        names = apps.get_model('expenses', 'Expense').objects.order_by('pk').values_list('category__name', flat=True)
+        self.assertEqual(list(names), ['Food', 'Rent', 'Food'])
+
+        apps = self.migrate(self.migrate_from)
+        names = apps.get_model('expenses', 'Expense').objects.order_by('pk').values_list('category', flat=True)
+        self.assertEqual(list(names), ['Food', 'Rent', 'Food'])
+
+
+class KeysetPaginatorTests(TestCase):
+    """
+    Paging forwards and backwards visits every row once, in order.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='pager')
+        category = Category.objects.create(name='Food')
+        # Several rows per day so the id tiebreak matters
+        Expense.objects.bulk_create(
+            Expense(owner=cls.user, category=category, amount=number, description='row',
+                    date=date(2024, 1, 1) + timedelta(days=number // 3))
+            for number in range(23))
+        cls.expected = list(Expense.objects.filter(owner=cls.user)
+                            .order_by(*LEDGER_ORDERING).values_list('pk', flat=True))
+
+    def test_walk_forward_and_back(self):
+        paginator = KeysetPaginator(Expense.objects.filter(owner=self.user), 5)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(after=pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [5, 5, 5, 5, 3])
+        self.assertEqual([row.pk for page in pages for row in page], self.expected)
+        self.assertFalse(pages[0].has_previous())
+
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = paginator.page(before=page.previous_cursor)
+            self.assertEqual([row.pk for row in page], [row.pk for row in expected])
+        self.assertFalse(page.has_previous())
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        paginator = KeysetPaginator(Expense.objects.filter(owner=self.user), 5)
+        page = paginator.get_page(after='garbage')
+        self.assertEqual([row.pk for row in page], self.expected[:5])
+
+
+class SearchTests(TestCase):
+    """
+    The search endpoints return bounded, ranked pages of the user's own rows.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='searcher')
+        cls.food = Category.objects.create(name='Food')
+        cls.rent = Category.objects.create(name='Rent')
+        cls.salary = Source.objects.create(name='Salary')
+        Expense.objects.bulk_create([
+            Expense(owner=cls.user, category=cls.food, amount=4, description='coffee beans', date=date(2024, 1, 1)),
+            Expense(owner=cls.user, category=cls.food, amount=3, description='coffee shop coffee',
+                    date=date(2024, 1, 2)),
+            Expense(owner=cls.user, category=cls.rent, amount=900, description='march rent', date=date(2024, 3, 1)),
+        ])
+        Userincome.objects.bulk_create([
+            Userincome(owner=cls.user, source=cls.salary, amount=2000, description='coffee shop wages',
+                       date=date(2024, 1, 31)),
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def search(self, url, **params):
+        return self.client.post(url, json.dumps(params), content_type='application/json')
+
+    def test_no_search_terms(self):
+        for url in ('/search-expenses', '/income/search-income', '/search-transactions'):
+            for params in ({'searchText': ''}, {'searchText': '$'}, {'searchText': '-'}, {'searchText': '  '}, {}):
+                response = self.search(url, **params)
+                self.assertEqual(response.status_code, 200, (url, params))
+                self.assertEqual(response.json(), {'total_estimate': 0, 'next_cursor': None, 'results': []})
+
+    def descriptions(self, url, search_text):
+        results = self.search(url, searchText=search_text, fields=['description'])
+        return [row['description'] for row in results.json()['results']]
+
+    def test_match_and_rank(self):
+        # Both words count, and the row mentioning coffee twice ranks first
+        self.assertEqual(self.descriptions('/search-expenses', 'coffee'), ['coffee shop coffee', 'coffee beans'])
+        self.assertEqual(self.descriptions('/search-expenses', 'coffee beans'), ['coffee beans'])
+        self.assertEqual(self.descriptions('/income/search-income', 'wages'), ['coffee shop wages'])
+        self.assertEqual(self.descriptions('/search-expenses', 'tea'), [])
+
+    def test_prefix_match(self):
+        self.assertEqual(self.descriptions('/search-expenses', 'cof'), ['coffee shop coffee', 'coffee beans'])
+        self.assertEqual(self.descriptions('/search-expenses', 'COFFEE SH'), ['coffee shop coffee'])
+
+    def test_amount_date_and_category_terms(self):
+        self.assertEqual(self.descriptions('/search-expenses', '900'), ['march rent'])
+        self.assertEqual(self.descriptions('/search-expenses', '2024-01'), ['coffee shop coffee', 'coffee beans'])
+        self.assertEqual(self.descriptions('/search-expenses', 'foo'), ['coffee shop coffee', 'coffee beans'])
+
+    def test_amount_terms_beyond_the_largest_amount(self):
+        largest = Expense._meta.get_field('amount').max_amount
+        Expense.objects.create(owner=self.user, category=self.rent, amount=largest, description='jackpot',
+                               date=date(2024, 4, 1))
+        for url in ('/search-expenses', '/search-transactions'):
+            for search_text in ('99999999999999999999', '9223372036854775807', '92233720368547759'):
+                response = self.search(url, searchText=search_text)
+                self.assertEqual(response.status_code, 200, (url, search_text))
+                self.assertEqual(response.json()['results'], [])
+        # The range of the largest whole amount runs past it, and still finds it
+        self.assertEqual(self.descriptions('/search-expenses', '92233720368547758'), ['jackpot'])
+
+    def test_index_follows_edits_and_deletes(self):
+        beans = Expense.objects.get(description='coffee beans')
+        beans.description = 'tea leaves'
+        beans.save()
+        self.assertEqual(self.descriptions('/search-expenses', 'coffee'), ['coffee shop coffee'])
+        self.assertEqual(self.descriptions('/search-expenses', 'tea'), ['tea leaves'])
+
+        beans.delete()
+        self.assertEqual(self.descriptions('/search-expenses', 'tea'), [])
+
+    def test_cursor_walk(self):
+        # Equal ranks and dates, so the pages are cut on the id tiebreak too
+        Expense.objects.bulk_create(
+            Expense(owner=self.user, category=self.food, amount=number + 1, description='lunch',
+                    date=date(2024, 2, 1) + timedelta(days=number // 4))
+            for number in range(23))
+        expected = list(Expense.objects.filter(owner=self.user, description='lunch')
+                        .order_by('-date', '-id').values_list('pk', flat=True))
+
+        response = self.search('/search-expenses', searchText='lunch', pageSize=5).json()
+        self.assertEqual(response['total_estimate'], 23)
+        pages = [response]
+        while pages[-1]['next_cursor']:
+            pages.append(self.search('/search-expenses', searchText='lunch', pageSize=5,
+                                     cursor=pages[-1]['next_cursor']).json())
+        self.assertEqual([len(page['results']) for page in pages], [5, 5, 5, 5, 3])
+        self.assertEqual([row['id'] for page in pages for row in page['results']], expected)
+        self.assertNotIn('total_estimate', pages[1])
+
+    def test_tied_ranks_across_pages(self):
+        Expense.objects.bulk_create(
+            Expense(owner=self.user, category=self.food, amount=number + 1, description='team bonus lunch',
+                    date=date(2024, 5, 1))
+            for number in range(5))
+        Userincome.objects.bulk_create(
+            Userincome(owner=self.user, source=self.salary, amount=number + 1, description='team bonus',
+                       date=date(2024, 5, 1))
+            for number in range(5))
+
+        pages = [self.search('/search-transactions', searchText='bonus', pageSize=3).json()]
+        while pages[-1]['next_cursor']:
+            pages.append(self.search('/search-transactions', searchText='bonus', pageSize=3,
+                                     cursor=pages[-1]['next_cursor']).json())
+        rows = [(row['type'], row['id']) for page in pages for row in page['results']]
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(len(set(rows)), 10)
+
+        # The rank a cursor stores compares equal to the non-zero rank it was read from
+        rank = decode_cursor(pages[0]['next_cursor'], TRANSACTION_ORDERING)[0]
+        self.assertGreater(rank, 0)
+        matches = search_ledger(Expense.objects.filter(owner=self.user), 'bonus', 'category', Category)
+        self.assertEqual(matches.filter(rank=rank).count() + search_ledger(
+            Userincome.objects.filter(owner=self.user), 'bonus', 'source', Source).filter(rank=rank).count(), 5)
+
+    def test_page_size_is_bounded(self):
+        Expense.objects.bulk_create(
+            Expense(owner=self.user, category=self.food, amount=1, description='lunch', date=date(2024, 2, 1))
+            for _ in range(SEARCH_RESULTS_LIMIT + 5))
+        response = self.search('/search-expenses', searchText='lunch', pageSize=SEARCH_RESULTS_LIMIT * 10).json()
+        self.assertEqual(len(response['results']), SEARCH_RESULTS_LIMIT)
+        self.assertIsNotNone(response['next_cursor'])
+
+    def test_tampered_cursor(self):
+        cursor = self.search('/search-expenses', searchText='coffee', pageSize=1).json()['next_cursor']
+        for bad in (cursor[:-2] + 'xx', 'garbage'):
+            response = self.search('/search-expenses', searchText='coffee', cursor=bad)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+    def test_fields_whitelist(self):
+        row = self.search('/search-expenses', searchText='rent').json()['results'][0]
+        self.assertEqual(set(row), {'id', 'amount', 'category', 'description', 'date'})
+        self.assertEqual(row['category'], 'Rent')
+
+        row = self.search('/search-expenses', searchText='rent', fields=['amount', 'owner_id', 'rank']).json()
+        self.assertEqual(row['results'], [{'amount': '900.00'}])
+
+        row = self.search('/income/search-income', searchText='wages', fields=['source', 'owner']).json()
+        self.assertEqual(row['results'], [{'source': 'Salary'}])
+
+    def test_transactions(self):
+        response = self.search('/search-transactions', searchText='coffee').json()
+        self.assertEqual(response['total_estimate'], 3)
+        self.assertEqual(sorted((row['type'], row['label'], row['description']) for row in response['results']), [
+            ('expense', 'Food', 'coffee beans'),
+            ('expense', 'Food', 'coffee shop coffee'),
+            ('income', 'Salary', 'coffee shop wages'),
+        ])
+
+        # One row per page; expense and income ids overlap, so the cursor must also hold the type
+        rows, cursor = [], None
+        while True:
+            page = self.search('/search-transactions', searchText='coffee', pageSize=1, cursor=cursor).json()
+            rows.extend((row['type'], row['id']) for row in page['results'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(rows, [(row['type'], row['id']) for row in response['results']])
+
+        response = self.search('/search-transactions', searchText='wages', fields=['type', 'amount']).json()
+        self.assertEqual(response['results'], [{'type': 'income', 'amount': '2000.00'}])
+
+    def test_other_users_rows(self):
+        other = User.objects.create(username='other-searcher')
+        Expense.objects.create(owner=other, category=self.food, amount=1, description='coffee', date=date(2024, 1, 1))
+        self.assertEqual(self.descriptions('/search-expenses', 'coffee'), ['coffee shop coffee', 'coffee beans'])
+
+
+class LedgerSummaryTests(TestCase):
+    """
+    The grouped summary matches the per-row totals.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='summary')
+        food, rent = Category.objects.bulk_create([Category(name='Food'), Category(name='Rent')])
+        Expense.objects.bulk_create([
+            Expense(owner=cls.user, category=food, amount=Decimal('1.10'), date=date(2024, 1, 30)),
+            Expense(owner=cls.user, category=food, amount=Decimal('2.25'), date=date(2024, 1, 31)),
+            Expense(owner=cls.user, category=rent, amount=Decimal('500'), date=date(2024, 2, 1)),
+            Expense(owner=cls.user, category=food, amount=Decimal('3'), date=date(2024, 3, 5)),
+            # Outside the window
+            Expense(owner=cls.user, category=rent, amount=Decimal('500'), date=date(2024, 4, 1)),
+        ])
+        rebuild_rollups(Expense, ExpenseMonthlyRollup, 'category')
+
+    def summary(self, granularity):
+        return ledger_summary(Expense.objects.filter(owner=self.user), 'category',
+                              date(2024, 1, 1), date(2024, 3, 31), granularity)
+
+    def test_monthly(self):
+        summary = self.summary('month')
+        self.assertEqual(summary['periods'], ['2024-01-01', '2024-02-01', '2024-03-01'])
+        self.assertEqual(summary['labels'], ['Food', 'Rent'])
+        self.assertEqual(summary['series'], [[3.35, 0.0, 3.0], [0.0, 500.0, 0.0]])
+        self.assertEqual(summary['totals'], [6.35, 500.0])
+        self.assertEqual(summary['counts'], [3, 1])
+
+    def test_rollups_match_ledger(self):
+        rollups = ExpenseMonthlyRollup.objects.filter(owner=self.user)
+        for granularity in ('month', 'year'):
+            self.assertEqual(
+                ledger_summary(Expense.objects.filter(owner=self.user), 'category',
+                               date(2024, 1, 1), date(2024, 3, 31), granularity, rollups),
+                self.summary(granularity))
+
+    def test_weekly(self):
+        summary = self.summary('week')
+        # 2024-01-30 and 2024-02-01 fall in the week starting Monday 2024-01-29
+        self.assertEqual(summary['periods'], ['2024-01-29', '2024-03-04'])
+        self.assertEqual(summary['series'], [[3.35, 3.0], [500.0, 0.0]])
+
+
+class MonthlyRollupTests(TestCase):
+    """
+    Saves and deletes keep the rollups equal to a rebuild from the ledger.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='rollup')
+        self.food, self.rent = Category.objects.bulk_create([Category(name='Food'), Category(name='Rent')])
+
+    def rollups(self):
+        return sorted(ExpenseMonthlyRollup.objects.values_list('owner', 'category', 'month', 'total', 'count'))
+
+    def assertRollupsRebuildable(self):
+        maintained = self.rollups()
+        rebuild_rollups(Expense, ExpenseMonthlyRollup, 'category')
+        self.assertEqual(maintained, self.rollups())
+
+    def test_create_edit_delete(self):
+        first = Expense.objects.create(owner=self.user, category=self.food, amount='10.10',
+                                       date='2024-01-15', description='a')
+        Expense.objects.create(owner=self.user, category=self.food, amount='5', date='2024-01-20', description='b')
+        self.assertEqual(self.rollups(), [(self.user.pk, self.food.pk, date(2024, 1, 1), Decimal('15.10'), 2)])
+        self.assertRollupsRebuildable()
+
+        # Moving a row to another month and category takes it out of its old bucket
+        first.amount = Decimal('7')
+        first.date = date(2024, 2, 3)
+        first.category = self.rent
+        first.save()
+        self.assertEqual(self.rollups(), [
+            (self.user.pk, self.food.pk, date(2024, 1, 1), Decimal('5.00'), 1),
+            (self.user.pk, self.rent.pk, date(2024, 2, 1), Decimal('7.00'), 1),
+        ])
+        self.assertRollupsRebuildable()
+
+        first.delete()
+        self.assertEqual(self.rollups(), [(self.user.pk, self.food.pk, date(2024, 1, 1), Decimal('5.00'), 1)])
+        self.assertRollupsRebuildable()
+
+
+class LedgerCacheTests(TestCase):
+    """
+    Cached values are reused until the owner's data changes.
+    """
+
+    def setUp(self):
+        caches[LEDGER_CACHE_ALIAS].clear()
+        reset_cache_stats()
+        self.user = User.objects.create(username='cache')
+        self.category = Category.objects.create(name='Food')
+
+    def test_change_invalidates(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return Expense.objects.filter(owner=self.user).count()
+
+        self.assertEqual(cached_for_user(self.user.pk, 'count', [], compute), 0)
+        self.assertEqual(cached_for_user(self.user.pk, 'count', [], compute), 0)
+        self.assertEqual(len(calls), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            expense = Expense.objects.create(owner=self.user, category=self.category, amount=1,
+                                             date=date(2024, 1, 1), description='x')
+        self.assertEqual(cached_for_user(self.user.pk, 'count', [], compute), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            expense.delete()
+        self.assertEqual(cached_for_user(self.user.pk, 'count', [], compute), 0)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(cache_stats(), {'count': {'hits': 1, 'misses': 3, 'hit_rate': 0.25}})
+
+    def test_version_is_shared(self):
+        # Kept in the database, so other processes and an emptied cache see the same version
+        self.assertEqual(data_version(self.user.pk), 0)
+        bump_data_version(self.user.pk)
+        bumped = data_version(self.user.pk)
+        self.assertGreater(bumped, 0)
+        caches[LEDGER_CACHE_ALIAS].clear()
+        self.assertEqual(data_version(self.user.pk), bumped)
+
+        # The clock lagging behind the stored version never moves it backwards
+        DataVersion.objects.filter(owner=self.user).update(version=F('version') + 10 ** 15)
+        ahead = data_version(self.user.pk)
+        bump_data_version(self.user.pk)
+        self.assertEqual(data_version(self.user.pk), ahead + 1)
+
+
+    def test_delete_owner(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.create(owner=self.user, category=self.category, amount=1, date=date(2024, 1, 1),
+                                   description='x')
+            Userincome.objects.create(owner=self.user, source=Source.objects.create(name='Salary'), amount=2,
+                                      date=date(2024, 1, 1), description='y')
+        owner_id = self.user.pk
+
+        # The cascade deletes the rows one by one, and the bumps they queue must not bring the version back
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(DataVersion.objects.filter(owner_id=owner_id).exists())
+        connection.check_constraints()
+
+class ExpenseAdminTests(TestCase):
+    """
+    The admin finds expenses by the amount typed, although it is stored in cents.
+    """
+
+    def test_search_amount(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        food = Category.objects.create(name='Food')
+        for amount, description in [('12.50', 'lunch'), ('12.05', 'snack'), ('1250', 'rent')]:
+            Expense.objects.create(owner=admin_user, category=food, amount=amount, description=description,
+                                   date=date(2024, 1, 1))
+        self.client.force_login(admin_user)
+
+        for search_term, found in [('12.50', ['lunch']), ('12', ['lunch', 'snack']), ('lunch', ['lunch'])]:
+            response = self.client.get('/admin/expenses/expense/', {'q': search_term})
+            self.assertEqual(sorted(expense.description for expense in response.context['cl'].result_list),
+                             found, search_term)
+
+class ConditionalGetTests(TestCase):
+    """
+    Summaries and exports answer 304 to a current copy and reuse rendered files.
+    """
+
+    def setUp(self):
+        caches[LEDGER_CACHE_ALIAS].clear()
+        reset_cache_stats()
+        self.user = User.objects.create(username='conditional')
+        self.category = Category.objects.create(name='Food')
+        self.client.force_login(self.user)
+
+    def test_not_modified_until_change(self):
+        response = self.client.get('/expense_category_summary')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get('/expense_category_summary', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/expense_category_summary', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.create(owner=self.user, category=self.category, amount=1,
+                                   date=date.today(), description='x')
+        response = self.client.get('/expense_category_summary', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['counts'], [1])
+
+    def test_artifact_is_cached(self):
+        Expense.objects.create(owner=self.user, category=self.category, amount=1,
+                               date=date(2024, 1, 1), description='x')
+        first = b''.join(self.client.get('/export_excel').streaming_content)
+        second = b''.join(self.client.get('/export_excel').streaming_content)
+        self.assertEqual(first, second)
+        self.assertEqual(cache_stats()['expense-xlsx'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+
+    def test_large_artifact_is_not_cached(self):
+        renders = []
+
+        def render(output):
+            renders.append(1)
+            output.write(b'x' * 100)
+
+        with mock.patch('expenses.cache.LEDGER_ARTIFACT_MAX_BYTES', 64):
+            for _ in range(2):
+                with cached_artifact(self.user.pk, 'large', [], render) as output:
+                    self.assertEqual(output.read(), b'x' * 100)
+            small = cached_artifact(self.user.pk, 'small', [], lambda output: output.write(b'y' * 10))
+            self.assertEqual(small.read(), b'y' * 10)
+        self.assertEqual(len(renders), 2)
+        self.assertEqual(cached_artifact(self.user.pk, 'small', [], None).read(), b'y' * 10)
+
+class CsvExportTests(TestCase):
+    """
+    The streamed CSV holds every row, in batches, newest first.
+    """
+
+    def test_stream(self):
+        user = User.objects.create(username='export')
+        category = Category.objects.create(name='Food, "fresh"')
+        Expense.objects.bulk_create(
+            Expense(owner=user, category=category, amount=number, description='row {}'.format(number),
+                    date=date(2024, 1, 1) + timedelta(days=number))
+            for number in range(1200))
+        self.client.force_login(user)
+
+        response = self.client.get('/export_csv')
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Disposition'].startswith('attachment; filename="Expenses_'))
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 3)
+        lines = b''.join(chunks).decode().splitlines()
+        self.assertEqual(len(lines), 1201)
+        self.assertEqual(lines[0], ','.join(EXPORT_COLUMNS))
+        self.assertEqual(lines[1], '1199.00,row 1199,"Food, ""fresh""",2027-04-14')
+
+
+class CompressedExportTests(TestCase):
+    """
+    Streamed exports are compressed chunk by chunk when the client accepts it.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='compressed')
+        category = Category.objects.create(name='Food')
+        Expense.objects.bulk_create(
+            Expense(owner=self.user, category=category, amount=number, description='row {}'.format(number),
+                    date=date(2024, 1, 1) + timedelta(days=number))
+            for number in range(1200))
+        self.client.force_login(self.user)
+
+    def test_gzip(self):
+        response = self.client.get('/export_csv', HTTP_ACCEPT_ENCODING='br;q=1.0, gzip;q=0.8')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 3)
+        lines = gzip.decompress(b''.join(chunks)).decode().splitlines()
+        self.assertEqual(len(lines), 1201)
+        self.assertEqual(lines[1], '1199.00,row 1199,Food,2027-04-14')
+
+    def test_identity(self):
+        for header in ('', 'gzip;q=0', 'identity'):
+            response = self.client.get('/export_csv', HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 1201)
+
+    @mock.patch('expenses.exports.EXPORT_COMPRESSION', ('gzip',))
+    def test_combined_jsonl(self):
+        response = self.client.get('/export_combined?format=jsonl', HTTP_ACCEPT_ENCODING='*')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(json.loads(lines[-1])['balance'], str(Decimal(-sum(range(1200))).quantize(Decimal('0.01'))))
+
+
+class ExcelExportTests(TestCase):
+    """
+    The .xlsx export has typed cells and a totals row.
+    """
+
+    def test_workbook(self):
+        user = User.objects.create(username='excel')
+        category = Category.objects.create(name='Food')
+        Expense.objects.bulk_create([
+            Expense(owner=user, category=category, amount=Decimal('12.50'), description='a', date=date(2024, 1, 2)),
+            Expense(owner=user, category=category, amount=Decimal('0.75'), description='b', date=date(2024, 1, 1)),
+        ])
+        self.client.force_login(user)
+
+        response = self.client.get('/export_excel')
+        self.assertEqual(response['Content-Type'], XLSX_CONTENT_TYPE)
+        self.assertIn('filename="Expenses_', response['Content-Disposition'])
+        sheet = load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(rows[0], tuple(EXPORT_COLUMNS))
+        self.assertEqual(rows[1], (12.5, 'a', 'Food', datetime(2024, 1, 2)))
+        self.assertEqual(rows[-1][:2], (13.25, 'TOTAL'))
+        self.assertEqual(len(rows), 4)
+
+
+class CsvImportTests(TestCase):
+    """
+    CSV files in the export layout are imported in batches, with row errors reported.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='importer')
+        self.client.force_login(self.user)
+
+    def upload(self, url, text):
+        return self.client.post(url, {'file': SimpleUploadedFile('ledger.csv', text.encode('utf-8-sig'))})
+
+    def test_round_trip(self):
+        category = Category.objects.create(name='Food')
+        Expense.objects.bulk_create(
+            Expense(owner=self.user, category=category, amount=Decimal(number) / 4,
+                    description='row, "{}"'.format(number), date=date(2024, 1, 1) + timedelta(days=number))
+            for number in range(250))
+        exported = b''.join(self.client.get('/export_csv').streaming_content).decode()
+        Expense.objects.all().delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            report = import_csv(self.user, 'expense', exported.splitlines(keepends=True), batch_size=100)
+        self.assertEqual(report, {'created': 250, 'error_count': 0, 'errors': []})
+        self.assertEqual(b''.join(self.client.get('/export_csv').streaming_content).decode(), exported)
+
+        rollups = list(ExpenseMonthlyRollup.objects.order_by('month').values_list('month', 'total', 'count'))
+        rebuild_rollups(Expense, ExpenseMonthlyRollup, 'category', [self.user.pk])
+        self.assertEqual(rollups, list(ExpenseMonthlyRollup.objects.order_by('month')
+                                       .values_list('month', 'total', 'count')))
+
+    def test_row_errors(self):
+        response = self.upload('/import_csv', '\r\n'.join([
+            'AMOUNT,DESCRIPTION,CATEGORY,DATE',
+            '12.50,coffee,Food,2024-01-02',
+            'abc,bad amount,Food,2024-01-02',
+            '3,,Food,2024-01-02',
+            '4,no category,,2024-01-02',
+            '5,bad date,Food,02/01/2024',
+            '',
+            '6,short row',
+            '7,new category,Books,2024-01-03',
+            '99999999999999999999,too large,Food,2024-01-03',
+        ]))
+        report = response.json()
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([(error['line'], error['error']) for error in report['errors']], [
+            (3, 'Amount must be a number'),
+            (4, 'Description is required'),
+            (5, 'Category is required'),
+            (6, 'Invalid date format! The date must be in YYYY-MM-DD format.'),
+            (8, 'Expected 4 columns, got 2'),
+            (10, 'Amount is too large'),
+        ])
+        self.assertEqual(sorted(Expense.objects.values_list('category__name', flat=True)), ['Books', 'Food'])
+
+    def test_income(self):
+        response = self.upload('/income/income_import_csv',
+                               'date,source,amount,description\n2024-01-01,Salary,1000,pay\n')
+        self.assertEqual(response.json()['created'], 1)
+        income = Userincome.objects.get(owner=self.user)
+        self.assertEqual((income.source.name, income.amount), ('Salary', Decimal('1000.00')))
+        self.assertEqual(IncomeMonthlyRollup.objects.get(owner=self.user).count, 1)
+
+    def test_command_invalidates_web_caches(self):
+        etag = self.client.get('/expense_category_summary')['ETag']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ledger.csv')
+            with open(path, 'w') as stream:
+                stream.write('AMOUNT,DESCRIPTION,CATEGORY,DATE\n4,coffee,Food,{}\n'.format(date.today()))
+            with other_process_cache():
+                call_command('import_csv', path, '--user', 'importer', stdout=StringIO())
+        response = self.client.get('/expense_category_summary', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['counts'], [1])
+
+    def test_invalid_file(self):
+        self.assertEqual(self.upload('/import_csv', 'AMOUNT,DATE\n1,2024-01-01\n').status_code, 400)
+        self.assertEqual(self.client.post('/import_csv').status_code, 400)
+
+
+class StatementImportTests(TestCase):
+    """
+    Bank statements are split by sign and re-importing them adds no duplicates.
+    """
+
+    OFX = """OFXHEADER:100
+DATA:OFXSGML
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240105120000[-5:EST]<TRNAMT>-4.50<FITID>A1<NAME>COFFEE SHOP<MEMO>Card 1234
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240105<TRNAMT>-4.50<FITID>A2<NAME>COFFEE SHOP<MEMO>Card 1234
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240106<TRNAMT>1500.00<FITID>A3<NAME>ACME PAYROLL
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>bad<TRNAMT>-1.00<FITID>A4<NAME>BROKEN
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+    QIF = """!Type:Bank
+D01/07/2024
+T-12.00
+PBookshop
+LBooks
+^
+D01/07'24
+T-12.00
+PBookshop
+LBooks
+^
+D01/08/2024
+T1,000.00
+PRefund
+^
+"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='statements')
+        self.client.force_login(self.user)
+
+    def upload(self, name, text):
+        return self.client.post('/import_statement', {'file': SimpleUploadedFile(name, text.encode())}).json()
+
+    def test_ofx(self):
+        report = self.upload('january.ofx', self.OFX)
+        self.assertEqual((report['expenses'], report['income'], report['duplicates']), (2, 1, 0))
+        self.assertEqual(report['errors'], [{'line': 8, 'error': "Invalid date: 'bad'"}])
+        self.assertEqual(sorted(Expense.objects.values_list('amount', 'date', 'description')), [
+            (Decimal('4.50'), date(2024, 1, 5), 'COFFEE SHOP - Card 1234'),
+        ] * 2)
+        income = Userincome.objects.get(owner=self.user)
+        self.assertEqual((income.amount, income.source.name), (Decimal('1500.00'), 'Uncategorized'))
+
+        overlapping = self.OFX.replace(
+            '</BANKTRANLIST>', '<STMTTRN><DTPOSTED>20240107<TRNAMT>-2.00<FITID>A5<NAME>BUS\n</BANKTRANLIST>')
+        report = self.upload('february.ofx', overlapping)
+        self.assertEqual((report['expenses'], report['income'], report['duplicates']), (1, 0, 3))
+        self.assertEqual(ExpenseMonthlyRollup.objects.get(owner=self.user).count, 3)
+
+    def test_concurrent_import(self):
+        skip_existing = LedgerImport.skip_existing
+
+        def race(ledger_import, batch):
+            # Another import of the same statement commits one of the rows right after the duplicate check
+            patched.stop()
+            batch = skip_existing(ledger_import, batch)
+            racer = batch[0]
+            racer.__class__.objects.create(
+                owner=self.user, amount=racer.amount, description=racer.description, date=racer.date,
+                fingerprint=racer.fingerprint, **{ledger_import.label_field: getattr(racer, ledger_import.label_field)})
+            return batch
+
+        patched = mock.patch.object(LedgerImport, 'skip_existing', autospec=True, side_effect=race)
+        patched.start()
+        self.addCleanup(patched.stop)
+        report = self.upload('january.ofx', self.OFX)
+        self.assertEqual((report['expenses'], report['income'], report['duplicates']), (1, 1, 1))
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_qif(self):
+        report = self.upload('statement.qif', self.QIF)
+        self.assertEqual((report['expenses'], report['income'], report['error_count']), (2, 1, 0))
+        self.assertEqual(set(Expense.objects.values_list('category__name', 'date')), {('Books', date(2024, 1, 7))})
+        self.assertEqual(Userincome.objects.get().amount, Decimal('1000.00'))
+
+        report = self.upload('statement.qif', self.QIF)
+        self.assertEqual((report['expenses'], report['income'], report['duplicates']), (0, 0, 3))
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_unknown_format(self):
+        response = self.client.post('/import_statement', {'file': SimpleUploadedFile('x.txt', b'hello')})
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchApiTests(TestCase):
+    """
+    Batches of operations are applied together, or not at all.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='batch')
+        self.food = Category.objects.create(name='Food')
+        self.rent = Category.objects.create(name='Rent')
+        self.expense = Expense.objects.create(owner=self.user, category=self.food, amount=5,
+                                              date=date(2024, 1, 5), description='lunch')
+        self.doomed = Expense.objects.create(owner=self.user, category=self.food, amount=7,
+                                             date=date(2024, 1, 6), description='dinner')
+        self.client.force_login(self.user)
+
+    def post(self, url, operations):
+        return self.client.post(url, json.dumps({'operations': operations}), content_type='application/json')
+
+    def test_apply(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post('/expenses-batch', [
+                {'op': 'create', 'amount': '12.50', 'description': 'flat', 'category': self.rent.pk,
+                 'date': '2024-02-01'},
+                {'op': 'update', 'id': self.expense.pk, 'amount': 6, 'date': '2024-02-03'},
+                {'op': 'delete', 'id': self.doomed.pk},
+            ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'updated', 'deleted'])
+        created = Expense.objects.get(pk=results[0]['id'])
+        self.assertEqual((created.amount, created.category, created.owner), (Decimal('12.50'), self.rent, self.user))
+        self.expense.refresh_from_db()
+        self.assertEqual((self.expense.amount, self.expense.date, self.expense.description),
+                         (Decimal('6.00'), date(2024, 2, 3), 'lunch'))
+        self.assertFalse(Expense.objects.filter(pk=self.doomed.pk).exists())
+
+        fields = ('category', 'month', 'total', 'count')
+        rollups = sorted(ExpenseMonthlyRollup.objects.values_list(*fields))
+        rebuild_rollups(Expense, ExpenseMonthlyRollup, 'category', [self.user.pk])
+        self.assertEqual(rollups, sorted(ExpenseMonthlyRollup.objects.values_list(*fields)))
+
+    def test_invalid_batch_changes_nothing(self):
+        other = Expense.objects.create(owner=User.objects.create(username='other'), category=self.food,
+                                       amount=1, date=date(2024, 1, 1), description='not yours')
+        response = self.post('/expenses-batch', [
+            {'op': 'delete', 'id': self.doomed.pk},
+            {'op': 'create', 'amount': 'x', 'description': '', 'category': 999, 'date': '01/02/2024'},
+            {'op': 'delete', 'id': other.pk},
+            {'op': 'update', 'id': self.expense.pk, 'category': 999, 'amount': '1e20'},
+            {'op': 'rename'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual(results[0], {'status': 'deleted', 'id': self.doomed.pk})
+        self.assertEqual(set(results[1]['errors']), {'amount', 'description', 'category', 'date'})
+        self.assertEqual(results[2]['errors'], {'id': 'No such expense'})
+        self.assertEqual(results[3]['errors'], {'category': 'No such category', 'amount': 'Amount is too large'})
+        self.assertIn('op', results[4]['errors'])
+        self.assertEqual(Expense.objects.count(), 3)
+
+    def test_updates_changed_columns_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            applied, _ = apply_batch(self.user, 'expense', [
+                {'op': 'update', 'id': self.expense.pk, 'amount': 6},
+                {'op': 'update', 'id': self.doomed.pk, 'description': 'dinner'},
+            ])
+        self.assertTrue(applied)
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "{}"'.format(Expense._meta.db_table))]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"amount"', updates[0])
+        self.assertNotIn('"description"', updates[0])
+        self.assertNotIn('"date"', updates[0])
+
+    def test_income_and_csrf(self):
+        source = Source.objects.create(name='Salary')
+        response = self.post('/income/income-batch', [
+            {'op': 'create', 'amount': 100, 'description': 'pay', 'source': source.pk, 'date': '2024-01-31'},
+        ])
+        self.assertEqual(response.json()['results'][0]['status'], 'created')
+        self.assertEqual(IncomeMonthlyRollup.objects.get(owner=self.user).count, 1)
+
+        client = self.client_class(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post('/income/income-batch', '{"operations": []}', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.post('/income/income-batch', '[]', content_type='application/json').status_code,
+                         400)
+
+
+class RecurringRuleTests(TestCase):
+    """
+    Recurring rules follow their schedule and materialize each occurrence once.
+    """
+
+    def test_schedule(self):
+        def dates(rule, start, number):
+            schedule = parse_rule(rule)
+            return [next_occurrence(schedule, start, index) for index in range(number)]
+
+        self.assertEqual(dates('FREQ=MONTHLY', date(2024, 1, 31), 3),
+                         [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31)])
+        self.assertEqual(dates('RRULE:FREQ=MONTHLY;BYMONTHDAY=1;INTERVAL=2', date(2024, 1, 15), 2),
+                         [date(2024, 2, 1), date(2024, 4, 1)])
+        self.assertEqual(dates('FREQ=MONTHLY;BYMONTHDAY=-1;COUNT=2', date(2024, 2, 1), 3),
+                         [date(2024, 2, 29), date(2024, 3, 31), None])
+        self.assertEqual(dates('FREQ=WEEKLY;UNTIL=20240115', date(2024, 1, 1), 4),
+                         [date(2024, 1, 1), date(2024, 1, 8), date(2024, 1, 15), None])
+        for rule in ('FREQ=HOURLY', 'FREQ=DAILY;BYMONTHDAY=2', 'FREQ=MONTHLY;BYDAY=MO', 'FREQ=DAILY;COUNT=0'):
+            with self.assertRaises(InvalidRecurrence):
+                parse_rule(rule)
+
+    def test_materialize_is_idempotent(self):
+        user = User.objects.create(username='recurring')
+        rent = Category.objects.create(name='Rent')
+        rule = RecurringExpense.objects.create(owner=user, category=rent, amount=900, description='rent',
+                                               rule='FREQ=MONTHLY;BYMONTHDAY=1;COUNT=3', start_date=date(2024, 1, 1))
+        salary = RecurringIncome.objects.create(owner=user, source=Source.objects.create(name='Salary'),
+                                                amount=2000, description='pay', rule='FREQ=MONTHLY;BYMONTHDAY=-1',
+                                                start_date=date(2024, 1, 1))
+
+        self.assertEqual(materialize(RecurringExpense, Expense, ExpenseMonthlyRollup, 'category',
+                                     date(2024, 2, 15), batch_size=1), (1, 2))
+        rule.refresh_from_db()
+        self.assertEqual((rule.occurrences, rule.next_date, rule.active), (2, date(2024, 3, 1), True))
+
+        # A run that wrote its rows but lost its rule update is repeated without duplicates
+        RecurringExpense.objects.filter(pk=rule.pk).update(occurrences=0, next_date=date(2024, 1, 1))
+        call_command('materialize_recurring', '--date', '2024-12-31', stdout=StringIO())
+        call_command('materialize_recurring', '--date', '2024-12-31', stdout=StringIO())
+        self.assertEqual(list(Expense.objects.order_by('date').values_list('date', flat=True)),
+                         [date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 1)])
+        rule.refresh_from_db()
+        self.assertEqual((rule.next_date, rule.active), (None, False))
+        self.assertEqual(Userincome.objects.filter(owner=user).count(), 12)
+        salary.refresh_from_db()
+        self.assertEqual(salary.next_date, date(2025, 1, 31))
+        self.assertEqual(ExpenseMonthlyRollup.objects.filter(owner=user).count(), 3)
+
+    def test_overlapping_runs(self):
+        user = User.objects.create(username='recurring')
+        rule = RecurringExpense.objects.create(owner=user, category=Category.objects.create(name='Rent'), amount=900,
+                                               description='rent', rule='FREQ=MONTHLY', start_date=date(2024, 1, 1))
+        run = partial(materialize, RecurringExpense, Expense, ExpenseMonthlyRollup, 'category', date(2024, 3, 15))
+        bulk_create = Expense.objects.bulk_create
+
+        def overlapping_bulk_create(rows, **kwargs):
+            # Another run reads and materializes the same rules before this one moves them on
+            patched.stop()
+            self.assertEqual(run(), (1, 3))
+            return bulk_create(rows, **kwargs)
+
+        patched = mock.patch.object(Expense.objects, 'bulk_create', overlapping_bulk_create)
+        patched.start()
+        self.addCleanup(patched.stop)
+        self.assertEqual(run(), (1, 3))
+        self.assertEqual(Expense.objects.count(), 3)
+        rule.refresh_from_db()
+        self.assertEqual((rule.occurrences, rule.next_date), (3, date(2024, 4, 1)))
+
+    def test_command_invalidates_web_caches(self):
+        user = User.objects.create(username='recurring')
+        RecurringExpense.objects.create(owner=user, category=Category.objects.create(name='Rent'), amount=900,
+                                        description='rent', rule='FREQ=MONTHLY', start_date=date.today())
+        self.client.force_login(user)
+        etag = self.client.get('/expense_category_summary')['ETag']
+        with other_process_cache():
+            call_command('materialize_recurring', stdout=StringIO())
+        response = self.client.get('/expense_category_summary', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['counts'], [1])
+
+
+class CategorizationTests(TestCase):
+    """
+    Categorization rules label new, imported and existing rows by precedence.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='rules')
+        self.other = User.objects.create(username='other')
+        self.food, self.cafe, self.fuel, self.big = Category.objects.bulk_create(
+            [Category(name='Food'), Category(name='Cafe'), Category(name='Fuel'), Category(name='Big')])
+        CategoryRule.objects.bulk_create([
+            CategoryRule(pattern='coffee', category=self.food),
+            CategoryRule(pattern='Coffee Shop', category=self.cafe, priority=10),
+            CategoryRule(kind=CategoryRule.REGEX, pattern=r'^(shell|bp)\b', category=self.fuel),
+            CategoryRule(pattern='coffee', category=self.fuel, owner=self.other),
+            CategoryRule(min_amount=1000, category=self.big, priority=200),
+        ])
+
+    def test_precedence(self):
+        rules = rule_set(CategoryRule, 'category', self.user.pk)
+        self.assertEqual(rules.categorize('Morning COFFEE', Decimal(3)), self.food.pk)
+        # Both keywords match; the lower priority wins
+        self.assertEqual(rules.categorize('the coffee shop', Decimal(3)), self.cafe.pk)
+        self.assertEqual(rules.categorize('SHELL 1234', Decimal(40)), self.fuel.pk)
+        self.assertEqual(rules.categorize('bookshelf', Decimal(40)), None)
+        self.assertEqual(rules.categorize('laptop', Decimal(1200)), self.big.pk)
+        self.assertEqual(rule_set(CategoryRule, 'category', self.other.pk).categorize('coffee', 3), self.fuel.pk)
+        self.assertFalse(RuleSet([], 'category'))
+
+    def test_new_and_imported_rows(self):
+        self.client.force_login(self.user)
+        self.client.post('/add_expense', {'amount': '3.20', 'description': 'Coffee', 'expense_date': '2024-01-02',
+                                          'category': ''})
+        self.assertEqual(Expense.objects.get(owner=self.user).category, self.food)
+
+        response = self.client.post('/import_csv', {'file': SimpleUploadedFile(
+            'ledger.csv', b'AMOUNT,DESCRIPTION,DATE\n40,Shell garage,2024-01-03\n5,parking,2024-01-03\n')})
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(response.json()['errors'], [{'line': 3, 'error': 'Category is required'}])
+        self.assertEqual(Expense.objects.get(description='Shell garage').category, self.fuel)
+
+        salary = Source.objects.create(name='Salary')
+        SourceRule.objects.create(pattern='payroll', source=salary)
+        statement = '!Type:Bank\nD01/08/2024\nT1500\nPACME PAYROLL\n^\nD01/09/2024\nT-9\nPKiosk\n^\n'
+        self.client.post('/import_statement', {'file': SimpleUploadedFile('bank.qif', statement.encode())})
+        self.assertEqual(Userincome.objects.get(owner=self.user).source, salary)
+        self.assertEqual(Expense.objects.get(description='Kiosk').category.name, 'Uncategorized')
+
+    def test_backfill(self):
+        uncategorized = Category.objects.create(name='Uncategorized')
+        Expense.objects.bulk_create(
+            Expense(owner=self.user, category=category, amount=4, description=description, date=date(2024, 1, 1))
+            for category, description in [(uncategorized, 'coffee'), (uncategorized, 'misc'), (self.big, 'coffee')])
+        rebuild_rollups(Expense, ExpenseMonthlyRollup, 'category', [self.user.pk])
+
+        out = StringIO()
+        call_command('categorize', '--ledger', 'expense', '--batch-size', '2', stdout=out)
+        self.assertIn('Recategorized 1 of 2 expense rows.', out.getvalue())
+        self.assertEqual(sorted(Expense.objects.values_list('description', 'category__name')),
+                         [('coffee', 'Big'), ('coffee', 'Food'), ('misc', 'Uncategorized')])
+        self.assertEqual(ExpenseMonthlyRollup.objects.get(category=self.food).count, 1)
+
+        call_command('categorize', '--all', stdout=out)
+        self.assertEqual(Expense.objects.filter(category=self.food).count(), 2)
+
+    def test_command_invalidates_web_caches(self):
+        Expense.objects.create(owner=self.user, category=Category.objects.create(name='Uncategorized'), amount=4,
+                               description='coffee', date=date.today())
+        rebuild_rollups(Expense, ExpenseMonthlyRollup, 'category', [self.user.pk])
+        self.client.force_login(self.user)
+        response = self.client.get('/expense_category_summary')
+        self.assertEqual(response.json()['labels'], ['Uncategorized'])
+        with other_process_cache():
+            call_command('categorize', '--ledger', 'expense', stdout=StringIO())
+        response = self.client.get('/expense_category_summary', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['labels'], ['Food'])
+
+
+class SyntheticLedgerTests(TestCase):
+    """
+    Generated ledgers depend only on the arguments, not on the batch size.
+    """
+
+    def generate(self, prefix, seed, batch_size):
+        call_command('generate_ledger', '--users', '3', '--rows', '40', '--income-rows', '4', '--days', '60',
+                     '--seed', str(seed), '--prefix', prefix, '--batch-size', str(batch_size), stdout=StringIO())
+        return [
+            (list(Expense.objects.filter(owner__username='{}{}'.format(prefix, number)).order_by('pk')
+                  .values_list('category__name', 'amount', 'description', 'date')),
+             list(Userincome.objects.filter(owner__username='{}{}'.format(prefix, number)).order_by('pk')
+                  .values_list('source__name', 'amount', 'description', 'date')))
+            for number in range(3)]
+
+    def test_deterministic(self):
+        dataset = self.generate('first', 1, batch_size=7)
+        self.assertEqual(self.generate('second', 1, batch_size=1000), dataset)
+        self.assertNotEqual(self.generate('third', 2, batch_size=1000), dataset)
+
+        expenses, income = dataset[0]
+        self.assertEqual((len(expenses), len(income)), (40, 4))
+        self.assertEqual([row[3] for row in expenses], sorted(row[3] for row in expenses))
+        self.assertTrue(date(2022, 1, 1) <= expenses[0][3] <= expenses[-1][3] < date(2022, 3, 2))
+        owner = User.objects.get(username='first0')
+        self.assertEqual(sum(ExpenseMonthlyRollup.objects.filter(owner=owner).values_list('count', flat=True)), 40)
+        self.assertEqual(UserPreference.objects.get(user=owner).currency, SYNTHETIC_CURRENCY)
+
+        with self.assertRaises(CommandError):
+            self.generate('first', 1, batch_size=7)
+
+
+class BenchmarkTests(TestCase):
+    """
+    The benchmark drives the views and flags regressions against a baseline.
+    """
+
+    def test_run(self):
+        generate_ledgers(2, 30, 3, date(2022, 1, 1), 60, prefix='bench')
+        self.client.force_login(User.objects.get(username='bench0'))
+        names = ['index', 'search_expenses', 'expense_category_summary', 'export_csv', 'validate_username']
+        results = run_benchmarks(self.client, names, repeat=3, warmup=0)
+
+        self.assertEqual(list(results), names)
+        for result in results.values():
+            self.assertEqual(result['status'], 200)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+            self.assertGreater(result['queries'], 0)
+            self.assertGreater(result['peak_kib'], 0)
+        self.assertGreater(results['export_csv']['bytes'], 31 * 20)
+
+    def test_kept_dataset(self):
+        self.assertIsNone(benchmark_user(2, 10, 0))
+        user = seed_dataset(2, 10, 0)
+        self.assertEqual(user.username, 'bench-u2-r10-s0-0')
+        self.assertEqual(benchmark_user(2, 10, 0), user)
+
+        # A database kept from a run with other parameters is refused, not reused
+        self.assertIsNone(benchmark_user(2, 20, 0))
+        with self.assertRaises(ValueError):
+            seed_dataset(2, 20, 0)
+
+        # So is a dataset cut short while seeding
+        User.objects.filter(username='bench-u2-r10-s0-1').update(username='other')
+        self.assertIsNone(benchmark_user(2, 10, 0))
+
+    def test_compare(self):
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 99), 5)
+        baseline = {'index': {'p50_ms': 10, 'p95_ms': 20, 'p99_ms': 30, 'queries': 3, 'peak_kib': 100}}
+        same = {'index': {'p50_ms': 11, 'p95_ms': 20.5, 'p99_ms': 30, 'queries': 3, 'peak_kib': 110},
+                'new_view': {'p50_ms': 1, 'p95_ms': 1, 'p99_ms': 1, 'queries': 1, 'peak_kib': 1}}
+        self.assertEqual(compare(same, baseline, threshold=0.2), [])
+        worse = {'index': {'p50_ms': 15, 'p95_ms': 20, 'p99_ms': 30, 'queries': 4, 'peak_kib': 200}}
+        self.assertEqual(compare(worse, baseline, threshold=0.2), [
+            'index: p50_ms 10.0 ms -> 15.0 ms',
+            'index: 3 -> 4 queries',
+            'index: peak memory 100 KiB -> 200 KiB',
+        ])
+
+
+class ExportJobTests(TestCase):
+    """
+    A queued export is rendered, polled, downloaded and finally expired.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+        self.user = User.objects.create(username='jobs')
+        category = Category.objects.create(name='Food')
+        Expense.objects.create(owner=self.user, category=category, amount='4.20', date=date(2024, 1, 1),
+                               description='lunch')
+        self.client.force_login(self.user)
+
+    def test_lifecycle(self):
+        response = self.client.post('/export-jobs', {'ledger': 'expense', 'format': 'csv'})
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual(self.client.get(job['status_url']).json()['status'], ExportJob.PENDING)
+
+        self.assertTrue(claim_job(job['id']))
+        self.assertFalse(claim_job(job['id']))
+        run_export_job(job['id'])
+
+        status = self.client.get(job['status_url']).json()
+        self.assertEqual(status['status'], ExportJob.DONE)
+        download = self.client.get(status['download_url'])
+        self.assertIn('filename="Expenses_', download['Content-Disposition'])
+        self.assertEqual(b''.join(download.streaming_content).decode().splitlines()[1], '4.20,lunch,Food,2024-01-01')
+        download.close()
+
+        # Other users cannot see the job
+        self.client.force_login(User.objects.create(username='other'))
+        self.assertEqual(self.client.get(job['status_url']).status_code, 404)
+
+        path = ExportJob.objects.get(pk=job['id']).file.path
+        self.assertEqual(expire_jobs(now=timezone.now() + timedelta(days=2)), (1, 0))
+        self.assertFalse(os.path.exists(path))
+
+    def test_invalid_request(self):
+        response = self.client.post('/export-jobs', {'ledger': 'expense', 'format': 'doc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_stale_jobs_fail(self):
+        pending = enqueue_export(self.user, 'expense', 'csv')
+        running = enqueue_export(self.user, 'expense', 'pdf')
+        claim_job(running.pk)
+        self.assertEqual(expire_jobs(), (0, 0))
+        later = timezone.now() + timedelta(seconds=EXPORT_JOB_TIMEOUT + 1)
+        self.assertEqual(expire_jobs(now=later), (0, 2))
+        self.assertEqual(set(ExportJob.objects.values_list('pk', 'status')),
+                         {(pending.pk, ExportJob.FAILED), (running.pk, ExportJob.FAILED)})
+
+    def test_worker_survives_a_dead_process(self):
+        class BrokenPool:
+            def submit(self, function, *args):
+                future = Future()
+                future.set_exception(BrokenProcessPool('A process in the process pool was terminated abruptly'))
+                return future
+
+            def shutdown(self, **kwargs):
+                pass
+
+        job = enqueue_export(self.user, 'expense', 'pdf')
+        with mock.patch.object(ExportWorkerCommand, 'start_pool', side_effect=lambda processes: BrokenPool()) as pools:
+            call_command('run_export_worker', '--once', '--processes', '2', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(pools.call_count, 2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.FAILED)
+        self.assertIn('BrokenProcessPool', job.error)
+
+
+class PdfExportTests(TestCase):
+    """
+    A ledger larger than one part is rendered in parts and joined into one PDF.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='pdf')
+        category = Category.objects.create(name='Food')
+        Expense.objects.bulk_create(
+            Expense(owner=self.user, category=category, amount=number, description='row',
+                    date=date(2024, 1, 1) + timedelta(days=number))
+            for number in range(25))
+
+    def test_parts(self):
+        contexts = list(pdf_part_contexts(export_queryset(Expense.objects.filter(owner=self.user), 'category'),
+                                          'category', 'expenses'))
+        self.assertEqual(len(contexts), 1)
+
+        with mock.patch('expenses.exports.PDF_CHUNK_ROWS', 10):
+            contexts = list(pdf_part_contexts(
+                export_queryset(Expense.objects.filter(owner=self.user), 'category'), 'category', 'expenses'))
+        self.assertEqual([len(context['expenses']) for context in contexts], [10, 10, 5])
+        self.assertEqual([context['offset'] for context in contexts], [0, 10, 20])
+        self.assertEqual([context['last'] for context in contexts], [False, False, True])
+        self.assertEqual(contexts[-1]['total'], Decimal(sum(range(25))))
+        self.assertEqual(contexts[0]['expenses'][0]['category'], 'Food')
+
+    def test_joined_document(self):
+        self.client.force_login(self.user)
+        with mock.patch('expenses.exports.PDF_CHUNK_ROWS', 10), \
+                mock.patch('expenses.exports.PDF_RENDER_PROCESSES', 2):
+            response = self.client.get('/export_pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertGreaterEqual(len(PdfReader(BytesIO(b''.join(response.streaming_content))).pages), 3)
+
+    def test_sequential_in_pool_processes(self):
+        output = BytesIO()
+        with mock.patch('expenses.exports.PDF_CHUNK_ROWS', 10), \
+                mock.patch('expenses.exports.PDF_RENDER_PROCESSES', 2), \
+                mock.patch('expenses.exports.parent_process', return_value=object()), \
+                mock.patch('expenses.exports.pdf_pool') as pool:
+            write_pdf(Expense.objects.filter(owner=self.user), 'category', 'expenses/pdf-output.html', 'expenses',
+                      output)
+        pool.assert_not_called()
+        self.assertGreaterEqual(len(PdfReader(BytesIO(output.getvalue())).pages), 3)
+
+
+@skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+class ColumnarExportTests(TestCase):
+    """
+    Columnar exports are typed and honour the SQL-side filters.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='columnar')
+        food, rent = Category.objects.bulk_create([Category(name='Food'), Category(name='Rent')])
+        Expense.objects.bulk_create(
+            Expense(owner=cls.user, category=food if number % 2 else rent, amount=Decimal(number) / 4,
+                    description='row {}'.format(number), date=date(2024, 1, 1) + timedelta(days=number))
+            for number in range(100))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+
+        with mock.patch('expenses.exports.COLUMNAR_BATCH_ROWS', 30):
+            response = self.client.get('/export_columnar', {'format': 'parquet', 'label': 'Food',
+                                                            'start': '2024-01-11', 'min_amount': '5'})
+        parquet = pq.ParquetFile(BytesIO(b''.join(response.streaming_content)))
+        table = parquet.read()
+        self.assertEqual(parquet.metadata.num_row_groups, 2)
+        self.assertEqual(str(table.schema.field('amount').type), 'decimal128(18, 2)')
+        self.assertEqual(str(table.schema.field('date').type), 'date32[day]')
+        # Odd numbers from 21 to 99
+        self.assertEqual(table.num_rows, 40)
+        self.assertEqual(table.column('amount')[0].as_py(), Decimal('24.75'))
+        self.assertEqual(set(table.column('category').to_pylist()), {'Food'})
+
+    def test_arrow(self):
+        import pyarrow as pa
+
+        response = self.client.get('/export_columnar', {'format': 'arrow', 'max_amount': '1'})
+        table = pa.ipc.open_stream(b''.join(response.streaming_content)).read_all()
+        self.assertEqual(table.column('date').to_pylist()[-1], date(2024, 1, 1))
+        self.assertEqual(table.num_rows, 5)
+
+    def test_invalid_filter(self):
+        response = self.client.get('/export_columnar', {'min_amount': 'lots'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CombinedExportTests(TestCase):
+    """
+    The combined export interleaves both ledgers by date with a running balance.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='combined')
+        food = Category.objects.create(name='Food')
+        salary = Source.objects.create(name='Salary')
+        Userincome.objects.bulk_create([
+            Userincome(owner=cls.user, source=salary, amount=100, description='pay', date=date(2024, 1, 1)),
+            Userincome(owner=cls.user, source=salary, amount=50, description='bonus', date=date(2024, 1, 3)),
+        ])
+        Expense.objects.bulk_create([
+            Expense(owner=cls.user, category=food, amount=Decimal('10.50'), description='a', date=date(2024, 1, 1)),
+            Expense(owner=cls.user, category=food, amount=20, description='b', date=date(2024, 1, 2)),
+            Expense(owner=cls.user, category=food, amount=5, description='c', date=date(2024, 1, 3)),
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_csv(self):
+        response = self.client.get('/export_combined')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [
+            ','.join(COMBINED_COLUMNS),
+            '2024-01-01,income,Salary,pay,100.00,100.00',
+            '2024-01-01,expense,Food,a,-10.50,89.50',
+            '2024-01-02,expense,Food,b,-20.00,69.50',
+            '2024-01-03,income,Salary,bonus,50.00,119.50',
+            '2024-01-03,expense,Food,c,-5.00,114.50',
+        ])
+
+    def test_jsonl_window(self):
+        response = self.client.get('/export_combined', {'format': 'jsonl', 'start': '2024-01-02', 'end': '2024-01-02'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows, [{'date': '2024-01-02', 'type': 'expense', 'label': 'Food', 'description': 'b',
+                                 'amount': '-20.00', 'balance': '69.50'}])
@@ -11,10 +11,19 @@ urlpatterns = [
     path('edit-expense/<int:id>', views.expense_edit, name="expense-edit"),
     path('expense-delete/<int:id>', views.delete_expense, name="expense-delete"),
     path('search-expenses', csrf_exempt(views.search_expenses), name="search_expenses"),
+    path('search-transactions', csrf_exempt(views.search_transactions), name="search_transactions"),
     path('expense_category_summary', views.expense_category_summary, name="expense_category_summary"),
     path('stats', views.stats_view, name="stats"),
     path('export_csv', views.export_csv, name="export_csv"),
     path('export_excel', views.export_excel, name="export_excel"),
     path('export_pdf', views.export_pdf, name="export_pdf"),
+    path('export_columnar', views.export_columnar, name="export_columnar"),
+    path('export_combined', views.export_combined, name="export_combined"),
+    path('expenses-batch', views.expense_batch, name="expense_batch"),
+    path('import_csv', views.import_expenses, name="import_expenses"),
+    path('import_statement', views.import_statement, name="import_statement"),
+    path('export-jobs', views.export_job_create, name="export_job_create"),
+    path('export-jobs/<int:id>', views.export_job_status, name="export_job_status"),
+    path('export-jobs/<int:id>/download', views.export_job_download, name="export_job_download"),
 
 ]
\ No newline at end of file
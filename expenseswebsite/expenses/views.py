@@ -1,47 +1,106 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth.decorators import login_required
-from .models import Category, Expense
+from .models import Category, CategoryRule, Expense, ExpenseMonthlyRollup, ExportJob
 from django.contrib import messages
-from django.core.paginator import Paginator
+from django.core.exceptions import ValidationError
+import codecs
 import json
-from django.http import JsonResponse, HttpResponse
+import os
+from decimal import Decimal
+from django.http import FileResponse, Http404, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import require_POST
 from userpreferences.models import UserPreference
 from datetime import *
-from django.utils import timezone
 
 # Usage example
 # date_str = '2023-06-18'
 # date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
 
-# CSV file conversion utility import
-import csv
-# Excel file conversion utility import
-import xlwt
-# PDF file conversion utility import
-from django.template.loader import render_to_string
-from weasyprint import HTML
-import tempfile
-from django.db.models import Sum
+from django.db.models import CharField, F, Value
+from userincome.models import Source, Userincome
+from .batch import InvalidBatch, apply_batch
+from .cache import cached_artifact, cached_for_user, conditional_on_ledger
+from .categorize import rule_set
+from .exports import (COLUMNAR_FORMATS, COMBINED_COLUMNS, COMBINED_FIELDS, XLSX_CONTENT_TYPE, InvalidExportFilter,
+                      accepted_encoding, combined_rows, export_filename, filter_ledger, ledger_rows, opening_balance,
+                      stream_csv, stream_jsonl, write_columnar, write_pdf, write_xlsx)
+from .imports import InvalidImportFile, import_csv
+from .jobs import enqueue_export
+from .pagination import InvalidCursor, KeysetPaginator, get_page_size
+from .search import TRANSACTION_ORDERING, search_ledger, search_page
+from .statements import import_statement as import_statement_file
+from .summaries import InvalidSummaryRequest, ledger_summary, summary_window
+
+# Columns the expenses table shows, and so the only ones search returns
+EXPENSE_SEARCH_FIELDS = {
+    'id': 'id',
+    'amount': 'amount',
+    'category': 'category__name',
+    'description': 'description',
+    'date': 'date',
+}
+
+# Columns returned by the cross-ledger search; ``label`` is the category or source
+TRANSACTION_SEARCH_FIELDS = {field: field for field in ('type', 'id', 'amount', 'label', 'description', 'date')}
 
 def search_expenses(request):
     """
     Search expenses based on the provided search string.
 
+    Matches descriptions through the full-text index and amounts, dates and
+    categories through range/lookup predicates, best matches first. The
+    request body may also carry ``cursor`` (from a previous page's
+    ``next_cursor``), ``pageSize`` and ``fields``.
+
     Parameters:
     - request: The HTTP request object.
 
     Returns:
-    - JsonResponse: JSON response containing the matching expenses.
+    - JsonResponse: One page of matching expenses with the cursor for the next page.
     """
     if request.method == 'POST':
-        search_str = json.loads(request.body).get('searchText')
-        expenses = Expense.objects.filter(
-            amount__istartswith=search_str, owner=request.user) | Expense.objects.filter(
-            date__istartswith=search_str, owner=request.user) | Expense.objects.filter(
-            description__icontains=search_str, owner=request.user) | Expense.objects.filter(
-            category__icontains=search_str, owner=request.user)
-        data = expenses.values()
-        return JsonResponse(list(data), safe=False)
+        params = json.loads(request.body)
+        expenses = search_ledger(Expense.objects.filter(owner=request.user),
+                                 params.get('searchText'), 'category', Category)
+        try:
+            data = search_page(expenses, params, EXPENSE_SEARCH_FIELDS)
+        except InvalidCursor as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        return JsonResponse(data)
+
+
+
+def search_transactions(request):
+    """
+    Search expenses and income together based on the provided search string.
+
+    Both ledgers are searched in one UNION ALL query that the database sorts
+    and limits, and every row carries a ``type`` of ``expense`` or ``income``.
+    The request body takes the same ``searchText``, ``cursor``, ``pageSize``
+    and ``fields`` keys as ``search_expenses``.
+
+    Parameters:
+    - request: The HTTP request object.
+
+    Returns:
+    - JsonResponse: One page of matching transactions with the cursor for the next page.
+    """
+    if request.method == 'POST':
+        params = json.loads(request.body)
+        search_str = params.get('searchText')
+        expenses = search_ledger(Expense.objects.filter(owner=request.user),
+                                 search_str, 'category', Category).annotate(
+            label=F('category__name'), type=Value('expense', output_field=CharField()))
+        income = search_ledger(Userincome.objects.filter(owner=request.user),
+                               search_str, 'source', Source).annotate(
+            label=F('source__name'), type=Value('income', output_field=CharField()))
+        try:
+            data = search_page([expenses, income], params, TRANSACTION_SEARCH_FIELDS,
+                               ordering=TRANSACTION_ORDERING)
+        except InvalidCursor as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        return JsonResponse(data)
 
 
 @login_required(login_url='/authentication/login')
@@ -49,16 +108,24 @@ def index(request):
     """
     View function for displaying the expenses.
 
+    Pages are addressed by the ``after``/``before`` cursors of the pager links
+    and hold ``per_page`` rows.
+
     Parameters:
     - request: The HTTP request object.
 
     Returns:
     - HttpResponse: Rendered response with the expenses and pagination.
     """
-    expenses = Expense.objects.filter(owner=request.user)
-    paginator = Paginator(expenses, 5)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    expenses = Expense.objects.filter(owner=request.user).select_related('category')
+    per_page = get_page_size(request)
+    paginator = KeysetPaginator(expenses, per_page)
+    after, before = request.GET.get('after'), request.GET.get('before')
+    if after or before:
+        page_obj = paginator.get_page(after, before)
+    else:
+        # The first page is what almost every visit shows
+        page_obj = cached_for_user(request.user.pk, 'expense-index', [per_page], paginator.page)
 
     try:
         user_preference = UserPreference.objects.get(user=request.user)
@@ -67,8 +134,8 @@ def index(request):
         currency = None
 
     context = {
-        'expenses': expenses,
         'page_obj': page_obj,
+        'per_page': per_page,
         'currency': currency,
     }
     return render(request, 'expenses/index.html', context)
@@ -99,16 +166,32 @@ def add_expense(request):
         amount = request.POST['amount']
         description = request.POST['description']
         date_str = request.POST['expense_date']
-        category = request.POST['category']
+        category_id = request.POST.get('category', '')
+        category = Category.objects.filter(pk=category_id).first() if category_id.isdigit() else None
 
         if not amount:
             messages.error(request, 'Amount is required')
             return render(request, 'expenses/add_expense.html', context)
 
+        try:
+            amount = Expense._meta.get_field('amount').to_python(amount)
+        except ValidationError:
+            messages.error(request, 'Amount must be a number')
+            return render(request, 'expenses/add_expense.html', context)
+
         if not description:
             messages.error(request, 'Description is required')
             return render(request, 'expenses/add_expense.html', context)
 
+        if not category:
+            # Left to the owner's categorization rules
+            category_id = rule_set(CategoryRule, 'category', request.user.pk).categorize(description, amount)
+            category = Category.objects.filter(pk=category_id).first() if category_id else None
+
+        if not category:
+            messages.error(request, 'Category is required')
+            return render(request, 'expenses/add_expense.html', context)
+
         try:
             date = datetime.strptime(date_str, '%Y-%m-%d').date()
         except ValueError:
@@ -144,18 +227,21 @@ def expense_edit(request, id):
         amount = request.POST.get('amount')
         description = request.POST.get('description')
         date_str = request.POST.get('expense_date')
-        category = request.POST.get('category')
+        category_id = request.POST.get('category', '')
+        category = Category.objects.filter(pk=category_id).first() if category_id.isdigit() else None
 
         if not amount:
             messages.error(request, 'Amount is required!')
         elif not description:
             messages.error(request, 'Description is required!')
+        elif not category:
+            messages.error(request, 'Category is required!')
         elif not date_str:
             messages.error(request, 'Date is required!')
         else:
             try:
                 date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                expense.amount = amount
+                expense.amount = Expense._meta.get_field('amount').to_python(amount)
                 expense.description = description
                 expense.date = date
                 expense.category = category
@@ -164,6 +250,8 @@ def expense_edit(request, id):
                 return redirect('expenses')
             except ValueError:
                 messages.error(request, 'Invalid date format! The date must be in YYYY-MM-DD format.')
+            except ValidationError:
+                messages.error(request, 'Amount must be a number!')
 
     context = {
         'expense': expense,
@@ -193,32 +281,33 @@ def delete_expense(request, id):
     return redirect('expenses')
 
 
+@conditional_on_ledger
 def expense_category_summary(request):
     """
     View function for generating the expense category summary.
 
+    Totals are grouped by category and period in the database. The window is
+    given by the ``start``/``end`` query parameters (default: the last six
+    months) and the period width by ``granularity`` (day, week, month or year).
+    Monthly and yearly summaries are read from the monthly rollups. A client
+    holding the current version gets a 304.
+
     Parameters:
     - request: The HTTP request object.
 
     Returns:
-    - JsonResponse: JSON response containing the expense category data.
+    - JsonResponse: The summary arrays, or an error with status 400.
     """
-    today = date.today()
-    six_months_ago = today - timedelta(days=30 * 6)
-
-    expenses = Expense.objects.filter(owner=request.user,
-                                      date__gte=six_months_ago,
-                                      date__lte=today)
-
-    finalrep = {}
-    for expense in expenses:
-        category = expense.category
-        if category in finalrep:
-            finalrep[category] += expense.amount
-        else:
-            finalrep[category] = expense.amount
+    try:
+        start, end, granularity = summary_window(request.GET)
+    except InvalidSummaryRequest as error:
+        return JsonResponse({'error': str(error)}, status=400)
 
-    return JsonResponse({'expense_category_data': finalrep}, safe=False)
+    expenses = Expense.objects.filter(owner=request.user)
+    rollups = ExpenseMonthlyRollup.objects.filter(owner=request.user)
+    summary = cached_for_user(request.user.pk, 'expense-summary', [start, end, granularity],
+                              lambda: ledger_summary(expenses, 'category', start, end, granularity, rollups))
+    return JsonResponse(summary)
 
 
 def stats_view(request):
@@ -234,110 +323,294 @@ def stats_view(request):
     return render(request, 'expenses/stats.html')
 
 
+@conditional_on_ledger
 def export_csv(request):
     """
     View function for exporting expenses as a CSV file.
 
+    The file is streamed as rows are read, so memory use stays flat however
+    many expenses the user has. It is compressed on the fly (gzip, or zstd
+    where installed) when the client's ``Accept-Encoding`` allows.
+
     Parameters:
     - request: The HTTP request object.
 
     Returns:
-    - HttpResponse: CSV file response containing the expenses.
+    - StreamingHttpResponse: CSV file response containing the expenses.
+    """
+    expenses = Expense.objects.filter(owner=request.user)
+    return stream_csv(ledger_rows(expenses, 'category'), export_filename('Expenses', 'csv'),
+                      encoding=accepted_encoding(request))
+
+
+@conditional_on_ledger
+def export_excel(request):
     """
-    now = timezone.now().strftime('%Y-%m-%d_%H-%M-%S')  # Format the current datetime
-    filename = 'Expenses_{}.csv'.format(now)
+    View function for exporting expenses as an Excel (.xlsx) file.
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'inline; attachment; filename="{}"'.format(filename)
+    The rendered workbook is cached until the user's expenses change.
 
-    writer = csv.writer(response)
-    writer.writerow(['AMOUNT', 'DESCRIPTION', 'CATEGORY', 'DATE'])
+    Parameters:
+    - request: The HTTP request object.
 
+    Returns:
+    - FileResponse: Excel file response containing the expenses and their total.
+    """
     expenses = Expense.objects.filter(owner=request.user)
+    output = cached_artifact(request.user.pk, 'expense-xlsx', [],
+                             lambda output: write_xlsx(ledger_rows(expenses, 'category'), output, 'Expenses'))
+    return FileResponse(output, as_attachment=True, filename=export_filename('Expenses', 'xlsx'),
+                        content_type=XLSX_CONTENT_TYPE)
 
-    for expense in expenses:
-        writer.writerow([expense.amount, expense.description, expense.category, expense.date])
 
-    return response
+@conditional_on_ledger
+def export_columnar(request):
+    """
+    View function for exporting expenses as a Parquet file or Arrow IPC stream.
 
+    ``format`` is ``parquet`` (default) or ``arrow``; ``start``, ``end``,
+    ``label`` (category name, repeatable), ``min_amount`` and ``max_amount``
+    narrow the rows in the database query. Rendered files are cached per set
+    of parameters until the user's expenses change.
 
-def export_excel(request):
+    Parameters:
+    - request: The HTTP request object.
+
+    Returns:
+    - FileResponse: The typed columnar file, or a JSON error.
+    """
+    export_format = request.GET.get('format', 'parquet')
+    if export_format not in COLUMNAR_FORMATS:
+        return JsonResponse({'error': 'format must be one of: {}'.format(', '.join(COLUMNAR_FORMATS))}, status=400)
+    try:
+        expenses = filter_ledger(Expense.objects.filter(owner=request.user), 'category', request.GET)
+        output = cached_artifact(
+            request.user.pk, 'expense-columnar', sorted(request.GET.lists()),
+            lambda output: write_columnar(ledger_rows(expenses, 'category'), output, export_format, 'category'))
+    except InvalidExportFilter as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    except ImportError:
+        return JsonResponse({'error': 'Columnar exports need pyarrow installed'}, status=501)
+
+    extension, content_type = COLUMNAR_FORMATS[export_format]
+    return FileResponse(output, as_attachment=True, filename=export_filename('Expenses', extension),
+                        content_type=content_type)
+
+
+@conditional_on_ledger
+def export_combined(request):
     """
-    View function for exporting expenses as an Excel file.
+    View function for exporting expenses and income together as a cash-flow
+    statement, oldest first, with a running balance.
+
+    ``format`` is ``csv`` (default) or ``jsonl``; the optional ``start`` and
+    ``end`` dates bound the rows, and rows before ``start`` make up the
+    opening balance.
 
     Parameters:
     - request: The HTTP request object.
 
     Returns:
-    - HttpResponse: Excel file response containing the expenses.
+    - StreamingHttpResponse: The combined ledger, or a JSON error.
     """
-    import datetime
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'jsonl'):
+        return JsonResponse({'error': 'format must be one of: csv, jsonl'}, status=400)
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return JsonResponse({'error': 'Dates must be given as YYYY-MM-DD'}, status=400)
 
-    response = HttpResponse(content_type='application/ms-excel')
-    current_datetime = datetime.datetime.now()
-    file_name = 'Expenses_' + current_datetime.strftime('%Y-%m-%d_%H-%M-%S') + '.xls'
-    response['Content-Disposition'] = 'inline; attachment; filename=' + file_name
+    expenses = Expense.objects.filter(owner=request.user)
+    income = Userincome.objects.filter(owner=request.user)
+    balance = opening_balance(expenses, income, start) if start else Decimal(0)
+    if start:
+        expenses, income = expenses.filter(date__gte=start), income.filter(date__gte=start)
+    if end:
+        expenses, income = expenses.filter(date__lte=end), income.filter(date__lte=end)
 
-    wb = xlwt.Workbook(encoding='utf-8')
-    ws = wb.add_sheet('Expenses')
-    row_num = 0
-    font_style = xlwt.XFStyle()
-    font_style.font.bold = True
+    rows = combined_rows(expenses, income, balance)
+    filename = export_filename('Ledger', export_format)
+    if export_format == 'jsonl':
+        return stream_jsonl(rows, filename, COMBINED_FIELDS, encoding=accepted_encoding(request))
+    return stream_csv(rows, filename, COMBINED_COLUMNS, encoding=accepted_encoding(request))
 
-    columns = ['AMOUNT', 'DESCRIPTION', 'CATEGORY', 'DATE']
 
-    for col_num in range(len(columns)):
-        ws.write(row_num, col_num, columns[col_num], font_style)
+@conditional_on_ledger
+def export_pdf(request):
+    """
+    View function for exporting expenses as a PDF file.
 
-    font_style = xlwt.XFStyle()
+    Large ledgers are rendered in parallel parts and joined. The document is
+    cached until the user's expenses change.
 
-    rows = Expense.objects.filter(owner=request.user).values_list(
-        'amount', 'description', 'category', 'date')
+    Parameters:
+    - request: The HTTP request object.
 
-    for row in rows:
-        row_num += 1
+    Returns:
+    - FileResponse: PDF file response containing the expenses.
+    """
+    expenses = Expense.objects.filter(owner=request.user)
+    output = cached_artifact(
+        request.user.pk, 'expense-pdf', [],
+        lambda output: write_pdf(expenses, 'category', 'expenses/pdf-output.html', 'expenses', output))
+    return FileResponse(output, filename=export_filename('Expenses', 'pdf'), content_type='application/pdf')
 
-        for col_num in range(len(row)):
-            ws.write(row_num, col_num, str(row[col_num]), font_style)
 
-    wb.save(response)
+@login_required(login_url='/authentication/login')
+@require_POST
+def expense_batch(request):
+    """
+    View function for applying many expense changes in one request.
 
-    return response
+    The JSON body is ``{"operations": [...]}`` where each operation is
+    ``{"op": "create", "amount", "description", "category", "date"}``,
+    ``{"op": "update", "id", ...changed fields}`` or ``{"op": "delete", "id"}``
+    (``category`` is a category id). All operations are applied in one
+    transaction, or none if any is invalid.
 
+    Parameters:
+    - request: The HTTP request object.
 
-def export_pdf(request):
+    Returns:
+    - JsonResponse: One result per operation, with status 400 if nothing was applied.
     """
-    View function for exporting expenses as a PDF file.
+    try:
+        operations = json.loads(request.body).get('operations')
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'The body must be a JSON object'}, status=400)
+    try:
+        applied, results = apply_batch(request.user, 'expense', operations)
+    except InvalidBatch as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({'applied': applied, 'results': results}, status=200 if applied else 400)
+
+
+@login_required(login_url='/authentication/login')
+@require_POST
+def import_expenses(request):
+    """
+    View function for importing expenses from an uploaded CSV file.
+
+    The file (form field ``file``) uses the layout of the CSV export. Valid
+    rows are inserted in batches and missing categories are created; invalid
+    rows are skipped and reported.
 
     Parameters:
     - request: The HTTP request object.
 
     Returns:
-    - HttpResponse: PDF file response containing the expenses.
+    - JsonResponse: The number of rows created and the row errors, or an error with status 400.
     """
-    import datetime
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'A CSV file is required'}, status=400)
+    try:
+        report = import_csv(request.user, 'expense', codecs.iterdecode(upload, 'utf-8-sig'))
+    except InvalidImportFile as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse(report)
 
-    response = HttpResponse(content_type='application/pdf')
-    current_datetime = datetime.datetime.now()
-    file_name = 'Expenses_' + current_datetime.strftime('%Y-%m-%d_%H-%M-%S') + '.pdf'
-    response['Content-Disposition'] = 'inline; filename=' + file_name
 
-    response['Content-Transfer-Encoding'] = 'binary'
+@login_required(login_url='/authentication/login')
+@require_POST
+def import_statement(request):
+    """
+    View function for importing an OFX or QIF bank statement.
 
-    expenses = Expense.objects.filter(owner=request.user)
+    Debits in the uploaded ``file`` become expenses and credits income.
+    Transactions already imported from an earlier, overlapping statement are
+    skipped. ``day_first`` set to ``1`` reads QIF dates as day/month/year.
 
-    total = expenses.aggregate(Sum('amount'))
+    Parameters:
+    - request: The HTTP request object.
+
+    Returns:
+    - JsonResponse: The rows created per ledger, the duplicates skipped and the
+      row errors, or an error with status 400.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'A statement file is required'}, status=400)
+    try:
+        report = import_statement_file(request.user, upload.name, upload.read(),
+                                       day_first=request.POST.get('day_first') == '1')
+    except InvalidImportFile as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse(report)
 
-    html_string = render_to_string(
-        'expenses/pdf-output.html', {'expenses': expenses, 'total': total['amount__sum']})
-    html = HTML(string=html_string)
 
-    result = html.write_pdf()
+def export_job_payload(job):
+    """
+    Return the JSON description of an export job.
+    """
+    payload = {
+        'id': job.pk,
+        'ledger': job.ledger,
+        'format': job.format,
+        'status': job.status,
+        'status_url': reverse('export_job_status', args=[job.pk]),
+    }
+    if job.status == ExportJob.DONE:
+        payload['download_url'] = reverse('export_job_download', args=[job.pk])
+        payload['expires_at'] = job.expires_at.isoformat()
+    elif job.status == ExportJob.FAILED:
+        payload['error'] = job.error
+    return payload
 
-    with tempfile.NamedTemporaryFile(delete=True) as output:
-        output.write(result)
-        output.flush()
-        output = open(output.name, 'rb')
-        response.write(output.read())
 
-    return response
+@login_required(login_url='/authentication/login')
+@require_POST
+def export_job_create(request):
+    """
+    View function for queueing an export in the background.
+
+    Expects ``ledger`` (expense or income) and ``format`` (csv, xlsx or pdf)
+    form fields; the job is rendered by ``manage.py run_export_worker``.
+
+    Parameters:
+    - request: The HTTP request object.
+
+    Returns:
+    - JsonResponse: The new job with status 202, or an error with status 400.
+    """
+    try:
+        job = enqueue_export(request.user, request.POST.get('ledger'), request.POST.get('format'))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse(export_job_payload(job), status=202)
+
+
+@login_required(login_url='/authentication/login')
+def export_job_status(request, id):
+    """
+    View function for polling an export job.
+
+    Parameters:
+    - request: The HTTP request object.
+    - id: The ID of the job.
+
+    Returns:
+    - JsonResponse: The job status, with a download URL once it is done.
+    """
+    job = get_object_or_404(ExportJob, pk=id, owner=request.user)
+    return JsonResponse(export_job_payload(job))
+
+
+@login_required(login_url='/authentication/login')
+def export_job_download(request, id):
+    """
+    View function for downloading the file of a finished export job.
+
+    Parameters:
+    - request: The HTTP request object.
+    - id: The ID of the job.
+
+    Returns:
+    - FileResponse: The exported file.
+    """
+    job = get_object_or_404(ExportJob, pk=id, owner=request.user, status=ExportJob.DONE)
+    if not job.file:
+        raise Http404('The export has expired')
+    return FileResponse(job.file.open('rb'), as_attachment=True, filename=os.path.basename(job.file.name))
@@ -89,6 +89,27 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Per-process memory by default; set CACHE_DIR to share a file-based cache between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['CACHE_DIR'],
+    } if os.environ.get('CACHE_DIR') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'expenseswebsite',
+    }
+}
+
+# Lifetime of cached summaries and list pages; changes invalidate them immediately anyway
+LEDGER_CACHE_TIMEOUT = 60 * 60
+
+# Rendered exports up to this size are cached too
+LEDGER_ARTIFACT_MAX_BYTES = 5 * 1024 * 1024
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -129,6 +150,15 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'expenseswebsite/static')]
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
+# Uploaded and generated files (export job results)
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+
+# Finished exports can be downloaded for this long before cleanup_export_jobs removes them
+EXPORT_JOB_TTL = 24 * 60 * 60
+
+# Processes each web worker renders the parts of large PDF exports in
+PDF_RENDER_PROCESSES = int(os.environ.get('PDF_RENDER_PROCESSES', 2))
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -0,0 +1,59 @@
+// Run the export buttons as background jobs: queue the job, poll its status,
+// then download the file. Without JavaScript the buttons keep their direct links,
+// and a job the worker has not finished in time falls back to them as well.
+const csrfToken = document.querySelector("[name=csrfmiddlewaretoken]");
+const exportButtons = document.querySelectorAll("[data-export-format]");
+
+// Give up on a job still pending or running after this long, e.g. when no worker runs
+const EXPORT_POLL_TIMEOUT_MS = 30000;
+
+const pollExportJob = (job, button, label, deadline) => {
+  fetch(job.status_url)
+    .then((res) => res.json())
+    .then((data) => {
+      if (data.status === "done") {
+        button.textContent = label;
+        window.location = data.download_url;
+      } else if (data.status === "failed") {
+        button.textContent = label;
+        alert(`Export failed: ${data.error}`);
+      } else if (Date.now() > deadline) {
+        button.textContent = label;
+        window.location = button.href;
+      } else {
+        setTimeout(() => pollExportJob(data, button, label, deadline), 1000);
+      }
+    })
+    .catch(() => {
+      button.textContent = label;
+    });
+};
+
+exportButtons.forEach((button) => {
+  button.addEventListener("click", (e) => {
+    e.preventDefault();
+    const label = button.textContent;
+    const body = new FormData();
+    body.append("ledger", button.dataset.exportLedger);
+    body.append("format", button.dataset.exportFormat);
+
+    button.textContent = "Preparing…";
+    fetch("/export-jobs", {
+      method: "POST",
+      body: body,
+      headers: { "X-CSRFToken": csrfToken.value },
+    })
+      .then((res) => res.json())
+      .then((job) => {
+        if (job.error) {
+          button.textContent = label;
+          alert(job.error);
+        } else {
+          pollExportJob(job, button, label, Date.now() + EXPORT_POLL_TIMEOUT_MS);
+        }
+      })
+      .catch(() => {
+        button.textContent = label;
+      });
+  });
+});
@@ -6,6 +6,37 @@ const tableBody = document.querySelector('.table-body');
 const paginationContainer = document.querySelector('.pagination-container');
 tableOutput.style.display = 'none';
 
+// "Load more" button for the next page of search results
+const loadMoreButton = document.createElement('button');
+loadMoreButton.className = 'btn btn-outline-secondary btn-sm';
+loadMoreButton.textContent = 'Load more';
+loadMoreButton.style.display = 'none';
+tableOutput.appendChild(loadMoreButton);
+
+let nextCursor = null;
+
+// Generate HTML for each search result item
+const renderRows = (results) => results.map(item => `
+    <tr>
+        <td>${item.amount}</td>
+        <td>${item.category}</td>
+        <td>${item.description}</td>
+        <td>${item.date}</td>
+    </tr>
+`).join('');
+
+// Fetch one page of search results from server
+const fetchResults = (searchValue, cursor) => fetch("/search-expenses", {
+    body: JSON.stringify({ searchText: searchValue, cursor: cursor }),
+    method: "POST",
+})
+.then((res) => res.json())
+.then((data) => {
+    nextCursor = data.next_cursor;
+    loadMoreButton.style.display = nextCursor ? "inline-block" : "none";
+    return data;
+});
+
 // Event listener for search field
 searchField.addEventListener('keyup', (e) => {
     const searchValue = e.target.value;
@@ -15,34 +46,16 @@ searchField.addEventListener('keyup', (e) => {
         paginationContainer.style.display = "none";
         tableBody.innerHTML = "";
 
-        // Fetch search results from server
-        fetch("/search-expenses", {
-            body: JSON.stringify({ searchText: searchValue }),
-            method: "POST",
-        })
-        .then((res) => res.json())
-        .then((data) => {
-            console.log("data", data);
-
+        fetchResults(searchValue, null).then((data) => {
             // Hide original table and show search results container
             appTable.style.display = "none";
             tableOutput.style.display = "block";
 
-            if (data.length === 0) {
-                tableOutput.innerHTML = "No search results found!";
+            if (data.results.length === 0) {
+                tableBody.innerHTML = "<tr><td colspan='4'>No search results found!</td></tr>";
             } else {
-                // Generate HTML for each search result item
-                const tableRows = data.map(item => `
-                    <tr>
-                        <td>${item.amount}</td>
-                        <td>${item.category}</td>
-                        <td>${item.description}</td>
-                        <td>${item.date}</td>
-                    </tr>
-                `).join('');
-
                 // Append generated HTML to table body
-                tableBody.innerHTML = tableRows;
+                tableBody.innerHTML = renderRows(data.results);
             }
         });
     } else {
@@ -52,3 +65,12 @@ searchField.addEventListener('keyup', (e) => {
         paginationContainer.style.display = "block";
     }
 });
+
+// Event listener for the "Load more" button
+loadMoreButton.addEventListener('click', () => {
+    if (nextCursor) {
+        fetchResults(searchField.value, nextCursor).then((data) => {
+            tableBody.insertAdjacentHTML('beforeend', renderRows(data.results));
+        });
+    }
+});
@@ -1,12 +1,18 @@
+let myChart = null;
+let trendChart = null;
+
 const renderChart = (data, labels) => {
   var ctx = document.getElementById("myChart").getContext("2d");
-  var myChart = new Chart(ctx, {
+  if (myChart) {
+    myChart.destroy();
+  }
+  myChart = new Chart(ctx, {
     type: "pie",
     data: {
       labels: labels,
       datasets: [
         {
-          label: "Last 6 months expenses",
+          label: "Expenses in period",
           data: data,
           backgroundColor: [
             "rgba(255, 99, 132, 0.2)",
@@ -39,20 +45,48 @@ const renderChart = (data, labels) => {
   });
 };
 
+// One stacked dataset per label, one bar per period
+const renderTrendChart = (periods, labels, series) => {
+  var ctx = document.getElementById("trendChart").getContext("2d");
+  if (trendChart) {
+    trendChart.destroy();
+  }
+  trendChart = new Chart(ctx, {
+    type: "bar",
+    data: {
+      labels: periods,
+      datasets: labels.map((label, index) => ({ label: label, data: series[index] })),
+    },
+    options: {
+      scales: { x: { stacked: true }, y: { stacked: true } },
+    },
+  });
+};
+
+// Fetch the summary for the window and granularity picked in the form
 const getChartData = () => {
-  console.log("fetching");
-  fetch("/expense_category_summary")
+  const params = new URLSearchParams();
+  ["start", "end", "granularity"].forEach((name) => {
+    const field = document.querySelector(`#summary-${name}`);
+    if (field && field.value) {
+      params.append(name, field.value);
+    }
+  });
+
+  fetch(`/expense_category_summary?${params}`)
     .then((res) => res.json())
     .then((results) => {
-      console.log("results", results);
-      const category_data = results.expense_category_data;
-      const [labels, data] = [
-        Object.keys(category_data),
-        Object.values(category_data),
-      ];
-
-      renderChart(data, labels);
+      if (results.error) {
+        console.log("summary error", results.error);
+        return;
+      }
+      renderChart(results.totals, results.labels);
+      renderTrendChart(results.periods, results.labels, results.series);
     });
 };
 
+document.querySelectorAll(".summary-control").forEach((field) => {
+  field.addEventListener("change", getChartData);
+});
+
 document.onload = getChartData();
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Userincome, Source
+from .models import RecurringIncome, SourceRule, Userincome, Source
 
 
 
@@ -7,4 +7,20 @@ from .models import Userincome, Source
 
 
 admin.site.register(Userincome)
-admin.site.register(Source)
\ No newline at end of file
+admin.site.register(Source)
+
+
+class RecurringIncomeAdmin(admin.ModelAdmin):
+    list_display = ('description', 'amount', 'source', 'rule', 'next_date', 'active', 'owner')
+    list_filter = ('active',)
+    list_select_related = ('source', 'owner')
+
+admin.site.register(RecurringIncome, RecurringIncomeAdmin)
+
+
+class SourceRuleAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'pattern', 'source', 'min_amount', 'max_amount', 'priority', 'owner')
+    list_filter = ('kind',)
+    list_select_related = ('source', 'owner')
+
+admin.site.register(SourceRule, SourceRuleAdmin)
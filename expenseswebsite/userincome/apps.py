@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class UserincomeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'userincome'
+
+    def ready(self):
+        from expenses.cache import connect_data_version
+        from expenses.rollups import connect_rollup
+
+        from .models import IncomeMonthlyRollup, Userincome
+
+        connect_rollup(Userincome, IncomeMonthlyRollup, 'source')
+        connect_data_version(Userincome)
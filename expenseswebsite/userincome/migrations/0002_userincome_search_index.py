@@ -0,0 +1,24 @@
+# Generated by Django 4.2.2 on 2026-10-17 09:12
+
+from django.db import migrations
+
+from expenses.search import drop_search_index, install_search_index
+
+
+def create_index(apps, schema_editor):
+    install_search_index(schema_editor, apps.get_model('userincome', 'Userincome')._meta.db_table)
+
+
+def remove_index(apps, schema_editor):
+    drop_search_index(schema_editor, apps.get_model('userincome', 'Userincome')._meta.db_table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userincome', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, remove_index),
+    ]
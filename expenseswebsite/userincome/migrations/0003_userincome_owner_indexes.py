@@ -0,0 +1,21 @@
+# Generated by Django 4.2.2 on 2026-10-17 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userincome', '0002_userincome_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userincome',
+            index=models.Index(fields=['owner', '-date', '-id'], name='income_owner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userincome',
+            index=models.Index(fields=['owner', 'source'], name='income_owner_source_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+from expenses.search import install_search_index
+
+
+def link_sources(apps, schema_editor):
+    Source = apps.get_model('userincome', 'Source')
+    Userincome = apps.get_model('userincome', 'Userincome')
+
+    names = set(Userincome.objects.values_list('source', flat=True).distinct())
+    names -= set(Source.objects.values_list('name', flat=True))
+    Source.objects.bulk_create(Source(name=name) for name in sorted(names))
+
+    Userincome.objects.update(source_ref=Subquery(
+        Source.objects.filter(name=OuterRef('source')).order_by('pk').values('pk')[:1]))
+
+
+def unlink_sources(apps, schema_editor):
+    Source = apps.get_model('userincome', 'Source')
+    Userincome = apps.get_model('userincome', 'Userincome')
+
+    Userincome.objects.update(source=Subquery(
+        Source.objects.filter(pk=OuterRef('source_ref')).values('name')[:1]))
+
+
+def restore_search_index(apps, schema_editor):
+    # SQLite drops the index triggers when a field change rebuilds the table
+    install_search_index(schema_editor, apps.get_model('userincome', 'Userincome')._meta.db_table)
+
+
+# Only adds and fills in the new column; ``0006_userincome_source_swap`` swaps it in. On PostgreSQL the
+# backfill leaves deferred foreign key checks pending until the transaction commits,
+# and a table with pending checks cannot be altered in the same transaction.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userincome', '0004_userincome_amount_minor_units'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.AddField(
+            model_name='userincome',
+            name='source_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='userincome.source'),
+        ),
+        # Nullable so that unapplying can re-add the column before refilling it
+        migrations.AlterField(
+            model_name='userincome',
+            name='source',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        # Before the backfill, which must be the last operation (see above)
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+        migrations.RunPython(link_sources, unlink_sources),
+    ]
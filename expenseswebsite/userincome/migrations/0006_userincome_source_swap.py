@@ -0,0 +1,46 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from expenses.search import install_search_index
+
+
+def restore_search_index(apps, schema_editor):
+    # SQLite drops the index triggers when a field change rebuilds the table
+    install_search_index(schema_editor, apps.get_model('userincome', 'Userincome')._meta.db_table)
+
+
+# Replaces the old source name column with the foreign key filled in by the previous migration
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userincome', '0005_userincome_source_foreign_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.RemoveIndex(
+            model_name='userincome',
+            name='income_owner_source_idx',
+        ),
+        migrations.RemoveField(
+            model_name='userincome',
+            name='source',
+        ),
+        migrations.RenameField(
+            model_name='userincome',
+            old_name='source_ref',
+            new_name='source',
+        ),
+        migrations.AlterField(
+            model_name='userincome',
+            name='source',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='userincome.source'),
+        ),
+        migrations.AddIndex(
+            model_name='userincome',
+            index=models.Index(fields=['owner', 'source'], name='income_owner_source_idx'),
+        ),
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+    ]
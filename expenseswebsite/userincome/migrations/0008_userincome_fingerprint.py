@@ -0,0 +1,31 @@
+# Generated by Django 4.2.2 on 2026-10-17 21:21
+
+from django.db import migrations, models
+
+from expenses.search import install_search_index
+
+
+def restore_search_index(apps, schema_editor):
+    # SQLite drops the index triggers when a field change rebuilds the table
+    install_search_index(schema_editor, apps.get_model('userincome', 'Userincome')._meta.db_table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userincome', '0007_income_monthly_rollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.AddField(
+            model_name='userincome',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='userincome',
+            constraint=models.UniqueConstraint(condition=models.Q(('fingerprint__isnull', False)), fields=('owner', 'fingerprint'), name='income_owner_fingerprint_uniq'),
+        ),
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.2 on 2026-10-17 21:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import expenses.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('userincome', '0008_userincome_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringIncome',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', expenses.fields.MoneyField()),
+                ('description', models.TextField()),
+                ('rule', models.CharField(help_text='e.g. FREQ=MONTHLY;BYMONTHDAY=1', max_length=255)),
+                ('start_date', models.DateField(default=django.utils.timezone.now)),
+                ('next_date', models.DateField(blank=True, editable=False, null=True)),
+                ('occurrences', models.PositiveIntegerField(default=0, editable=False)),
+                ('active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='userincome.source')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['active', 'next_date'], name='recurring_income_due_idx')],
+            },
+        ),
+    ]
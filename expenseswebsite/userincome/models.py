@@ -2,25 +2,40 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils.timezone import now
 
+from expenses.fields import MoneyField
+from expenses.models import LabelRule, RecurringRule
+
 
 
 
 # Create your models here.
 
 class Userincome(models.Model):
-    amount = models.FloatField()
+    amount = MoneyField()
     date = models.DateField(default=now)
     description = models.TextField()
     owner = models.ForeignKey(to=User, on_delete=models.CASCADE)
-    source = models.CharField(max_length=255)
+    source = models.ForeignKey(to='Source', on_delete=models.PROTECT)
+    # Hash identifying a transaction imported from a bank statement, so re-imports skip it
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     def __str__(self):
-        return self.source
+        return str(self.source)
     
 
 
     class Meta:
         ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'fingerprint'], condition=models.Q(fingerprint__isnull=False),
+                                    name='income_owner_fingerprint_uniq'),
+        ]
+        indexes = [
+            # Every list, summary and export filters by owner and sorts/filters by date
+            models.Index(fields=['owner', '-date', '-id'], name='income_owner_date_idx'),
+            models.Index(fields=['owner', 'source'], name='income_owner_source_idx'),
+            models.Index(fields=['owner', 'amount'], name='income_owner_amount_idx'),
+        ]
 
     
 class Source(models.Model):
@@ -28,4 +43,42 @@ class Source(models.Model):
 
    
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class IncomeMonthlyRollup(models.Model):
+    """
+    Running total and count of one owner's income per source and month.
+
+    Kept current by the signal handlers in ``expenses.rollups``; rebuild it with
+    ``manage.py rebuild_rollups`` after writes that bypass them.
+    """
+    owner = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    source = models.ForeignKey(to='Source', on_delete=models.CASCADE)
+    # First day of the month
+    month = models.DateField()
+    total = MoneyField(default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'source', 'month'],
+                                    name='income_rollup_owner_source_month_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'month'], name='income_rollup_owner_month_idx'),
+        ]
+
+
+class RecurringIncome(RecurringRule):
+    source = models.ForeignKey(to='Source', on_delete=models.PROTECT)
+
+    class Meta:
+        indexes = [
+            # materialize_recurring reads the active rules that are due
+            models.Index(fields=['active', 'next_date'], name='recurring_income_due_idx'),
+        ]
+
+
+class SourceRule(LabelRule):
+    source = models.ForeignKey(to='Source', on_delete=models.CASCADE)
@@ -1,3 +1,71 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
 from django.test import TestCase
 
-# Create your tests here.
+from expenses.exports import export_queryset
+from expenses.pagination import LEDGER_ORDERING, seek_filter
+from expenses.summaries import SUMMARY_GRANULARITIES, summary_queryset
+from expenses.tests import MigrationTestCase, QueryPlanMixin, seed_ledger
+
+from .models import Source, Userincome
+
+
+class IncomeQueryPlanTests(QueryPlanMixin, TestCase):
+    """
+    The queries behind the income views must be served from the (owner, ...) indexes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_ledger(Userincome, 'source', ['Salary', 'Business', 'Gift'])[0]
+        cls.source = Source.objects.get(name='Salary')
+
+    def test_index_page(self):
+        income = Userincome.objects.filter(owner=self.user).order_by(*LEDGER_ORDERING)
+        self.assertNoFullScan(income[:6])
+        self.assertNoSort(income[:6])
+        deep = income.filter(seek_filter(LEDGER_ORDERING, [date.today() - timedelta(days=400), 1]))
+        self.assertNoFullScan(deep[:6])
+        self.assertNoSort(deep[:6])
+
+    def test_source_summary(self):
+        today = date.today()
+        for granularity in SUMMARY_GRANULARITIES:
+            self.assertNoFullScan(summary_queryset(Userincome.objects.filter(owner=self.user), 'source',
+                                                   today - timedelta(days=30 * 6), today, granularity))
+
+    def test_source_filter(self):
+        self.assertNoFullScan(Userincome.objects.filter(owner=self.user, source=self.source))
+
+    def test_exports(self):
+        income = Userincome.objects.filter(owner=self.user)
+        self.assertNoFullScan(income)
+        self.assertNoSort(income)
+        rows = export_queryset(income, 'source')
+        self.assertNoFullScan(rows)
+        self.assertNoSort(rows)
+
+
+class SourceForeignKeyMigrationTests(MigrationTestCase):
+    """
+    Migrating a populated table turns the source names into foreign keys, and back.
+    """
+    migrate_from = [('userincome', '0004_userincome_amount_minor_units')]
+    migrate_to = [('userincome', '0006_userincome_source_swap')]
+
+    def test_round_trip(self):
+        owner = self.apps.get_model('auth', 'User').objects.create(username='migrated')
+        self.apps.get_model('userincome', 'Source').objects.create(name='Salary')
+        Userincome = self.apps.get_model('userincome', 'Userincome')
+        for source in ['Salary', 'Gift', 'Salary']:
+            Userincome.objects.create(owner_id=owner.pk, source=source, amount=Decimal('1.50'), description='row')
+
+        apps = self.migrate(self.migrate_to)
+        self.assertEqual(apps.get_model('userincome', 'Source').objects.count(), 2)
+        names = apps.get_model('userincome', 'Userincome').objects.order_by('pk').values_list('source__name', flat=True)
+        self.assertEqual(list(names), ['Salary', 'Gift', 'Salary'])
+
+        apps = self.migrate(self.migrate_from)
+        names = apps.get_model('userincome', 'Userincome').objects.order_by('pk').values_list('source', flat=True)
+        self.assertEqual(list(names), ['Salary', 'Gift', 'Salary'])
@@ -16,5 +16,8 @@ urlpatterns = [
     path('income_export_csv', views.income_export_csv, name="income_export_csv"),
     path('income_export_excel', views.income_export_excel, name="income_export_excel"),
     path('income_export_pdf', views.income_export_pdf, name="income_export_pdf"),
+    path('income_export_columnar', views.income_export_columnar, name="income_export_columnar"),
+    path('income-batch', views.income_batch, name="income_batch"),
+    path('income_import_csv', views.income_import_csv, name="income_import_csv"),
     
 ]
\ No newline at end of file
@@ -1,47 +1,60 @@
 from django.shortcuts import render, redirect
+from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
-from .models import Source, Userincome
-from django.core.paginator import Paginator
+from .models import IncomeMonthlyRollup, Source, SourceRule, Userincome
 from userpreferences.models import UserPreference
 from django.contrib import messages
+from django.core.exceptions import ValidationError
+import codecs
 import json
-from django.http import JsonResponse, HttpResponse
+from django.http import FileResponse, JsonResponse
 from datetime import *
-from django.utils import timezone
 
 # Usage example
 # date_str = '2023-06-18'
 # date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
 
-# csv file conversion utility import
-import csv
-# Excelfile conversion utility import
-import xlwt
-# pdf file conversion utility import
-from django.template.loader import render_to_string
-from weasyprint import HTML
-import tempfile
-from django.db.models import Sum
+from expenses.batch import InvalidBatch, apply_batch
+from expenses.cache import cached_artifact, cached_for_user, conditional_on_ledger
+from expenses.categorize import rule_set
+from expenses.exports import (COLUMNAR_FORMATS, XLSX_CONTENT_TYPE, InvalidExportFilter, accepted_encoding,
+                              export_filename, filter_ledger, ledger_rows, stream_csv, write_columnar, write_pdf,
+                              write_xlsx)
+from expenses.imports import InvalidImportFile, import_csv
+from expenses.pagination import InvalidCursor, KeysetPaginator, get_page_size
+from expenses.search import search_ledger, search_page
+from expenses.summaries import InvalidSummaryRequest, ledger_summary, summary_window
+
+# Columns the income table shows, and so the only ones search returns
+INCOME_SEARCH_FIELDS = {
+    'id': 'id',
+    'amount': 'amount',
+    'source': 'source__name',
+    'description': 'description',
+    'date': 'date',
+}
 
 # Search income
 def search_income(request):
     """
     View function for searching income.
 
-    Searches income based on the provided search text in the request body.
+    Searches income based on the provided search text in the request body,
+    using the full-text index for descriptions, best matches first. The body
+    may also carry ``cursor``, ``pageSize`` and ``fields``.
 
     :param request: The HTTP request object.
-    :return: JSON response with the search results.
+    :return: JSON response with one page of results and the next page's cursor.
     """
     if request.method == 'POST':
-        search_str = json.loads(request.body).get('searchText')
-        income = Userincome.objects.filter(
-            amount__istartswith=search_str, owner=request.user) | Userincome.objects.filter(
-            date__istartswith=search_str, owner=request.user) | Userincome.objects.filter(
-            description__icontains=search_str, owner=request.user) | Userincome.objects.filter(
-            source__icontains=search_str, owner=request.user)
-        data = income.values()
-        return JsonResponse(list(data), safe=False)
+        params = json.loads(request.body)
+        income = search_ledger(Userincome.objects.filter(owner=request.user),
+                               params.get('searchText'), 'source', Source)
+        try:
+            data = search_page(income, params, INCOME_SEARCH_FIELDS)
+        except InvalidCursor as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        return JsonResponse(data)
 
 # Index page
 @login_required(login_url='/authentication/login')
@@ -49,23 +62,29 @@ def index(request):
     """
     View function for the income index page.
 
-    Renders the income index page with income data.
+    Renders the income index page with income data, one keyset page
+    (``after``/``before`` cursor, ``per_page`` rows) at a time.
 
     :param request: The HTTP request object.
     :return: Rendered HTML template for the income index page.
     """
     sources = Source.objects.all()
-    income = Userincome.objects.filter(owner=request.user)
-    paginator = Paginator(income, 5)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    income = Userincome.objects.filter(owner=request.user).select_related('source')
+    per_page = get_page_size(request)
+    paginator = KeysetPaginator(income, per_page)
+    after, before = request.GET.get('after'), request.GET.get('before')
+    if after or before:
+        page_obj = paginator.get_page(after, before)
+    else:
+        # The first page is what almost every visit shows
+        page_obj = cached_for_user(request.user.pk, 'income-index', [per_page], paginator.page)
     try:
         currency = UserPreference.objects.get(user=request.user).currency
     except UserPreference.DoesNotExist:
         currency = 'USD'
     context = {
-        'income': income,
         'page_obj': page_obj,
+        'per_page': per_page,
         'currency': currency
     }
     return render(request, 'income/index.html', context)
@@ -94,16 +113,32 @@ def add_income(request):
         amount = request.POST['amount']
         description = request.POST['description']
         date_str = request.POST['income_date']
-        source = request.POST['source']
+        source_id = request.POST.get('source', '')
+        source = Source.objects.filter(pk=source_id).first() if source_id.isdigit() else None
 
         if not amount:
             messages.error(request, 'Amount is required')
             return render(request, 'income/add_income.html', context)
 
+        try:
+            amount = Userincome._meta.get_field('amount').to_python(amount)
+        except ValidationError:
+            messages.error(request, 'Amount must be a number')
+            return render(request, 'income/add_income.html', context)
+
         if not description:
             messages.error(request, 'Description is required')
             return render(request, 'income/add_income.html', context)
 
+        if not source:
+            # Left to the owner's categorization rules
+            source_id = rule_set(SourceRule, 'source', request.user.pk).categorize(description, amount)
+            source = Source.objects.filter(pk=source_id).first() if source_id else None
+
+        if not source:
+            messages.error(request, 'Source is required')
+            return render(request, 'income/add_income.html', context)
+
         try:
             date = datetime.strptime(date_str, '%Y-%m-%d').date()
         except ValueError:
@@ -137,18 +172,21 @@ def income_edit(request, id):
         amount = request.POST.get('amount')
         description = request.POST.get('description')
         date_str = request.POST.get('income_date')
-        source = request.POST.get('source')
+        source_id = request.POST.get('source', '')
+        source = Source.objects.filter(pk=source_id).first() if source_id.isdigit() else None
 
         if not amount:
             messages.error(request, 'Amount is required!')
         elif not description:
             messages.error(request, 'Description is required!')
+        elif not source:
+            messages.error(request, 'Source is required!')
         elif not date_str:
             messages.error(request, 'Date is required!')
         else:
             try:
                 date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                income.amount = amount
+                income.amount = Userincome._meta.get_field('amount').to_python(amount)
                 income.description = description
                 income.date = date
                 income.source = source
@@ -157,6 +195,8 @@ def income_edit(request, id):
                 return redirect('income')
             except ValueError:
                 messages.error(request, 'Invalid date format! The date must be in YYYY-MM-DD format.')
+            except ValidationError:
+                messages.error(request, 'Amount must be a number!')
 
     context = {
         'income': income,
@@ -182,31 +222,29 @@ def delete_income(request, id):
     return redirect('income')
 
 # Income source summary
+@conditional_on_ledger
 def income_source_summary(request):
     """
     View function for generating income source summary.
 
-    Calculates the total income for each income source in the last six months.
+    Calculates the total income per source and period in the database, over
+    the ``start``/``end`` window (default: the last six months) bucketed by
+    ``granularity`` (day, week, month or year). Monthly and yearly summaries
+    are read from the monthly rollups.
 
     :param request: The HTTP request object.
-    :return: JSON response with the income source data.
+    :return: JSON response with the summary arrays, or an error with status 400.
     """
-    today = date.today()
-    six_months_ago = today - timedelta(days=30*6)
-
-    userincome = Userincome.objects.filter(owner=request.user,
-                                      date__gte=six_months_ago,
-                                      date__lte=today)
-
-    finalrep = {}
-    for income in userincome:
-        source = income.source
-        if source in finalrep:
-            finalrep[source] += income.amount
-        else:
-            finalrep[source] = income.amount
+    try:
+        start, end, granularity = summary_window(request.GET)
+    except InvalidSummaryRequest as error:
+        return JsonResponse({'error': str(error)}, status=400)
 
-    return JsonResponse({'income_source_data': finalrep}, safe=False)
+    userincome = Userincome.objects.filter(owner=request.user)
+    rollups = IncomeMonthlyRollup.objects.filter(owner=request.user)
+    summary = cached_for_user(request.user.pk, 'income-summary', [start, end, granularity],
+                              lambda: ledger_summary(userincome, 'source', start, end, granularity, rollups))
+    return JsonResponse(summary)
 
 # Income statistics view
 def income_stats_view(request):
@@ -221,107 +259,134 @@ def income_stats_view(request):
     return render(request, 'income/income_stats.html')
 
 # Export income to CSV
+@conditional_on_ledger
 def income_export_csv(request):
     """
     View function for exporting income data to CSV.
 
-    Generates a CSV file with the income data.
+    Streams a CSV file with the income data as rows are read from the database,
+    compressed on the fly when the client's ``Accept-Encoding`` allows.
 
     :param request: The HTTP request object.
-    :return: HTTP response with the CSV file.
+    :return: Streaming HTTP response with the CSV file.
     """
-    now = timezone.now().strftime('%Y-%m-%d_%H-%M-%S')  # Format the current datetime
-    filename = 'Expenses_{}.csv'.format(now)
-
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'inline; attachment; filename="{}"'.format(filename)
-
-    writer = csv.writer(response)
-    writer.writerow(['AMOUNT', 'DESCRIPTION', 'CATEGORY', 'DATE'])
-
-    incomes = Userincome.objects.filter(owner=request.user)
-
-    for income in incomes:
-        writer.writerow([income.amount, income.description, income.source, income.date])
-
-    return response
+    income = Userincome.objects.filter(owner=request.user)
+    return stream_csv(ledger_rows(income, 'source'), export_filename('Income', 'csv'),
+                      encoding=accepted_encoding(request))
 
 # Export income to Excel
+@conditional_on_ledger
 def income_export_excel(request):
     """
     View function for exporting income data to Excel.
 
-    Generates an Excel file with the income data.
+    Generates an .xlsx file with the income data and its total, cached until
+    the user's income changes.
 
     :param request: The HTTP request object.
-    :return: HTTP response with the Excel file.
+    :return: File response with the Excel file.
     """
-    import datetime
-
-    response = HttpResponse(content_type='application/ms-excel')
-    current_datetime = datetime.datetime.now()
-    file_name = 'Incomes_' + current_datetime.strftime('%Y-%m-%d_%H-%M-%S') + '.xls'
-    response['Content-Disposition'] = 'inline; attachment; filename=' + file_name
-
-    wb = xlwt.Workbook(encoding='utf-8')
-    ws = wb.add_sheet('Incomes')
-    row_num = 0
-    font_style = xlwt.XFStyle()
-    font_style.font.bold = True
-
-    columns = ['AMOUNT', 'DESCRIPTION', 'CATEGORY', 'DATE']
-
-    for col_num in range(len(columns)):
-        ws.write(row_num, col_num, columns[col_num], font_style)
-
-    font_style = xlwt.XFStyle()
-
-    rows = Userincome.objects.filter(owner=request.user).values_list(
-        'amount', 'description', 'source', 'date')
-
-    for row in rows:
-        row_num += 1
-
-        for col_num in range(len(row)):
-            ws.write(row_num, col_num, str(row[col_num]), font_style)
+    income = Userincome.objects.filter(owner=request.user)
+    output = cached_artifact(request.user.pk, 'income-xlsx', [],
+                             lambda output: write_xlsx(ledger_rows(income, 'source'), output, 'Income'))
+    return FileResponse(output, as_attachment=True, filename=export_filename('Income', 'xlsx'),
+                        content_type=XLSX_CONTENT_TYPE)
+
+# Export income as Parquet / Arrow
+@conditional_on_ledger
+def income_export_columnar(request):
+    """
+    View function for exporting income data as a Parquet file or Arrow IPC stream.
 
-    wb.save(response)
+    ``format`` is ``parquet`` (default) or ``arrow``; ``start``, ``end``,
+    ``label`` (source name, repeatable), ``min_amount`` and ``max_amount``
+    narrow the rows in the database query. Rendered files are cached per set
+    of parameters until the user's income changes.
 
-    return response
+    :param request: The HTTP request object.
+    :return: File response with the typed columnar file, or a JSON error.
+    """
+    export_format = request.GET.get('format', 'parquet')
+    if export_format not in COLUMNAR_FORMATS:
+        return JsonResponse({'error': 'format must be one of: {}'.format(', '.join(COLUMNAR_FORMATS))}, status=400)
+    try:
+        income = filter_ledger(Userincome.objects.filter(owner=request.user), 'source', request.GET)
+        output = cached_artifact(
+            request.user.pk, 'income-columnar', sorted(request.GET.lists()),
+            lambda output: write_columnar(ledger_rows(income, 'source'), output, export_format, 'source'))
+    except InvalidExportFilter as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    except ImportError:
+        return JsonResponse({'error': 'Columnar exports need pyarrow installed'}, status=501)
+
+    extension, content_type = COLUMNAR_FORMATS[export_format]
+    return FileResponse(output, as_attachment=True, filename=export_filename('Income', extension),
+                        content_type=content_type)
 
 # Export income to PDF
+@conditional_on_ledger
 def income_export_pdf(request):
     """
     View function for exporting income data to PDF.
 
-    Generates a PDF file with the income data.
+    Generates a PDF file with the income data, rendering large ledgers in
+    parallel parts that are joined. The document is cached until the user's
+    income changes.
 
     :param request: The HTTP request object.
-    :return: HTTP response with the PDF file.
+    :return: File response with the PDF file.
     """
-    import datetime
-
-    response = HttpResponse(content_type='application/pdf')
-    current_datetime = datetime.datetime.now()
-    file_name = 'Incomes_' + current_datetime.strftime('%Y-%m-%d_%H-%M-%S') + '.pdf'
-    response['Content-Disposition'] = 'inline; filename=' + file_name
-
-    response['Content-Transfer-Encoding'] = 'binary'
+    income = Userincome.objects.filter(owner=request.user)
+    output = cached_artifact(
+        request.user.pk, 'income-pdf', [],
+        lambda output: write_pdf(income, 'source', 'income/pdf-output.html', 'incomes', output))
+    return FileResponse(output, filename=export_filename('Income', 'pdf'), content_type='application/pdf')
 
-    incomes = Userincome.objects.filter(owner=request.user)
+# Apply a batch of income changes
+@login_required(login_url='/authentication/login')
+@require_POST
+def income_batch(request):
+    """
+    View function for applying many income changes in one request.
 
-    total = incomes.aggregate(Sum('amount'))
+    The JSON body is ``{"operations": [...]}`` where each operation is
+    ``{"op": "create", "amount", "description", "source", "date"}``,
+    ``{"op": "update", "id", ...changed fields}`` or ``{"op": "delete", "id"}``
+    (``source`` is a source id). All operations are applied in one
+    transaction, or none if any is invalid.
 
-    html_string = render_to_string(
-        'income/pdf-output.html', {'incomes': incomes, 'total': total['amount__sum']})
-    html = HTML(string=html_string)
+    :param request: The HTTP request object.
+    :return: JSON response with one result per operation, with status 400 if nothing was applied.
+    """
+    try:
+        operations = json.loads(request.body).get('operations')
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'The body must be a JSON object'}, status=400)
+    try:
+        applied, results = apply_batch(request.user, 'income', operations)
+    except InvalidBatch as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({'applied': applied, 'results': results}, status=200 if applied else 400)
 
-    result = html.write_pdf()
+# Import income from CSV
+@login_required(login_url='/authentication/login')
+@require_POST
+def income_import_csv(request):
+    """
+    View function for importing income from an uploaded CSV file.
 
-    with tempfile.NamedTemporaryFile(delete=True) as output:
-        output.write(result)
-        output.flush()
-        output = open(output.name, 'rb')
-        response.write(output.read())
+    The file (form field ``file``) uses the layout of the CSV export. Valid
+    rows are inserted in batches and missing sources are created; invalid rows
+    are skipped and reported.
 
-    return response
+    :param request: The HTTP request object.
+    :return: JSON response with the number of rows created and the row errors, or an error with status 400.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'A CSV file is required'}, status=400)
+    try:
+        report = import_csv(request.user, 'income', codecs.iterdecode(upload, 'utf-8-sig'))
+    except InvalidImportFile as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse(report)